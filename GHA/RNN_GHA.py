@@ -13,9 +13,10 @@ from tensorflow.keras.optimizers import Adam, SGD, RMSprop, Adagrad, Adadelta, A
 
 
 from tools.dicts import load_dict, focussed_dict_print, print_nested_round_floats
-from tools.RNN_STM import get_label_seqs, get_test_scores, get_layer_acts
+from tools.RNN_STM import get_label_seqs, get_test_scores, get_all_layer_acts
 from tools.RNN_STM import seq_items_per_class, spell_label_seqs
 from tools.data import find_path_to_dir, running_on_laptop, switch_home_dirs
+from models.rnns import rnn_custom_objects
 
 
 def kernel_to_2d(layer_activation_4d, reduce_type='max', verbose=False):
@@ -193,13 +194,14 @@ def rnn_gha(sim_dict_path,
     model_name = sim_dict['model_info']['overview']['trained_model']
 
     if os.path.isfile(model_name):
-        loaded_model = load_model(model_name)
+        loaded_model = load_model(model_name, custom_objects=rnn_custom_objects)
     else:
         training_dir, sim_dict_name = os.path.split(sim_dict_path)
         print(f"training_dir: {training_dir}\n"
               f"sim_dict_name: {sim_dict_name}")
         if os.path.isfile(os.path.join(training_dir, model_name)):
-            loaded_model = load_model(os.path.join(training_dir, model_name))
+            loaded_model = load_model(os.path.join(training_dir, model_name),
+                                      custom_objects=rnn_custom_objects)
 
     loaded_model.trainable = False
 
@@ -416,6 +418,19 @@ def rnn_gha(sim_dict_path,
     print("\n**** Get Hidden unit activations ****")
     hid_acts_dict = dict()
 
+    # # get acts for all key layers with one predict
+    record_layers = [row['name'] for index, row in key_layers_df.iterrows()
+                     if row['name'] in get_layer_list and not (test_run and index > 3)]
+    layer_acts_dict = get_all_layer_acts(model=loaded_model,
+                                         layer_names=record_layers,
+                                         data_dict=data_dict,
+                                         test_label_seqs=test_label_seqs,
+                                         serial_recall=serial_recall,
+                                         end_seq_cue=end_seq_cue,
+                                         batch_size=batch_size,
+                                         verbose=verbose
+                                         )
+
     # # loop through key layers df
     gha_key_layers = []
     for index, row in key_layers_df.iterrows():
@@ -432,15 +447,7 @@ def rnn_gha(sim_dict_path,
 
         else:
             # record hid acts
-            layer_activations = get_layer_acts(model=loaded_model,
-                                               layer_name=layer_name,
-                                               data_dict=data_dict,
-                                               test_label_seqs=test_label_seqs,
-                                               serial_recall=serial_recall,
-                                               end_seq_cue=end_seq_cue,
-                                               batch_size=batch_size,
-                                               verbose=verbose
-                                               )
+            layer_activations = layer_acts_dict[layer_name]
 
             layer_acts_shape = np.shape(layer_activations)
 
@@ -12,7 +12,7 @@ from tensorflow.keras.models import load_model
 from tensorflow.keras.models import Model
 
 from tools.dicts import load_dict, focussed_dict_print, print_nested_round_floats
-from tools.data import load_x_data, load_y_data, get_dset_path
+from tools.data import load_x_data, load_y_data, get_dset_path, x_data_batches
 from tools.network import get_scores
 
 
@@ -189,11 +189,12 @@ def ff_gha(sim_dict_path,
                 print(f"NEW x_size: {x_size}")
 
     # Preprocess the data (these are NumPy arrays)
+    # # x_data is memory-mapped, it is converted to float32 (and scaled) a batch at a time
+    gha_batch_size = 32
+    x_scale = None
     if x_data.dtype == "uint8":
-        print(f"converting input data from {x_data.dtype} to float32")
-        max_x = np.amax(x_data)
-        x_data = x_data.astype("float32") / max_x
-        print(f"x_data.dtype: {x_data.dtype}")
+        print(f"converting input data from {x_data.dtype} to float32 (per batch)")
+        x_scale = np.amax(x_data)
 
     # Output files
     output_filename = sim_dict["topic_info"]["output_filename"]
@@ -287,7 +288,8 @@ def ff_gha(sim_dict_path,
     print(f"saving hid_acts to: {gha_path}")
 
     # # # PART 3 get_scores() # # #
-    predicted_outputs = loaded_model.predict(x_data)
+    predicted_outputs = loaded_model.predict(x_data_batches(x_data, batch_size=gha_batch_size, scale=x_scale),
+                                             steps=int(np.ceil(len(x_data) / gha_batch_size)))
 
     item_correct_df, scores_dict, incorrect_items = get_scores(predicted_outputs, y_df, output_filename,
                                                                save_all_csvs=True, verbose=True)
@@ -332,7 +334,9 @@ def ff_gha(sim_dict_path,
 
             # model to record hid acts
             intermediate_layer_model = Model(inputs=model.input, outputs=model.get_layer(layer_name).output)
-            intermediate_output = intermediate_layer_model.predict(gha_items, verbose=1)
+            intermediate_output = intermediate_layer_model.predict(
+                x_data_batches(gha_items, batch_size=gha_batch_size, scale=x_scale),
+                steps=int(np.ceil(len(gha_items) / gha_batch_size)), verbose=1)
             layer_acts_shape = np.shape(intermediate_output)
 
             if save_2d_layers:
@@ -16,10 +16,16 @@ from sklearn.metrics import roc_curve, auc
 
 from tools.dicts import load_dict, focussed_dict_print, print_nested_round_floats
 from tools.dicts import nested_dict_to_df
-from tools.RNN_STM import get_X_and_Y_data_from_seq, seq_items_per_class
+from tools.RNN_STM import get_vocab_tables, encode_label_seqs, seq_items_per_class
 from tools.RNN_STM import spell_label_seqs, word_letter_combo_dict
-from tools.data import nick_read_csv, find_path_to_dir
+from tools.data import nick_read_table, find_path_to_dir
 from tools.network import loop_thru_acts
+from Selectivity.sel_store import open_sel_store, append_unit_sel, get_already_completed
+from Selectivity.sel_store import sel_store_to_pickles
+from Selectivity.sel_table import sel_dict_to_table, sel_store_to_table, save_sel_table
+from Selectivity.sel_kernels import unit_perm_test, permute_labels, perm_measures
+from Selectivity.sel_kernels import tensor_sel, tensor_sel_max, default_zhou_selects
+from Selectivity.sel_kernels import tensor_letters_sel
 
 
 '''This script uses shelve instead of pickle for sel_p_unit dict.
@@ -120,6 +126,23 @@ def nick_roc_stuff(class_list, hid_acts, this_class, class_a_size, not_a_size,
     return roc_sel_dict
 
 
+def get_zhou_selects(n_correct, IPC_letters):
+    """
+    Number of most active items to use for zhou_prec.
+
+    :param n_correct: number of items
+    :param IPC_letters: items per letter at this timestep
+
+    :return: zhou_selects
+    """
+    zhou_selects = default_zhou_selects(n_correct)
+    if 9 < min(IPC_letters.values()) < 100:
+        zhou_selects = min(IPC_letters.values())
+    if zhou_selects < min(IPC_letters.values()):
+        zhou_selects = min(IPC_letters.values())
+    return zhou_selects
+
+
 def class_correlation(this_unit_acts, output_acts, verbose=False):
     """
     from: Revisiting the Importance of Individual Units in CNNs via Ablation
@@ -1116,6 +1139,8 @@ def count_sel_units(word_sel_dict_path, measure='b_sel',
 def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
             save_output_to='pickle',
             letter_sel=False,
+            n_perms=0, perm_seed=None,
+            batch_timesteps=False,
             verbose=False, test_run=False):
     """
     Analyse hidden unit activations.
@@ -1139,9 +1164,19 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
     :param all_classes: Whether to test for selectivity of all classes or a subset
                         (e.g., most active classes)
     :param letter_sel: if False, test sel for words (class-labels).
-            If True, test for letters (parts) using 'local_word_X' for each word when looping through classes
+            If True, test for letters (parts) using 'local_word_X' for each word.
+            Letters are always done a whole layer at a time (all letters and units, as batch_timesteps).
     :param verbose: how much to print to screen
-    :param save_output_to: file-type to use, deault piclke
+    :param save_output_to: file-type to use, default 'pickle'.  Or 'shelve', or
+                            'sqlite' (rows appended per unit/timestep, pickles written once at the end).
+    :param n_perms: if > 0, permutation test for max_informed, ccma and b_sel with this many
+                    label shuffles (word sel only).  Adds p-values and permutation-corrected
+                    max sel to max_sel_p_unit.
+    :param perm_seed: seed for the label shuffles (reproducible p-values)
+    :param batch_timesteps: if True, each layer is analysed as an (items, timesteps, units)
+                    tensor with tensor_sel() (or tensor_letters_sel()), rather than
+                    one unit/timestep/class at a time.  Same values as nick_roc_stuff() etc,
+                    including the roc_curve thresholds it drops (max_info_count, ave_prec, pr_auc).
     :param test_run: if True, only do subset, e.g., 3 units from 3 layers
 
     :return: master dict: contains 'sel_path' (e.g., dir),
@@ -1278,22 +1313,10 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
         # # get 1hot item vectors for 'words' and 3 hot for letters
         '''Always use serial_recall True. as I want a separate 1hot vector for each item.
         Always use x_data_type 'local_letter_X' as I want 3hot vectors'''
-        y_letters = []
-        y_words = []
-        for this_seq in test_label_seqs:
-            get_letters, get_words = get_X_and_Y_data_from_seq(vocab_dict=vocab_dict,
-                                                               seq_line=this_seq,
-                                                               serial_recall=True,
-                                                               end_seq_cue=False,
-                                                               x_data_type='local_letter_X')
-            y_letters.append(get_letters)
-            y_words.append(get_words)
-
-
-            # print(f"\nthis_seq: {this_seq}\nget_letters: {get_letters}\nget_words: {get_words}\n")
-
-        y_letters = np.array(y_letters)
-        y_words = np.array(y_words)
+        y_letters, y_words = encode_label_seqs(test_label_seqs, get_vocab_tables(vocab_dict),
+                                               serial_recall=True,
+                                               end_seq_cue=False,
+                                               x_data_type='local_letter_X')
         if verbose:
             print(f"\ny_letters: {type(y_letters)}  {np.shape(y_letters)}")
             print(f"y_words: {type(y_words)}  {np.shape(y_words)}")
@@ -1318,7 +1341,7 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
         # # load item_correct (y_data)
         item_correct_name = gha_dict['GHA_info']['scores_dict']['item_correct_name']
         # y_df = pd.read_csv(item_correct_name)
-        y_scores_df = nick_read_csv(item_correct_name)
+        y_scores_df = nick_read_table(item_correct_name)
 
     """# # get rid of incorrect items if required"""
     print("\n\nRemoving incorrect responses")
@@ -1490,7 +1513,20 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
     all_sel_dict = dict()
     max_sel_dict = dict()
 
-    if save_output_to is 'pickle':
+    if save_output_to == 'sqlite':
+        all_sel_dict_name = f"{sel_path}/{output_filename}_sel_per_unit.pickle"
+        max_sel_dict_name = f"{sel_path}/{output_filename}_max_sel_p_unit.pickle"
+        sel_store_name = f"{sel_path}/{output_filename}_sel_store.db"
+
+        # # append-only store: resume is just a lookup of completed units
+        sel_store = open_sel_store(sel_store_name, verbose=verbose)
+        if sequence_data:
+            already_completed = get_already_completed(sel_store, timesteps=timesteps,
+                                                      verbose=verbose)
+        else:
+            already_completed = get_already_completed(sel_store, verbose=verbose)
+
+    if save_output_to == 'pickle':
         all_sel_dict_name = f"{sel_path}/{output_filename}_sel_per_unit.pickle"
         max_sel_dict_name = f"{sel_path}/{output_filename}_max_sel_p_unit.pickle"
 
@@ -1511,7 +1547,7 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
                 max_unit = max(unit_list)
                 already_completed[key] = max_unit
 
-    if save_output_to is 'shelve':
+    if save_output_to == 'shelve':
         all_sel_dict_name = f"{sel_path}/{output_filename}_sel_per_unit"
         max_sel_dict_name = f"{sel_path}/{output_filename}_max_sel_p_unit"
 
@@ -1542,16 +1578,108 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
 
 
 
-    '''
-    part 3   - get gha for each unit
-    '''
-    loop_gha = loop_thru_acts(gha_dict_path=gha_dict_path,
-                              correct_items_only=correct_items_only,
-                              letter_sel=letter_sel,
-                              already_completed=already_completed,
-                              verbose=verbose,
-                              test_run=test_run
-                              )
+    if letter_sel and not batch_timesteps:
+        print("letter sel runs all letters and units of a layer at once (batch_timesteps=True)")
+        batch_timesteps = True
+
+    if batch_timesteps:
+        '''
+        part 3 (batched) - get gha for each layer, all units and timesteps in one go
+        '''
+        ts_zhou_selects = [get_zhou_selects(n_correct, IPC_dict['letter_p_class_p_ts'][f"ts{ts}"])
+                           for ts in range(timesteps)]
+
+        output_layer_acts = None
+        if y_1hot:
+            output_layer_acts = np.load(output_acts_name, mmap_mode='r')
+
+        loop_layers = loop_thru_acts(gha_dict_path=gha_dict_path,
+                                     correct_items_only=correct_items_only,
+                                     letter_sel=letter_sel,
+                                     already_completed=already_completed,
+                                     yield_layers=True,
+                                     verbose=verbose,
+                                     test_run=test_run
+                                     )
+
+        for layer_gha in loop_layers:
+            layer_name = layer_gha['layer_name']
+            run_units = layer_gha['units']
+            if not run_units:
+                continue
+            print(f"\nrunning {len(run_units)} units from {layer_name} as one tensor")
+
+            layer_acts = layer_gha['hid_acts'][:, :, run_units]
+            if layer_gha['rows'] is not None:
+                layer_acts = layer_acts[layer_gha['rows']]
+            live_units = np.sum(layer_acts, axis=(0, 1)) != 0
+
+            if letter_sel:
+                layer_sel = tensor_letters_sel(layer_acts[:, :, live_units], y_letters,
+                                               act_func=layer_gha['act_func'],
+                                               zhou_selects=ts_zhou_selects,
+                                               verbose=verbose)
+            else:
+                layer_sel = tensor_sel(layer_acts[:, :, live_units], layer_gha['labels'], n_cats,
+                                       act_func=layer_gha['act_func'],
+                                       zhou_selects=ts_zhou_selects,
+                                       output_acts=output_layer_acts,
+                                       verbose=verbose)
+            layer_max = tensor_sel_max(layer_sel)
+
+            for live_index, unit_index in enumerate(np.array(run_units)[live_units]):
+                unit_index = int(unit_index)
+                for timestep in range(timesteps):
+                    ts_name = f"ts{timestep}"
+
+                    unit_ts_dict = dict()
+                    for measure, values in layer_sel.items():
+                        class_values = values[timestep, live_index].tolist()
+                        if measure in ['means', 'sd'] and not letter_sel:
+                            # # as class_sel_basics, only classes with items
+                            unit_ts_dict[measure] = {k: v for k, v in enumerate(class_values)
+                                                     if not np.isnan(v)}
+                        else:
+                            unit_ts_dict[measure] = dict(enumerate(class_values))
+                    max_sel_p_unit_dict = {k: v[timestep, live_index].item()
+                                           for k, v in layer_max.items()}
+
+                    if save_output_to == 'sqlite':
+                        append_unit_sel(sel_store, layer_name=layer_name, unit_index=unit_index,
+                                        timestep=timestep, unit_ts_dict=unit_ts_dict,
+                                        max_sel_p_unit_dict=max_sel_p_unit_dict)
+                    else:
+                        all_sel_dict.setdefault(layer_name, dict()).setdefault(
+                            unit_index, dict())[ts_name] = unit_ts_dict
+                        max_sel_dict.setdefault(layer_name, dict()).setdefault(
+                            unit_index, dict())[ts_name] = max_sel_p_unit_dict
+
+            # # save layer to disk
+            if save_output_to == 'pickle':
+                with open(all_sel_dict_name, "wb") as pickle_out:
+                    pickle.dump(all_sel_dict, pickle_out, protocol=pickle.HIGHEST_PROTOCOL)
+                with open(max_sel_dict_name, "wb") as pickle_out:
+                    pickle.dump(max_sel_dict, pickle_out, protocol=pickle.HIGHEST_PROTOCOL)
+            if save_output_to == 'shelve':
+                with shelve.open(all_sel_dict_name, protocol=pickle.HIGHEST_PROTOCOL) as db:
+                    db['all_sel_dict'] = all_sel_dict
+                    db['max_sel_dict'] = max_sel_dict
+            print(f"saved {layer_name} to disk")
+
+        # # nothing left to do per unit
+        loop_gha = []
+
+    else:
+        '''
+        part 3   - get gha for each unit
+        '''
+        loop_gha = loop_thru_acts(gha_dict_path=gha_dict_path,
+                                  correct_items_only=correct_items_only,
+                                  letter_sel=letter_sel,
+                                  already_completed=already_completed,
+                                  verbose=verbose,
+                                  test_run=test_run
+                                  )
 
     for index, unit_gha in enumerate(loop_gha):
 
@@ -1581,7 +1709,6 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
         unit_index = unit_gha["unit_index"]
         timestep = unit_gha["timestep"]
         ts_name = f"ts{timestep}"
-        item_act_label_array = unit_gha["item_act_label_array"]
         IPC_words = IPC_dict['word_p_class_p_ts'][ts_name]
         IPC_letters = IPC_dict['letter_p_class_p_ts'][ts_name]
 
@@ -1595,11 +1722,10 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
 
 
 
-        # #  make df
-        this_unit_acts = pd.DataFrame(data=item_act_label_array,
-                                      columns=['item', 'activation', 'label'])
-        this_unit_acts_df = this_unit_acts.astype(
-            {'item': 'int32', 'activation': 'float', 'label': 'int32'})
+        # #  make df (straight from the unit record, no item_act_label_array)
+        this_unit_acts_df = pd.DataFrame({'item': unit_gha.item_index.astype('int32'),
+                                          'activation': unit_gha.acts.astype('float'),
+                                          'label': unit_gha.labels.astype('int32')})
 
         print(f"unit_index, ts: {unit_index}, {ts_name}")
         if verbose:
@@ -1627,19 +1753,6 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
 
         # sort by descending hid act values (per item)
         this_unit_acts_df = this_unit_acts_df.sort_values(by='activation', ascending=False)
-        if letter_sel:
-            sorted_items = this_unit_acts_df['item'].to_list()
-            sorted_idx = list(range(len(sorted_items)))
-
-            # # unsort sorted_idx back into order of ascending items
-            unsorted_order = [b for a, b in sorted(zip(sorted_items, sorted_idx))]
-
-            # # put y_letters into same order as sorted_items
-            y_letters_1ts = [b for a, b in sorted(zip(unsorted_order, y_letters_1ts))]
-            y_letters_1ts = np.array(y_letters_1ts)
-            # print(f"y_letters_1ts: {y_letters_1ts}")
-            if verbose:
-                print(f"np.shape(y_letters_1ts): {np.shape(y_letters_1ts)}")
 
 
         # # # always normalize to range [0, 1] activations if relu
@@ -1694,59 +1807,13 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
         if verbose:
             print('\n**** cycle through classes ****')
 
-        cycle_this = range(len(classes_of_interest))
-        if letter_sel:
-            cycle_this = range(n_letters)
-
-        for this_cat in cycle_this:
-
-            if letter_sel:
-                this_letter = letter_id_dict[this_cat]
-                print(f"\nthis_cat: {this_cat} this_letter: {this_letter}")
-                if this_letter in IPC_letters:
-                    this_class_size = IPC_letters[this_letter]
-                else:
-                    this_class_size = 0
-                not_a_size = n_correct - this_class_size
-
-                # # make binary letter class list
-                letter_class_list = y_letters_1ts[:, this_cat]
-
-                # print(f"\n idiot check\n"
-                #       f"y_letters: {y_letters.shape}\n{list(y_letters)}"
-                #       f"\ny_letters_1ts: {y_letters_1ts.shape}\n{list(y_letters_1ts)}"
-                #
-                #       # f"y_letters_1ts\n{list(y_letters_1ts)}\n"
-                #       f"original lettter class list\n{letter_class_list}\n"
-                #       f"this_letter: {this_letter}, this_class_size: {this_class_size}, not_a_size: {not_a_size}\n"
-                #       f"{this_unit_acts_df.sort_values(by='words')}\n"
-                #       f"")
-
-                # # changes '1's to this_cat
-                # print(f"letter_class_list: {letter_class_list}")
-
-                not_this_letter_symbol = 0
-
-                if this_cat == 0:
-                    not_this_letter_symbol = -4
-                    letter_class_list = [this_cat if i == 1 else not_this_letter_symbol
-                                         for i in np.array(letter_class_list)]
-                else:
-                    letter_class_list = [this_cat if i == 1 else not_this_letter_symbol
-                                         for i in np.array(letter_class_list)]
-                if verbose:
-                    print(f"letter_class_list: {letter_class_list}")
-                    # print(f"letter_class_list: {np.shape(letter_class_list)}")
-
-                this_unit_acts_df['label'] = letter_class_list
+        for this_cat in range(len(classes_of_interest)):
 
+            if this_cat in IPC_words:
+                this_class_size = IPC_words[this_cat]
             else:
-                # if letter sel is False
-                if this_cat in IPC_words:
-                    this_class_size = IPC_words[this_cat]
-                else:
-                    this_class_size = 0
-                not_a_size = n_correct - this_class_size
+                this_class_size = 0
+            not_a_size = n_correct - this_class_size
 
             if verbose:
                 print(f"this_unit_acts_df:\n{this_unit_acts_df.head()}")
@@ -1759,72 +1826,7 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
 
             # # running selectivity measures
 
-            # # run class_sel_basics here for letters, further up page ^ for words
-            if letter_sel:
-                # # make new IPC_dict
-                # is it necessary to copy this - yes because I pop the value?
-                ts_IPC_letters = copy.copy(IPC_dict['letter_p_class_p_ts'][ts_name])
-                # ts_IPC_letters = IPC_dict['letter_p_class_p_ts'][ts_name]
-
-                # print(f"ts_IPC_letters:\n{ts_IPC_letters}")
-
-                if this_letter in ts_IPC_letters.keys():
-                    # ts_IPC_this_letter = ts_IPC_letters[this_letter]
-                    ts_IPC_this_letter = ts_IPC_letters.pop(this_letter)
-
-                else:
-                    ts_IPC_this_letter = 0
-
-                ts_IPC_not_this_letter = sum(list(ts_IPC_letters.values()))
-
-                IPC_binary_letters = {this_cat: ts_IPC_this_letter,
-                                      not_this_letter_symbol: ts_IPC_not_this_letter}
-
-                # print(f"ts_IPC_letters: {ts_IPC_letters}")
-                # print(f"ts_IPC_this_letter: {ts_IPC_this_letter}")
-                # print(f"ts_IPC_not_this_letter: {ts_IPC_not_this_letter}")
-                if verbose:
-                    print(f"IPC_binary_letters: {IPC_binary_letters}")
-
-                # # get class_sel_basics (class_means, sd, prop > .5, prop @ 0)
-                class_sel_basics_dict = class_sel_basics(this_unit_acts_df=this_unit_acts_df,
-                                                         items_per_cat=IPC_binary_letters,
-                                                         n_classes=[this_cat, not_this_letter_symbol],
-                                                         act_func=act_func,
-                                                         verbose=verbose)
-
-                if verbose:
-                    focussed_dict_print(class_sel_basics_dict, 'class_sel_basics_dict')
-
-                # # add class_sel_basics_dict to unit dict
-                for csb_key, csb_value in class_sel_basics_dict.items():
-                    if csb_key == 'total':
-                        continue
-                    if csb_key == 'perplexity':
-                        continue
-
-                    if csb_key not in unit_ts_dict.keys():
-                        unit_ts_dict[csb_key] = dict()
-
-                    print(f"\nthis_cat: {this_cat}")
-                    print(f"not_this_letter_symbol: {not_this_letter_symbol}")
-                    print(f"csb_key: {csb_key}")
-                    print(f"csb_value: {csb_value}")
-
-                    if this_cat in csb_value.keys():
-                        unit_ts_dict[csb_key][this_cat] = csb_value[this_cat]
-                    else:
-                        if verbose:
-                            print(f'\n\n\nclass {this_cat} contains no items.\n'
-                              f'setting values for class_sel_basics to zero\n'
-                              f'(means, sd, nz_count, nz_prop, nz_prec, '
-                              f'hi_val_count, hi_val_prop, hi_val_prec).\n'
-                              f'I could use np.NaN, but I don"t think I need to\n\n')
-                        unit_ts_dict[csb_key][this_cat] = 0
-
-
-
-                        # # ROC_stuff includes:
+            # # ROC_stuff includes:
             # roc_auc, ave_prec, pr_auc, nz_ave_prec, nz_pr_auc, top_class_sel, informedness
 
             # # if relu, always use normed values. Otherwise use original values,
@@ -2000,8 +2002,10 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
                     output_acts_ts = output_layer_acts[:, timestep, :]
                     # print(f"np.shape(output_acts_ts): {np.shape(output_acts_ts)}")
 
-                    class_corr = class_correlation(this_unit_acts=this_unit_acts_df[act_values],
-                                                   output_acts=output_acts_ts[:, this_cat],
+                    # # df is sorted by activation, its index is the item order (as output acts)
+                    class_corr = class_correlation(this_unit_acts=this_unit_acts_df[act_values].to_numpy(),
+                                                   output_acts=output_acts_ts[this_unit_acts_df.index.to_numpy(),
+                                                                              this_cat],
                                                    verbose=verbose)
                 unit_ts_dict["corr_coef"][this_cat] = class_corr['coef']
                 unit_ts_dict["corr_p"][this_cat] = class_corr['p']
@@ -2015,10 +2019,32 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
         # which class was the highest for each measure
         max_sel_p_unit_dict = sel_unit_max(unit_ts_dict, verbose=verbose)
 
+        # # permutation test: p-values, null dist summaries and permutation-corrected max sel
+        if n_perms and not letter_sel:
+            perm_labels = this_unit_acts_df['label'].to_numpy()
+            # # tanh ccma and b_sel are reported on (acts + 1) / max(acts + 1), so test those values
+            perm_acts = 'normed' if act_func == 'tanh' else 'activation'
+            perm_dict = unit_perm_test(acts=this_unit_acts_df[perm_acts].to_numpy(),
+                                       labels=perm_labels,
+                                       items_per_cat=np.bincount(perm_labels, minlength=n_cats),
+                                       perm_labels=permute_labels(perm_labels, n_perms, seed=perm_seed),
+                                       act_func=act_func)
+            for perm_key, perm_value in perm_dict.items():
+                if perm_key not in perm_measures:
+                    max_sel_p_unit_dict[perm_key] = perm_value
+
 
 
         # # # # once sel analysis has been done for this hid_act array
 
+        # # append unit/timestep to store, nested dicts are made at the end
+        if save_output_to == 'sqlite':
+            append_unit_sel(sel_store, layer_name=layer_name, unit_index=unit_index,
+                            timestep=timestep, unit_ts_dict=unit_ts_dict,
+                            max_sel_p_unit_dict=max_sel_p_unit_dict)
+            print("saved to disk")
+            continue
+
         # # sort dicts to save
         # # add layer to all_sel_dict
         if layer_name not in all_sel_dict:
@@ -2048,12 +2074,12 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
 
 
         # # save unit/timestep to disk
-        if save_output_to is 'pickle':
+        if save_output_to == 'pickle':
             with open(all_sel_dict_name, "wb") as pickle_out:
                 pickle.dump(all_sel_dict, pickle_out, protocol=pickle.HIGHEST_PROTOCOL)
             with open(max_sel_dict_name, "wb") as pickle_out:
                 pickle.dump(max_sel_dict, pickle_out, protocol=pickle.HIGHEST_PROTOCOL)
-        if save_output_to is 'shelve':
+        if save_output_to == 'shelve':
             with shelve.open(all_sel_dict_name, protocol=pickle.HIGHEST_PROTOCOL) as db:
                 # # make a test item just to establish the db
                 db['all_sel_dict'] = all_sel_dict
@@ -2064,6 +2090,22 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
 
     print(f"********\nfinished looping through units************")
 
+    if save_output_to == 'sqlite':
+        # # write the nested dicts once, for get_sel_summaries() etc
+        all_sel_dict, max_sel_dict = sel_store_to_pickles(sel_store,
+                                                          all_sel_dict_name=all_sel_dict_name,
+                                                          max_sel_dict_name=max_sel_dict_name,
+                                                          sequence_data=sequence_data,
+                                                          verbose=verbose)
+        sel_store.close()
+
+    # # columnar copy of results for queries (top_k_units etc)
+    if save_output_to == 'sqlite':
+        sel_table = sel_store_to_table(sel_store_name, verbose=verbose)
+    else:
+        sel_table = sel_dict_to_table(all_sel_dict, verbose=verbose)
+    sel_table_name = save_sel_table(sel_table, f"{sel_path}/{output_filename}_sel_table.npz",
+                                    verbose=verbose)
 
     if verbose:
         focussed_dict_print(all_sel_dict, 'all_sel_dict')
@@ -2084,8 +2126,12 @@ def rnn_sel(gha_dict_path, correct_items_only=True, all_classes=True,
                             'sel_dict_name': sel_dict_name,
                             "all_sel_dict_name": all_sel_dict_name,
                             'max_sel_dict_name': max_sel_dict_name,
+                            'sel_table_name': sel_table_name,
+                            'save_output_to': save_output_to,
                             "correct_items_only": correct_items_only,
                             "all_classes": all_classes,
+                            'n_perms': n_perms, 'perm_seed': perm_seed,
+                            'batch_timesteps': batch_timesteps,
                             'corr_test_seq_name': corr_test_seq_name,
                             'corr_test_letters_name': corr_test_letters_name,
                             'corr_test_IPC_name': corr_test_IPC_name,
@@ -12,7 +12,8 @@ from sklearn.metrics import roc_curve, auc
 from scipy.stats.stats import pearsonr
 
 from tools.dicts import load_dict, focussed_dict_print
-from tools.hdf import hdf_df_string_clean
+from tools.hdf import hdf_df_string_clean, load_item_scores
+from Selectivity.sel_kernels import bootstrap_sel_ci, boot_measures
 
 '''This script uses shelve instead of pickle for sel_p_unit dict.
 Sel-per_unit shelve was too big (maxed computed memory at about 141GB)
@@ -371,6 +372,7 @@ def sel_unit_max(all_sel_dict, verbose=False):
 # @profile
 def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
            layer_classes=("Conv2D", "Dense", "Activation"),
+           n_boot=0, top_k_correct=False,
            verbose=False, test_run=False):
     """
     Analyse hidden unit activations.
@@ -388,6 +390,11 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
     :param correct_items_only: Whether selectivity considered incorrect items
     :param all_classes: Whether to test for selectivity of all classes or a subset (e.g., most active classes)
     :param layer_classes: Which layers to analyse
+    :param n_boot: if > 0, number of Poisson bootstrap samples for 95% CIs of ccma, means, nz_prop and
+                    hi_val_prop (for each unit's max class).  Added to the layer sel_p_unit csv.
+    :param top_k_correct: if True, 'correct' items are those with the true class in the top-k predictions
+                    (full_model_top_k from {output_filename}_scores.h5, see load_item_scores()),
+                    e.g., top-5 for ImageNet.  Needs gha for all items (gha_incorrect=True).
     :param verbose: how much to print to screen
     :param test_run: if True, only do subset, e.g., 3 units from 3 layers
 
@@ -436,6 +443,18 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
     n_incorrect = all_items - n_correct
     items_per_cat = gha_dict['GHA_info']['scores_dict']['corr_per_cat_dict']
 
+    if top_k_correct:
+        if not gha_dict['GHA_info']['gha_incorrect']:
+            raise ValueError("top_k_correct needs hid acts for all items (gha_incorrect=True)")
+        # # score items as correct if true class is in top-k (saved by hdf_pred_scores)
+        item_scores = load_item_scores(output_filename, columns=('full_model_top_k',))
+        y_scores_df['full_model'] = item_scores['full_model_top_k'].astype(int)
+        n_correct = gha_dict['GHA_info']['scores_dict']['n_correct_top_k']
+        n_incorrect = all_items - n_correct
+        items_per_cat = gha_dict['GHA_info']['scores_dict']['corr_per_cat_top_k_dict']
+        print(f"top_k_correct: {n_correct} items with true class in top-"
+              f"{gha_dict['GHA_info']['scores_dict']['top_k']}")
+
     # # get basic COI list
     if all_classes is True:
         if type(items_per_cat) is int:
@@ -943,6 +962,20 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
         # # nick_to_csv(max_sel_df, max_sel_csv_name)
         max_sel_df = pd.read_csv(max_sel_csv_name)
 
+        # # bootstrap CIs for each unit's max class, from per-class weighted sums
+        if n_boot:
+            print(f"\ngetting bootstrap CIs ({n_boot} samples) for {boot_measures}")
+            boot_units = max_sel_df['unit'].to_numpy()
+            boot_acts = hid_acts_df.to_numpy()[:, boot_units]
+            ci_classes = {measure: max_sel_df[f'{measure}_c'].to_numpy().astype(int)
+                          for measure in boot_measures}
+            ci_dict = bootstrap_sel_ci(normed_acts=boot_acts / boot_acts.max(axis=0),
+                                       labels=y_df['class'].to_numpy(), n_cats=n_cats,
+                                       ci_classes=ci_classes, n_boot=n_boot, verbose=verbose)
+            for ci_key, ci_values in ci_dict.items():
+                max_sel_df[ci_key] = ci_values
+            max_sel_df.to_csv(max_sel_csv_name, index=False)
+
         # # get layer_sel_mean_dict
         # # for each unit, for each measure, the max_value.
         # # add all these up for the layer.
@@ -1262,6 +1295,7 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
                                'sel_highlights_list_dict_name': sel_highlights_list_dict_name,
                                "correct_items_only": correct_items_only,
                                "all_classes": all_classes, "layer_classes": layer_classes,
+                               "n_boot": n_boot, "top_k_correct": top_k_correct,
                                "sel_date": int(datetime.datetime.now().strftime("%y%m%d")),
                                "sel_time": int(datetime.datetime.now().strftime("%H%M")),
                                }
@@ -11,8 +11,10 @@ from sklearn.metrics import roc_curve, auc
 from scipy.stats.stats import pearsonr
 
 from tools.dicts import load_dict, focussed_dict_print
-from tools.data import nick_read_csv
+from tools.data import nick_read_table
 from tools.network import loop_thru_acts
+from Selectivity.sel_table import sel_dict_to_table, save_sel_table
+from Selectivity.sel_kernels import PreparedLayer, layer_perm_test, perm_measures
 
 
 def nick_roc_stuff(class_list, hid_acts, this_class, class_a_size, not_a_size,
@@ -509,6 +511,7 @@ def get_unit_sparsity(gha_dict_path,
 #######################################################################################################
 def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
            layer_classes=("Conv2D", "Dense", "Activation"),
+           n_perms=0, perm_jobs=1, perm_seed=None,
            verbose=False, test_run=False):
     """
     Analyse hidden unit activations.
@@ -526,6 +529,10 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
     :param correct_items_only: Whether selectivity considered incorrect items
     :param all_classes: Whether to test for selectivity of all classes or a subset (e.g., most active classes)
     :param layer_classes: Which layers to analyse
+    :param n_perms: if > 0, permutation test for max_informed, ccma and b_sel with this many
+                    label shuffles.  Adds p-values and permutation-corrected max sel to max_sel_p_unit.
+    :param perm_jobs: number of processes to use for the permutation test
+    :param perm_seed: seed for the label shuffles (reproducible p-values)
     :param verbose: how much to print to screen
     :param test_run: if True, only do subset, e.g., 3 units from 3 layers
 
@@ -555,7 +562,7 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
     # # load item_correct (y_data)
     item_correct_name = gha_dict['GHA_info']['scores_dict']['item_correct_name']
     # y_scores_df = pd.read_csv(item_correct_name)
-    y_scores_df = nick_read_csv(item_correct_name)
+    y_scores_df = nick_read_table(item_correct_name)
     # use y_df for analysis
     y_df = y_scores_df
 
@@ -764,24 +771,32 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
         #     continue
 
         hid_acts_array = layer_dict['2d_acts']
-        hid_acts_df = pd.DataFrame(hid_acts_array)
-        print(f"\nloaded hidden_activation_file: {hid_acts_pickle}, {np.shape(hid_acts_df)}")
-        units_per_layer = len(hid_acts_df.columns)
+        print(f"\nloaded hidden_activation_file: {hid_acts_pickle}, {np.shape(hid_acts_array)}")
+
+        # # sort orders, class groupings and counts are worked out once per layer,
+        # # then used by all the sel measures
+        prepared_layer = PreparedLayer(hid_acts_array, y_scores_df['class'].to_numpy(), n_cats=n_cats)
+        units_per_layer = prepared_layer.n_units
 
         # # remove incorrect responses
         if correct_items_only:
             if gha_incorrect:
-                print(f"\nremoving {n_incorrect} incorrect responses from hid_acts_df: {hid_acts_df.shape}")
-                hid_acts_df['full_model'] = y_scores_df['full_model']
-                hid_acts_df = hid_acts_df.loc[hid_acts_df['full_model'] == 1]
-                hid_acts_df = hid_acts_df.drop(['full_model'], axis=1)
-                print(f"(cleaned) hid_acts_df: {hid_acts_df.shape}\n{hid_acts_df.head()}")
+                print(f"\nremoving {n_incorrect} incorrect responses from hid_acts: {np.shape(hid_acts_array)}")
+                prepared_layer = prepared_layer.subset(y_scores_df['full_model'].to_numpy() == 1)
+                print(f"(cleaned) hid_acts: {np.shape(prepared_layer.acts)}")
+
+        # # permutation test for significance of max_informed, ccma and b_sel (all units at once)
+        layer_perm_dict = dict()
+        if n_perms:
+            print(f"\nrunning permutation test ({n_perms} label shuffles)")
+            layer_perm_dict = layer_perm_test(prepared_layer, act_func=act_func, n_perms=n_perms,
+                                              seed=perm_seed, n_jobs=perm_jobs, verbose=verbose)
 
         layer_dict = dict()
         max_sel_dict = dict()
 
         print("\n**** loop through units ****")
-        for unit_index, unit in enumerate(hid_acts_df.columns):
+        for unit_index, unit in enumerate(range(units_per_layer)):
 
             if test_run is True:
                 if unit_index > 3:
@@ -831,27 +846,43 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
 
                          }
 
-            this_unit_just_acts = list(hid_acts_df.loc[:, unit])
+            this_unit_just_acts = prepared_layer.acts[:, unit]
 
             # # 1st check its not a dead unit
-            # if this_unit_just_acts.sum() != 0:  # check for dead units, if dead, all details to 0/na/nan/-999 etc
-            if sum(this_unit_just_acts) != 0:  # check for dead units, if dead, all details to 0/na/nan/-999 etc
+            if not prepared_layer.dead_units[unit]:  # check for dead units, if dead, all details to 0/na/nan/-999 etc
 
                 print("not dead - sorting activations for analysis")
 
-                # insert act values in middle of labels (item, act, cat)
-                this_unit_acts = y_df.copy()
+                # # use prepared sort order (descending hid act values)
+                unit_order = prepared_layer.unit_order(unit)
+                this_unit_acts_df = y_df.iloc[unit_order]
 
-                this_unit_acts.insert(2, column='activation', value=this_unit_just_acts, )
-
-                # # sort by descending hid act values
-                this_unit_acts_df = this_unit_acts.sort_values(by='activation', ascending=False)
+                # insert act values in middle of labels (item, act, cat)
+                this_unit_acts_df.insert(2, column='activation', value=this_unit_just_acts[unit_order])
 
                 # # # normalize activations
                 just_act_values = this_unit_acts_df['activation'].tolist()
-                max_act = max(just_act_values)
-                normed_acts = np.true_divide(just_act_values, max_act)
+                normed_item_order = prepared_layer.normed_acts(unit)
+                normed_acts = normed_item_order[unit_order]
                 this_unit_acts_df.insert(2, column='normed', value=normed_acts)
+                sorted_classes = prepared_layer.labels[unit_order]
+
+                # # per-class and not-class mean/min/max for ccma and b_sel (all classes at once)
+                normed_class_stats = prepared_layer.class_vs_rest(normed_item_order)
+                b_sel_class_stats = prepared_layer.class_vs_rest(this_unit_just_acts)
+                if act_func in ['tanh', 'relu', 'ReLu', 'Relu']:
+                    b_sel_class_stats = normed_class_stats
+
+                # # zhou_prec: the most active items are the same for all classes
+                zhou_cut_off = .005
+                if n_correct < 20000:
+                    zhou_cut_off = 100 / n_correct
+                zhou_selects = int(n_correct * zhou_cut_off)
+                n_active = int(np.sum(normed_acts > 0))
+                if n_active < zhou_selects:
+                    zhou_selects = n_active
+                zhou_thr = normed_acts[zhou_selects - 1]
+                zhou_class_counts = np.bincount(sorted_classes[:zhou_selects], minlength=n_cats)
 
                 # # get overall unit mean activation (not class specific)
                 if act_func is 'sigmoid':
@@ -900,8 +931,8 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
 
                     # # ROC_stuff includes:
                     # roc_auc, ave_prec, pr_auc, nz_ave_prec, nz_pr_auc, top_class_sel, informedness
-                    roc_stuff_dict = nick_roc_stuff(class_list=this_unit_acts_df['class'],
-                                                    hid_acts=this_unit_acts_df['normed'],
+                    roc_stuff_dict = nick_roc_stuff(class_list=sorted_classes,
+                                                    hid_acts=normed_acts,
                                                     this_class=this_cat,
                                                     class_a_size=this_class_size, not_a_size=not_a_size,
                                                     verbose=verbose)
@@ -911,10 +942,8 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
                         unit_dict[roc_key][this_cat] = roc_value
 
                     # # ccma
-                    class_a = this_unit_acts_df.loc[this_unit_acts_df['class'] == this_cat]
-                    class_a_mean = class_a['normed'].mean()
-                    not_class_a = this_unit_acts_df.loc[this_unit_acts_df['class'] != this_cat]
-                    not_class_a_mean = not_class_a['normed'].mean()
+                    class_a_mean = normed_class_stats['class_mean'][this_cat]
+                    not_class_a_mean = normed_class_stats['not_class_mean'][this_cat]
                     ccma = (class_a_mean - not_class_a_mean) / (class_a_mean + not_class_a_mean)
                     unit_dict["ccma"][this_cat] = ccma
 
@@ -926,16 +955,11 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
                         print("\nBowers Sel")
 
                     # # first check for on units
-                    class_a_min = class_a['activation'].min()
-                    class_a_max = class_a['activation'].max()
-                    not_class_a_max = not_class_a['activation'].max()
-                    not_class_a_min = not_class_a['activation'].min()
-
-                    if act_func in ['tanh', 'relu', 'ReLu', 'Relu']:
-                        class_a_min = class_a['normed'].min()
-                        class_a_max = class_a['normed'].max()
-                        not_class_a_max = not_class_a['normed'].max()
-                        not_class_a_min = not_class_a['normed'].min()
+                    # # (normed for tanh and relu)
+                    class_a_min = b_sel_class_stats['class_min'][this_cat]
+                    class_a_max = b_sel_class_stats['class_max'][this_cat]
+                    not_class_a_max = b_sel_class_stats['not_class_max'][this_cat]
+                    not_class_a_min = b_sel_class_stats['not_class_min'][this_cat]
 
                     if verbose:
                         print(f"class_a_min: {class_a_min}\n"
@@ -1002,16 +1026,7 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
 
 
                     # # zhou_prec
-                    zhou_cut_off = .005
-                    if n_correct < 20000:
-                        zhou_cut_off = 100 / n_correct
-                    zhou_selects = int(n_correct * zhou_cut_off)
-                    n_active = sum(i > 0 for i in normed_acts)
-                    if n_active < zhou_selects:
-                        zhou_selects = n_active
-                    most_active = this_unit_acts_df.iloc[:zhou_selects]
-                    zhou_thr = list(most_active["normed"])[-1]
-                    zhou_prec = sum([1 for i in most_active['class'] if i == this_cat]) / zhou_selects
+                    zhou_prec = zhou_class_counts[this_cat] / zhou_selects
                     unit_dict["zhou_prec"][this_cat] = zhou_prec
                     unit_dict["zhou_selects"][this_cat] = zhou_selects
                     unit_dict["zhou_thr"][this_cat] = zhou_thr
@@ -1019,7 +1034,7 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
 
 
                     # # class correlation
-                    class_corr = class_correlation(this_unit_acts=this_unit_acts_df['normed'],
+                    class_corr = class_correlation(this_unit_acts=normed_item_order,
                                                    output_acts=output_layer_df[this_cat], verbose=verbose)
                     unit_dict["corr_coef"][this_cat] = class_corr['coef']
                     unit_dict["corr_p"][this_cat] = class_corr['p']
@@ -1030,6 +1045,13 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
 
                 # # # for each sel variable - get the class with the highest values and add to per_unit
                 max_sel_p_unit_dict = sel_unit_max(unit_dict, verbose=verbose)
+
+                # # add p-values, null dist summaries and permutation-corrected max sel
+                if unit in layer_perm_dict:
+                    for perm_key, perm_value in layer_perm_dict[unit].items():
+                        if perm_key not in perm_measures:
+                            max_sel_p_unit_dict[perm_key] = perm_value
+
                 unit_dict['max'] = max_sel_p_unit_dict
                 max_sel_dict[unit] = max_sel_p_unit_dict
 
@@ -1383,6 +1405,11 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
     pickle.dump(sel_p_unit_dict, pickle_out)
     pickle_out.close()
 
+    # # columnar copy of results for queries (top_k_units etc)
+    sel_table_name = save_sel_table(sel_dict_to_table(sel_p_unit_dict, verbose=verbose),
+                                    f"{sel_path}/{output_filename}_sel_table.npz",
+                                    verbose=verbose)
+
     # # save dict
     print("\n\n\n*****************\nanalysis complete\n*****************")
 
@@ -1401,9 +1428,11 @@ def ff_sel(gha_dict_path, correct_items_only=True, all_classes=True,
     master_dict["sel_info"] = {"sel_path": sel_path,
                                'sel_dict_name': sel_dict_name,
                                "sel_per_unit_pickle_name": sel_per_unit_pickle_name,
+                               'sel_table_name': sel_table_name,
                                'sel_highlights_pickle_name': sel_highlights_pickle_name,
                                "correct_items_only": correct_items_only,
                                "all_classes": all_classes, "layer_classes": layer_classes,
+                               "n_perms": n_perms, "perm_seed": perm_seed,
                                "sel_date": sel_date,
                                "sel_time": sel_time,
                                }
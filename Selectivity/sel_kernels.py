@@ -0,0 +1,1093 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.special import betainc
+
+
+'''Shared precomputation for selectivity measures.
+
+Every measure (ROC, Zhou, b_sel, ccma, normalisation) needs the same orderings of a layer's
+activations: items sorted by activation for each unit, and items grouped by class.
+PreparedLayer works these out once per layer (compact int32 arrays) and the measures use them,
+rather than each one re-sorting or filtering a DataFrame per unit and per class.
+'''
+
+
+class PreparedLayer:
+    """
+    Per-layer precomputed orderings.
+
+    acts:           (items, units) activations
+    labels:         (items, ) int32 class labels
+    items_per_cat:  (n_cats, ) int32 item count per class
+    sort_idx:       (items, units) int32 item indices, descending activation for each unit
+    class_perm:     (items, ) int32 item indices grouped by class (class 0 items first)
+    class_starts:   (n_cats, ) int32 start of each class in class_perm
+    max_acts:       (units, ) max activation per unit (for normed acts)
+    dead_units:     (units, ) bool, True if unit activations sum to zero
+    """
+    __slots__ = ('acts', 'labels', 'n_cats', 'n_items', 'n_units', 'items_per_cat',
+                 'sort_idx', 'class_perm', 'class_starts', 'max_acts', 'dead_units')
+
+    def __init__(self, hid_acts, labels, n_cats=None, sort_idx=None):
+        """
+        :param hid_acts: 2d array (items, units)
+        :param labels: class label for each item
+        :param n_cats: number of classes (if None, use max label + 1)
+        :param sort_idx: descending argsort per unit if already known (see subset())
+        """
+        self.acts = np.asarray(hid_acts)
+        if self.acts.ndim == 1:
+            self.acts = self.acts.reshape(-1, 1)
+        self.labels = np.asarray(labels).astype(np.int32)
+        self.n_items, self.n_units = self.acts.shape
+
+        if n_cats is None:
+            n_cats = int(self.labels.max()) + 1
+        self.n_cats = n_cats
+
+        self.items_per_cat = np.bincount(self.labels, minlength=n_cats).astype(np.int32)
+        self.class_perm = np.argsort(self.labels, kind='stable').astype(np.int32)
+        self.class_starts = np.zeros(n_cats, dtype=np.int32)
+        self.class_starts[1:] = np.cumsum(self.items_per_cat)[:-1]
+
+        if sort_idx is None:
+            sort_idx = np.argsort(-self.acts, axis=0, kind='stable').astype(np.int32)
+        self.sort_idx = sort_idx
+
+        self.max_acts = self.acts.max(axis=0)
+        self.dead_units = self.acts.sum(axis=0) == 0
+
+    def subset(self, keep_items):
+        """
+        Make a PreparedLayer for a subset of items (e.g., correct items only).
+        The sort order is filtered rather than worked out again.
+
+        :param keep_items: bool mask (items, )
+
+        :return: PreparedLayer
+        """
+        keep_items = np.asarray(keep_items, dtype=bool)
+        n_keep = int(keep_items.sum())
+
+        # # new index for each kept item
+        new_index = (np.cumsum(keep_items) - 1).astype(np.int32)
+
+        # # keep sorted positions of kept items (same number per unit), column by column
+        keep_sorted = keep_items[self.sort_idx]
+        sub_sort_idx = self.sort_idx.T[keep_sorted.T].reshape(self.n_units, n_keep).T
+        sub_sort_idx = new_index[sub_sort_idx]
+
+        return PreparedLayer(self.acts[keep_items], self.labels[keep_items],
+                             n_cats=self.n_cats, sort_idx=np.ascontiguousarray(sub_sort_idx))
+
+    def unit_order(self, unit):
+        """item indices for this unit, sorted by descending activation"""
+        return self.sort_idx[:, unit]
+
+    def normed_acts(self, unit):
+        """activations for this unit (item order) divided by max activation"""
+        return np.true_divide(self.acts[:, unit], self.max_acts[unit])
+
+    def class_reduce(self, values, ufunc):
+        """
+        Apply a reducing ufunc (e.g., np.add, np.minimum, np.maximum) to values per class.
+
+        :param values: (items, ) values in item order
+        :param ufunc: numpy ufunc with reduceat
+
+        :return: (n_cats, ) array, NaN for empty classes
+        """
+        grouped = np.asarray(values, dtype=float)[self.class_perm]
+        has_items = self.items_per_cat > 0
+        reduced = np.full(self.n_cats, np.nan)
+        if grouped.size:
+            reduced[has_items] = ufunc.reduceat(grouped, self.class_starts[has_items])
+        return reduced
+
+    def class_vs_rest(self, values):
+        """
+        Per-class and not-class (all other items) mean, min and max of values.
+
+        :param values: (items, ) values in item order
+
+        :return: dict of (n_cats, ) arrays: class_mean, class_min, class_max,
+                    not_class_mean, not_class_min, not_class_max
+        """
+        values = np.asarray(values, dtype=float)
+        n_not = self.n_items - self.items_per_cat
+
+        class_sum = self.class_reduce(values, np.add)
+        class_sum[self.items_per_cat == 0] = 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            class_mean = np.where(self.items_per_cat > 0, class_sum / self.items_per_cat, np.nan)
+            not_class_mean = np.where(n_not > 0, (values.sum() - class_sum) / n_not, np.nan)
+
+        class_min = self.class_reduce(values, np.minimum)
+        class_max = self.class_reduce(values, np.maximum)
+
+        return {'class_mean': class_mean,
+                'class_min': class_min,
+                'class_max': class_max,
+                'not_class_mean': not_class_mean,
+                'not_class_min': _excluding_each(class_min, n_not, find_max=False),
+                'not_class_max': _excluding_each(class_max, n_not, find_max=True),
+                }
+
+
+def _excluding_each(per_class, n_not, find_max=True):
+    """
+    For each class, reduce (min or max) over all the other classes.
+    Uses the best and second-best class, so it's one pass rather than one per class.
+    Works along the last axis, so per_class can be (n_cats, ) or (n_perms, n_cats).
+    """
+    per_class = np.asarray(per_class, dtype=float)
+    valid = ~np.isnan(per_class)
+
+    if find_max:
+        ranked = np.where(valid, per_class, -np.inf)
+        order = np.argsort(-ranked, axis=-1, kind='stable')
+    else:
+        ranked = np.where(valid, per_class, np.inf)
+        order = np.argsort(ranked, axis=-1, kind='stable')
+
+    best = order[..., :1]
+    best_val = np.take_along_axis(per_class, best, axis=-1)
+    if per_class.shape[-1] > 1:
+        second_val = np.take_along_axis(per_class, order[..., 1:2], axis=-1)
+    else:
+        second_val = np.full(best_val.shape, np.nan)
+
+    excluded = np.repeat(best_val, per_class.shape[-1], axis=-1)
+    np.put_along_axis(excluded, best, second_val, axis=-1)
+
+    excluded[..., np.asarray(n_not) == 0] = np.nan
+    return excluded
+
+
+def permute_labels(labels, n_perms, seed=None):
+    """
+    Make shuffled copies of the class labels (class sizes are kept).
+
+    :param labels: (items, ) class labels
+    :param n_perms: number of permutations
+    :param seed: for np.random.default_rng
+
+    :return: (n_perms, items) int32 array
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels).astype(np.int32)
+    # # argsort of random keys gives an independent shuffle per row (Generator.permuted needs numpy 1.20)
+    shuffle_idx = np.argsort(rng.random((n_perms, len(labels))), axis=1)
+    return np.take_along_axis(np.tile(labels, (n_perms, 1)), shuffle_idx, axis=1)
+
+
+# # max number of elements in the (label sets, units or columns, classes, items) arrays per chunk
+max_chunk_size = 2 ** 22
+
+
+def batch_class_cumsum(sorted_labels, n_cats):
+    """
+    Running count of each class down the sorted items, for every label set and unit at once
+    (one-hot labels, cumsum over items).
+
+    :param sorted_labels: (n_perms, units, items) labels, items sorted by descending act per unit
+    :param n_cats: number of classes
+
+    :return: (n_perms, units, n_cats, items) int16 (int32 for 32768 items or more)
+    """
+    one_hot = sorted_labels[:, :, None, :] == np.arange(n_cats)[:, None]
+    count_type = np.int16 if sorted_labels.shape[-1] < 2 ** 15 else np.int32
+    return np.cumsum(one_hot, axis=-1, dtype=count_type)
+
+
+def batch_max_informed(class_cumsum, last_in_run, items_per_cat):
+    """
+    Max informedness (sens + spec - 1) for every class, unit and label set at once.
+    Same as nick_roc_stuff max_informed: thresholds are only taken between distinct activations,
+    and values below zero are set to zero.
+
+    :param class_cumsum: (n_perms, units, n_cats, items) from batch_class_cumsum()
+    :param last_in_run: (units, items) True for the last item of each run of tied activations
+    :param items_per_cat: (n_cats, ) items per class
+
+    :return: (n_perms, units, n_cats) max informedness
+    """
+    items_per_cat = np.asarray(items_per_cat)
+    n_items = class_cumsum.shape[-1]
+    not_a_size = n_items - items_per_cat
+
+    # # informedness * class size * not class size is an integer, tp * items - n_above * class size,
+    # # so the max is found in integers and divided once (equal informedness is always equal)
+    int_type = np.int32 if n_items ** 2 < 2 ** 31 else np.int64
+    n_above_a = np.outer(items_per_cat, np.arange(1, n_items + 1)).astype(int_type)
+    scaled = class_cumsum.astype(int_type, copy=False) * int_type(n_items) - n_above_a
+    if not last_in_run.all():
+        scaled = np.where(last_in_run[:, None, :], scaled, np.iinfo(int_type).min)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        max_informed = np.maximum(scaled.max(axis=-1) / (items_per_cat * not_a_size), 0)
+    max_informed[..., items_per_cat * not_a_size == 0] = 0
+
+    return max_informed
+
+
+def batch_ccma(labels, normed_acts, items_per_cat):
+    """
+    ccma ((class mean - not class mean) / (class mean + not class mean)),
+    for every class, unit and label set at once.
+    Class sums are one bincount on (label set, unit, class) keys, so each sum adds items in order
+    and the values don't depend on which units are done together.
+
+    :param labels: (n_perms, items) labels
+    :param normed_acts: (items, units) normed activations
+    :param items_per_cat: (n_cats, ) items per class
+
+    :return: (n_perms, units, n_cats) ccma
+    """
+    labels = np.atleast_2d(labels)
+    items_per_cat = np.asarray(items_per_cat)
+    n_perms, n_items = labels.shape
+    n_units = normed_acts.shape[1]
+    n_cats = len(items_per_cat)
+
+    unit_keys = np.arange(n_perms * n_units).reshape(n_perms, n_units, 1) * n_cats
+    unit_acts = np.broadcast_to(normed_acts.T, (n_perms, n_units, n_items))
+    class_sum = np.bincount((unit_keys + labels[:, None, :]).ravel(), weights=unit_acts.ravel(),
+                            minlength=n_perms * n_units * n_cats).reshape(n_perms, n_units, n_cats)
+    unit_sum = np.bincount(np.repeat(np.arange(n_units), n_items), weights=normed_acts.T.ravel(),
+                           minlength=n_units)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        class_mean = class_sum / items_per_cat
+        not_class_mean = (unit_sum[:, None] - class_sum) / (n_items - items_per_cat)
+        ccma = (class_mean - not_class_mean) / (class_mean + not_class_mean)
+    return ccma
+
+
+def batch_b_sel(class_cumsum, sorted_acts, items_per_cat):
+    """
+    Bowers sel (same on/off logic as ff_sel) for every class, unit and label set at once.
+    Activations only change by a positive or negative scale (normed acts), so each class
+    min and max are at its first and last item in the sorted order.
+
+    :param class_cumsum: (n_perms, units, n_cats, items) from batch_class_cumsum()
+    :param sorted_acts: (units, items) activations (normed for relu/tanh), in sorted order
+    :param items_per_cat: (n_cats, ) items per class
+
+    :return: (n_perms, units, n_cats) b_sel
+    """
+    items_per_cat = np.asarray(items_per_cat)
+    n_units, n_items = sorted_acts.shape
+    n_not = n_items - items_per_cat
+    unit_idx = np.arange(n_units)[:, None]
+
+    # # position of the first and last item from each class
+    first = np.minimum(np.sum(class_cumsum == 0, axis=-1), n_items - 1)
+    last = np.minimum(np.sum(class_cumsum < items_per_cat[:, None], axis=-1), n_items - 1)
+    first_acts = sorted_acts[unit_idx, first]
+    last_acts = sorted_acts[unit_idx, last]
+
+    empty = items_per_cat == 0
+    class_min = np.where(empty, np.nan, np.minimum(first_acts, last_acts))
+    class_max = np.where(empty, np.nan, np.maximum(first_acts, last_acts))
+    not_class_min = _excluding_each(class_min, n_not, find_max=False)
+    not_class_max = _excluding_each(class_max, n_not, find_max=True)
+
+    b_sel_on = class_min - not_class_max
+    b_sel_off = not_class_min - class_max
+
+    b_sel = np.where(b_sel_on >= b_sel_off, b_sel_on, b_sel_off)
+    b_sel = np.where(class_max == 0, b_sel_off, b_sel)
+    b_sel = np.where(not_class_min == 0, b_sel_on, b_sel)
+    return b_sel
+
+
+perm_measures = ('max_informed', 'ccma', 'b_sel')
+
+
+def batch_perm_test(acts, labels, items_per_cat, perm_labels, act_func='relu',
+                    batch_size=100, sort_idx=None):
+    """
+    Permutation test for many units at once, all with the same label permutations.
+    The null for each measure is the max over classes for each label permutation,
+    so p-values are corrected for testing every class.
+
+    :param acts: (items, units) activations
+    :param labels: (items, ) class labels
+    :param items_per_cat: (n_cats, ) items per class
+    :param perm_labels: (n_perms, items) shuffled labels (from permute_labels())
+    :param act_func: relu, sigmoid or tanh.  b_sel uses normed acts for relu/tanh
+    :param batch_size: number of permutations to do in one go
+            (memory is batch_size * units * n_cats * items, units are split to fit max_chunk_size)
+    :param sort_idx: (items, units) descending argsort of acts if known (e.g., PreparedLayer)
+
+    :return: dict of (units, ) arrays, for each measure: observed max, p-value, null mean,
+                null 95th percentile, and permutation-corrected max (observed - null mean)
+    """
+    acts = np.asarray(acts, dtype=float)
+    if acts.ndim == 1:
+        acts = acts.reshape(-1, 1)
+    labels = np.asarray(labels).astype(np.int32)
+    items_per_cat = np.asarray(items_per_cat)
+    n_perms = len(perm_labels)
+    n_items, n_units = acts.shape
+    n_cats = len(items_per_cat)
+
+    if sort_idx is None:
+        sort_idx = np.argsort(-acts, axis=0, kind='stable')
+    # # (units, items) so that the sorted items are the last (contiguous) axis
+    sort_idx = np.ascontiguousarray(np.reshape(sort_idx, (n_items, n_units)).T)
+    sorted_acts = np.take_along_axis(acts.T, sort_idx, axis=1)
+    last_in_run = np.ones(sorted_acts.shape, dtype=bool)
+    last_in_run[:, :-1] = sorted_acts[:, 1:] != sorted_acts[:, :-1]
+
+    max_act = acts.max(axis=0)
+    normed_acts = acts / np.where(max_act != 0, max_act, 1)
+    b_sel_acts = acts
+    if act_func in ['tanh', 'relu', 'ReLu', 'Relu']:
+        b_sel_acts = normed_acts
+    sorted_b_sel = np.take_along_axis(b_sel_acts.T, sort_idx, axis=1)
+
+    def measure_maxes(these_labels, units):
+        """max over classes for each measure, (n_label_sets, units) per measure"""
+        class_cumsum = batch_class_cumsum(these_labels[:, sort_idx[units]], n_cats)
+        return {'max_informed': batch_max_informed(class_cumsum, last_in_run[units],
+                                                   items_per_cat).max(axis=-1),
+                'ccma': np.nanmax(batch_ccma(these_labels, normed_acts[:, units],
+                                             items_per_cat), axis=-1),
+                'b_sel': np.nanmax(batch_b_sel(class_cumsum, sorted_b_sel[units],
+                                               items_per_cat), axis=-1)}
+
+    observed = {measure: np.zeros(n_units) for measure in perm_measures}
+    null_dist = {measure: np.zeros((n_perms, n_units)) for measure in perm_measures}
+    unit_step = max(1, max_chunk_size // (max(1, min(batch_size, n_perms)) * n_items * n_cats))
+    for start in range(0, n_units, unit_step):
+        units = slice(start, min(start + unit_step, n_units))
+        for measure, values in measure_maxes(labels[None], units).items():
+            observed[measure][units] = values[0]
+        for perm_start in range(0, n_perms, batch_size):
+            perms = slice(perm_start, perm_start + batch_size)
+            for measure, values in measure_maxes(perm_labels[perms], units).items():
+                null_dist[measure][perms, units] = values
+
+    perm_dict = dict()
+    for measure in perm_measures:
+        null = null_dist[measure]
+        obs = observed[measure]
+        perm_dict[measure] = obs
+        perm_dict[f'{measure}_p'] = (1 + np.sum(null >= obs, axis=0)) / (1 + n_perms)
+        perm_dict[f'{measure}_null_mean'] = np.mean(null, axis=0)
+        perm_dict[f'{measure}_null_95'] = np.percentile(null, 95, axis=0)
+        perm_dict[f'{measure}_perm_corr'] = obs - np.mean(null, axis=0)
+
+    return perm_dict
+
+
+def unit_perm_test(acts, labels, items_per_cat, perm_labels, act_func='relu',
+                   batch_size=100, sort_order=None):
+    """
+    Permutation test for one unit (see batch_perm_test()).
+
+    :param acts: (items, ) activations
+    :param labels: (items, ) class labels
+    :param items_per_cat: (n_cats, ) items per class
+    :param perm_labels: (n_perms, items) shuffled labels (from permute_labels())
+    :param act_func: relu, sigmoid or tanh.  b_sel uses normed acts for relu/tanh
+    :param batch_size: number of permutations to do in one go (memory)
+    :param sort_order: descending argsort of acts if already known (e.g., PreparedLayer)
+
+    :return: dict, for each measure: observed max, p-value, null mean, null 95th percentile,
+                and permutation-corrected max (observed - null mean)
+    """
+    perm_dict = batch_perm_test(np.reshape(acts, (-1, 1)), labels, items_per_cat, perm_labels,
+                                act_func=act_func, batch_size=batch_size, sort_idx=sort_order)
+    return {key: values[0] for key, values in perm_dict.items()}
+
+
+def _perm_test_units(acts, labels, items_per_cat, perm_labels, act_func, batch_size,
+                     sort_idx, units):
+    """run batch_perm_test on a chunk of units (one process pool job), {unit: perm_dict}"""
+    perm_dict = batch_perm_test(acts, labels, items_per_cat, perm_labels, act_func=act_func,
+                                batch_size=batch_size, sort_idx=sort_idx)
+    return {unit: {key: values[i] for key, values in perm_dict.items()}
+            for i, unit in enumerate(units)}
+
+
+def layer_perm_test(prepared_layer, act_func='relu', n_perms=1000, batch_size=100,
+                    seed=None, n_jobs=1, verbose=False):
+    """
+    Permutation test for all (not dead) units in a layer.
+    All units use the same label permutations, and are tested together with batch_perm_test().
+
+    :param prepared_layer: PreparedLayer
+    :param act_func: relu, sigmoid or tanh
+    :param n_perms: number of label permutations
+    :param batch_size: number of permutations to do in one go (memory)
+    :param seed: for np.random.default_rng
+    :param n_jobs: if > 1, split units into chunks across a process pool
+    :param verbose: how much to print to screen
+
+    :return: dict {unit: perm_dict} (see unit_perm_test())
+    """
+    if verbose:
+        print("\n**** layer_perm_test() ****")
+
+    perm_labels = permute_labels(prepared_layer.labels, n_perms, seed=seed)
+    units = [u for u in range(prepared_layer.n_units) if not prepared_layer.dead_units[u]]
+
+    if n_jobs is None or n_jobs <= 1 or len(units) < 2:
+        return _perm_test_units(prepared_layer.acts[:, units], prepared_layer.labels,
+                                prepared_layer.items_per_cat, perm_labels, act_func,
+                                batch_size, prepared_layer.sort_idx[:, units], units)
+
+    unit_chunks = [list(chunk) for chunk in np.array_split(units, n_jobs) if len(chunk)]
+    if verbose:
+        print(f"running {len(units)} units on {len(unit_chunks)} processes")
+
+    layer_perm_dict = dict()
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        jobs = [executor.submit(_perm_test_units, prepared_layer.acts[:, chunk],
+                                prepared_layer.labels, prepared_layer.items_per_cat,
+                                perm_labels, act_func, batch_size,
+                                prepared_layer.sort_idx[:, chunk], [int(u) for u in chunk])
+                for chunk in unit_chunks]
+        for job in jobs:
+            layer_perm_dict.update(job.result())
+
+    return layer_perm_dict
+
+
+boot_measures = ('ccma', 'means', 'nz_prop', 'hi_val_prop')
+
+
+def bootstrap_sel_ci(normed_acts, labels, n_cats, ci_classes, n_boot=100, ci=95,
+                     hi_val_thr=.5, unit_chunk=64, seed=None, verbose=False):
+    """
+    Poisson bootstrap confidence intervals for ccma, means, nz_prop and hi_val_prop.
+
+    Each item gets an integer weight ~ Poisson(1) per bootstrap sample.  The weights are only used
+    to make per-class sufficient stats (weighted sums and counts), one class at a time,
+    so memory is (classes, n_boot, units in chunk) rather than anything per item.
+    The same weights are used for every unit (replicates are consistent across the layer).
+
+    :param normed_acts: (items, units) normed activations
+    :param labels: (items, ) class labels
+    :param n_cats: number of classes
+    :param ci_classes: dict {measure: (units, ) class to get the CI for}, e.g., max sel class per unit
+    :param n_boot: number of bootstrap samples
+    :param ci: width of the confidence interval (percent)
+    :param hi_val_thr: threshold for hi_val_prop
+    :param unit_chunk: number of units to do at once (memory)
+    :param seed: for np.random.default_rng
+    :param verbose: how much to print to screen
+
+    :return: dict {f'{measure}_ci_lo': (units, ), f'{measure}_ci_hi': (units, )}
+    """
+    if verbose:
+        print("\n**** bootstrap_sel_ci() ****")
+
+    normed_acts = np.asarray(normed_acts)
+    if normed_acts.ndim == 1:
+        normed_acts = normed_acts.reshape(-1, 1)
+    labels = np.asarray(labels).astype(np.int32)
+    n_units = normed_acts.shape[1]
+
+    class_perm = np.argsort(labels, kind='stable')
+    class_bounds = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=n_cats))))
+
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    lo_pc, hi_pc = (100 - ci) / 2, 100 - (100 - ci) / 2
+    ci_dict = dict()
+    for measure in ci_classes:
+        ci_dict[f'{measure}_ci_lo'] = np.full(n_units, np.nan)
+        ci_dict[f'{measure}_ci_hi'] = np.full(n_units, np.nan)
+
+    for start in range(0, n_units, unit_chunk):
+        units = np.arange(start, min(start + unit_chunk, n_units))
+
+        class_sum = np.zeros((n_cats, n_boot, len(units)), dtype=np.float32)
+        class_nz = np.zeros((n_cats, n_boot, len(units)), dtype=np.float32)
+        class_hi = np.zeros((n_cats, n_boot, len(units)), dtype=np.float32)
+        class_count = np.zeros((n_cats, n_boot), dtype=np.float32)
+
+        for this_cat in range(n_cats):
+            cat_items = class_perm[class_bounds[this_cat]:class_bounds[this_cat + 1]]
+            if len(cat_items) == 0:
+                continue
+            # # same seed per class, so each unit chunk gets the same weights
+            rng = np.random.default_rng([seed, this_cat])
+            weights = rng.poisson(1, size=(len(cat_items), n_boot)).astype(np.float32)
+            cat_acts = normed_acts[np.ix_(cat_items, units)].astype(np.float32)
+
+            class_count[this_cat] = weights.sum(axis=0)
+            class_sum[this_cat] = weights.T @ cat_acts
+            class_nz[this_cat] = weights.T @ (cat_acts > 0).astype(np.float32)
+            class_hi[this_cat] = weights.T @ (cat_acts > hi_val_thr).astype(np.float32)
+
+        count = class_count[:, :, None]
+        not_count = class_count.sum(axis=0)[None, :, None] - count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            boot_dict = {'means': class_sum / count,
+                         'nz_prop': class_nz / count,
+                         'hi_val_prop': class_hi / count}
+            not_class_mean = (class_sum.sum(axis=0)[None] - class_sum) / not_count
+            boot_dict['ccma'] = ((boot_dict['means'] - not_class_mean) /
+                                 (boot_dict['means'] + not_class_mean))
+
+        for measure, unit_classes in ci_classes.items():
+            unit_classes = np.asarray(unit_classes)[units]
+            # # (n_boot, units) values for each unit's class
+            boot_vals = boot_dict[measure][unit_classes, :, np.arange(len(units))].T
+            with np.errstate(invalid='ignore'):
+                ci_dict[f'{measure}_ci_lo'][units] = np.nanpercentile(boot_vals, lo_pc, axis=0)
+                ci_dict[f'{measure}_ci_hi'][units] = np.nanpercentile(boot_vals, hi_pc, axis=0)
+
+    return ci_dict
+
+
+tensor_measures = ('roc_auc', 'ave_prec', 'pr_auc',
+                   'max_informed', 'max_info_count', 'max_info_thr',
+                   'max_info_sens', 'max_info_spec', 'max_info_prec',
+                   'ccma', 'b_sel', 'b_sel_off', 'zhou_prec', 'zhou_selects', 'zhou_thr',
+                   'means', 'sd', 'nz_count', 'nz_prop', 'nz_prec',
+                   'hi_val_count', 'hi_val_prop', 'hi_val_prec')
+
+
+def _tie_runs(sorted_acts):
+    """
+    For activations sorted descending (items, cols), the runs of tied values.
+
+    :return: run_start, run_end: first position and (last position + 1) of each item's run,
+                run_number: 0, 1, 2... per column
+    """
+    n_items = sorted_acts.shape[0]
+    pos = np.arange(n_items)[:, None]
+
+    new_run = np.ones(sorted_acts.shape, dtype=bool)
+    new_run[1:] = sorted_acts[1:] != sorted_acts[:-1]
+    last_in_run = np.ones(sorted_acts.shape, dtype=bool)
+    last_in_run[:-1] = new_run[1:]
+
+    run_start = np.maximum.accumulate(np.where(new_run, pos, 0), axis=0)
+    run_end = np.minimum.accumulate(np.where(last_in_run, pos, n_items)[::-1], axis=0)[::-1] + 1
+    run_number = np.cumsum(new_run, axis=0) - 1
+
+    return run_start, run_end, run_number
+
+
+def _roc_curve_measures(tp, n_pos, n_neg, sorted_acts, last_in_run):
+    """
+    ROC measures from true positives down each sorted column, as nick_roc_stuff().
+    Thresholds are at the end of each run of tied values, and as roc_curve(drop_intermediate=True)
+    a threshold is dropped if it is collinear with its neighbours on the roc curve.
+    So max_info_count is the index on the dropped curve (the (0, 0) point is index 0),
+    and ave_prec and pr_auc only use the kept thresholds.
+
+    :param tp: (items, cols, classes) cumulative true positives, items sorted by descending act
+    :param n_pos: (cols, classes), or broadcastable, items in the class
+    :param n_neg: as n_pos, items not in the class
+    :param sorted_acts: (items, cols) activations sorted descending
+    :param last_in_run: (items, cols) True for the last item of each run of tied values
+
+    :return: dict {measure: (cols, classes)} for ave_prec, pr_auc, max_informed and max_info_*
+    """
+    n_items = tp.shape[0]
+    pos = np.arange(n_items)[:, None]
+    n_above = (pos + 1)[:, :, None]
+
+    def at(values, idx):
+        return np.take_along_axis(values, idx, axis=0)
+
+    # # neighbouring thresholds (-1 or n_items if there isn't one)
+    prev_thr = np.full(last_in_run.shape, -1)
+    prev_thr[1:] = np.maximum.accumulate(np.where(last_in_run, pos, -1), axis=0)[:-1]
+    next_thr = np.full(last_in_run.shape, n_items)
+    next_thr[:-1] = np.minimum.accumulate(np.where(last_in_run, pos, n_items)[::-1],
+                                          axis=0)[::-1][1:]
+
+    # # keep the first and last thresholds, and any with a second difference in tp or fp
+    tp_diff2 = (at(tp, np.clip(next_thr, 0, n_items - 1)[:, :, None]) - 2 * tp +
+                at(tp, np.clip(prev_thr, 0, n_items - 1)[:, :, None]))
+    fp_diff2 = (next_thr - 2 * pos + prev_thr)[:, :, None] - tp_diff2
+    kept = last_in_run[:, :, None] & (((prev_thr < 0) | (next_thr == n_items))[:, :, None] |
+                                      (tp_diff2 != 0) | (fp_diff2 != 0))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # # same arithmetic as nick_roc_stuff(), so equal informedness is the same float
+        informed = tp / n_pos + (1 - (n_above - tp) / n_neg) - 1
+        precision = tp / n_above
+
+        # # increase in recall (and precision) since the previous kept threshold or (0, 0)
+        prev_kept = np.full(kept.shape, -1)
+        prev_kept[1:] = np.maximum.accumulate(np.where(kept, pos[:, :, None], -1), axis=0)[:-1]
+        prev_idx = np.maximum(prev_kept, 0)
+        tp_before = np.where(prev_kept >= 0, at(tp, prev_idx), 0)
+        prec_before = np.where(prev_kept >= 0, at(precision, prev_idx), 0)
+        recall_gain = np.where(kept, tp - tp_before, 0) / n_pos
+
+        roc_dict = {'ave_prec': np.sum(precision * recall_gain, axis=0),
+                    'pr_auc': np.sum(recall_gain * (precision + prec_before) / 2, axis=0)}
+
+    informed = np.where(kept & np.isfinite(informed), informed, -np.inf)
+    best = np.argmax(informed, axis=0)[None]
+    max_informed = at(informed, best)[0]
+    best_tp = at(tp, best)[0]
+    best_above = best[0] + 1
+    above_zero = max_informed > 0
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        roc_dict.update({
+            'max_informed': np.where(above_zero, max_informed, 0),
+            'max_info_count': np.where(above_zero, at(np.cumsum(kept, axis=0), best)[0], 0),
+            'max_info_thr': np.where(above_zero, at(sorted_acts[:, :, None], best)[0], 0),
+            'max_info_sens': np.where(above_zero, best_tp / n_pos, 0),
+            'max_info_spec': np.where(above_zero, 1 - (best_above - best_tp) / n_neg, 1),
+            'max_info_prec': np.where(above_zero, best_tp / best_above, 0)})
+
+    return roc_dict
+
+
+def default_zhou_selects(n_items):
+    """number of most active items used for zhou_prec (same cut-offs as rnn_sel)"""
+    zhou_cut_off = .005
+    if n_items < 20000:
+        zhou_cut_off = 100 / n_items
+    if n_items < 100:
+        zhou_cut_off = 1 / n_items
+    return int(n_items * zhou_cut_off)
+
+
+def columns_sel(acts, labels, n_cats, act_func='relu', zhou_selects=None, hi_val_thr=.5):
+    """
+    Selectivity measures for many columns (e.g., flattened timestep/unit) at once,
+    each column with its own labels.  Same values as rnn_sel does per unit/timestep/class:
+        relu: normed acts for everything.
+        tanh: acts, but (acts + 1) normed for ccma and b_sel.
+        sigmoid: acts, hi_val_thr = .75.
+
+    All class stats are bincounts on (class, column) keys.  ROC measures use one descending sort
+    per column: roc_auc from rank sums (mean rank for ties), and the rest from the cumulative sum
+    of each class down the sorted items (see _roc_curve_measures()), with the same dropped
+    thresholds as nick_roc_stuff().
+
+    :param acts: (items, cols) activations
+    :param labels: (items, cols) class labels
+    :param n_cats: number of classes
+    :param act_func: relu, sigmoid or tanh
+    :param zhou_selects: number of top items for zhou_prec (int or (cols, ) array).
+                        If None, use default_zhou_selects().
+    :param hi_val_thr: threshold for hi_val measures
+
+    :return: dict {measure: (n_cats, cols) array} for each of tensor_measures
+    """
+    acts = np.asarray(acts, dtype=float)
+    labels = np.asarray(labels).astype(np.int64)
+    n_items, n_cols = acts.shape
+    cols = np.arange(n_cols)
+    n_flat = n_cats * n_cols
+
+    sel_acts = acts
+    ccma_acts = acts
+    if act_func in ['relu', 'ReLu', 'Relu']:
+        max_act = acts.max(axis=0)
+        sel_acts = ccma_acts = acts / np.where(max_act == 0, 1, max_act)
+    elif act_func == 'tanh':
+        max_act = (acts + 1).max(axis=0)
+        ccma_acts = (acts + 1) / np.where(max_act == 0, 1, max_act)
+    if act_func == 'sigmoid':
+        hi_val_thr = .75
+
+    flat_key = (labels * n_cols + cols).ravel()
+
+    def class_sum(weights=None):
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float).ravel()
+        return np.bincount(flat_key, weights=weights, minlength=n_flat).reshape(n_cats, n_cols)
+
+    items_per_cat = class_sum()
+    n_not = n_items - items_per_cat
+    empty = items_per_cat * n_not == 0
+
+    # # class_sel_basics
+    sums = class_sum(sel_acts)
+    nz_count = class_sum(sel_acts > 0)
+    hi_val_count = class_sum(sel_acts > hi_val_thr)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / items_per_cat
+        var = (class_sum(sel_acts ** 2) - sums * means) / (items_per_cat - 1)
+        sd = np.sqrt(np.maximum(var, 0))
+        sd[items_per_cat < 2] = 0
+        sel_dict = {'means': means, 'sd': sd,
+                    'nz_count': nz_count,
+                    'nz_prop': np.where(items_per_cat > 0, nz_count / items_per_cat, 0),
+                    'nz_prec': np.where(nz_count > 0, nz_count / nz_count.sum(axis=0), 0),
+                    'hi_val_count': hi_val_count,
+                    'hi_val_prop': np.where(items_per_cat > 0, hi_val_count / items_per_cat, 0),
+                    'hi_val_prec': np.where(hi_val_count > 0,
+                                            hi_val_count / hi_val_count.sum(axis=0), 0)}
+
+        # # ccma
+        ccma_sums = class_sum(ccma_acts)
+        class_mean = ccma_sums / items_per_cat
+        not_class_mean = (ccma_sums.sum(axis=0) - ccma_sums) / n_not
+        ccma = (class_mean - not_class_mean) / (class_mean + not_class_mean)
+    ccma[empty] = np.nan
+    sel_dict['ccma'] = ccma
+
+    # # b_sel (on or off, whichever is bigger)
+    class_min = np.full(n_flat, np.inf)
+    np.minimum.at(class_min, flat_key, ccma_acts.ravel())
+    class_max = np.full(n_flat, -np.inf)
+    np.maximum.at(class_max, flat_key, ccma_acts.ravel())
+    class_min = np.where(np.isinf(class_min), np.nan, class_min).reshape(n_cats, n_cols)
+    class_max = np.where(np.isinf(class_max), np.nan, class_max).reshape(n_cats, n_cols)
+    not_class_min = _excluding_each(class_min.T, n_not.T, find_max=False).T
+    not_class_max = _excluding_each(class_max.T, n_not.T, find_max=True).T
+    b_sel_on = class_min - not_class_max
+    b_sel_off = not_class_min - class_max
+    sel_dict['b_sel'] = np.where(b_sel_on >= b_sel_off, b_sel_on, b_sel_off)
+    sel_dict['b_sel'][empty] = np.nan
+    sel_dict['b_sel_off'] = (b_sel_on < b_sel_off) & ~empty
+
+    # # sort each column by descending activation
+    order = np.argsort(-sel_acts, axis=0, kind='stable')
+    sorted_acts = np.take_along_axis(sel_acts, order, axis=0)
+    sorted_key = np.take_along_axis(labels, order, axis=0) * n_cols + cols
+    run_start, run_end, _ = _tie_runs(sorted_acts)
+
+    # # roc_auc from rank sums, ranks ascending from 1
+    ranks = n_items - (run_start + run_end - 1) / 2
+    rank_sums = np.bincount(sorted_key.ravel(), weights=ranks.ravel(),
+                            minlength=n_flat).reshape(n_cats, n_cols)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        roc_auc = (rank_sums - items_per_cat * (items_per_cat + 1) / 2) / (items_per_cat * n_not)
+    roc_auc[empty] = 0
+    sel_dict['roc_auc'] = roc_auc
+
+    # # ave_prec, pr_auc and max informedness from true positives for every class down each
+    # # sorted column, a chunk of columns at a time (memory is items * columns * n_cats)
+    last_in_run = run_end == np.arange(n_items)[:, None] + 1
+    col_step = max(1, max_chunk_size // (n_items * n_cats))
+    for start in range(0, n_cols, col_step):
+        chunk = slice(start, min(start + col_step, n_cols))
+        sorted_labels = np.take_along_axis(labels[:, chunk], order[:, chunk], axis=0)
+        tp = np.cumsum(sorted_labels[:, :, None] == np.arange(n_cats), axis=0, dtype=np.int32)
+        roc_dict = _roc_curve_measures(tp, items_per_cat[:, chunk].T, n_not[:, chunk].T,
+                                       sorted_acts[:, chunk], last_in_run[:, chunk])
+        for measure, values in roc_dict.items():
+            if measure not in sel_dict:
+                sel_dict[measure] = np.zeros((n_cats, n_cols))
+            sel_dict[measure][:, chunk] = values.T
+    for measure in roc_dict:
+        sel_dict[measure][empty] = 0
+
+    # # zhou_prec: proportion of the top zhou_selects items from this class
+    if zhou_selects is None:
+        zhou_selects = default_zhou_selects(n_items)
+    zhou_selects = np.clip(np.broadcast_to(zhou_selects, n_cols), 1, n_items)
+    in_top = np.arange(n_items)[:, None] < zhou_selects
+    top_count = np.bincount(sorted_key[in_top], minlength=n_flat).reshape(n_cats, n_cols)
+
+    sel_dict['zhou_prec'] = np.where(empty, 0, top_count / zhou_selects)
+    sel_dict['zhou_selects'] = np.where(empty, 0, np.broadcast_to(zhou_selects, (n_cats, n_cols)))
+    sel_dict['zhou_thr'] = np.where(empty, np.nan,
+                                    np.broadcast_to(sorted_acts[zhou_selects - 1, cols],
+                                                    (n_cats, n_cols)))
+
+    return sel_dict
+
+
+def batch_class_corr(acts, output_acts):
+    """
+    Pearson's correlation (and 2-tailed p, rounded to 3) between every unit
+    and every output class, as class_correlation() but as one matrix product.
+
+    :param acts: (items, units) activations
+    :param output_acts: (items, n_cats) output activations
+
+    :return: coef, p: (units, n_cats) arrays
+    """
+    acts = np.asarray(acts, dtype=float)
+    output_acts = np.asarray(output_acts, dtype=float)
+    df = len(acts) - 2
+
+    acts = acts - acts.mean(axis=0)
+    output_acts = output_acts - output_acts.mean(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        coef = (acts.T @ output_acts) / np.outer(np.linalg.norm(acts, axis=0),
+                                                 np.linalg.norm(output_acts, axis=0))
+        coef = np.clip(coef, -1, 1)
+        t_sq = coef ** 2 * df / (1 - coef ** 2)
+        p = betainc(df / 2, .5, df / (df + t_sq))
+
+    return coef, np.round(p, 3)
+
+
+def tensor_sel(layer_acts, label_seqs, n_cats, act_func='relu', zhou_selects=None,
+               output_acts=None, hi_val_thr=.5, col_chunk=1024, verbose=False):
+    """
+    Selectivity for a whole RNN layer in one go.
+    The (items, timesteps, units) layer is flattened to (items, timesteps * units) columns,
+    and each column uses the labels for its timestep (label_seqs[:, ts]),
+    so all units and timesteps go through columns_sel() together.
+
+    :param layer_acts: (items, timesteps, units) activations (can be a memmap)
+    :param label_seqs: (items, timesteps) class labels
+    :param n_cats: number of classes
+    :param act_func: relu, sigmoid or tanh
+    :param zhou_selects: int, or (timesteps, ) array, see columns_sel()
+    :param output_acts: if not None, (items, timesteps, n_cats) output activations for class corr
+    :param hi_val_thr: threshold for hi_val measures
+    :param col_chunk: number of columns to do at once (memory)
+    :param verbose: how much to print to screen
+
+    :return: dict {measure: (timesteps, units, n_cats) array}
+                (plus corr_coef and corr_p if output_acts is not None)
+    """
+    if verbose:
+        print("\n**** tensor_sel() ****")
+
+    n_items, timesteps, n_units = np.shape(layer_acts)
+    n_cols = timesteps * n_units
+    flat_acts = np.reshape(layer_acts, (n_items, n_cols))
+    label_seqs = np.asarray(label_seqs).astype(np.int64)
+    col_ts = np.repeat(np.arange(timesteps), n_units)
+
+    if zhou_selects is None:
+        zhou_selects = default_zhou_selects(n_items)
+    col_zhou = np.broadcast_to(zhou_selects, timesteps)[col_ts]
+
+    flat_dict = {measure: np.zeros((n_cats, n_cols)) for measure in tensor_measures}
+    for start in range(0, n_cols, col_chunk):
+        chunk = slice(start, min(start + col_chunk, n_cols))
+        if verbose:
+            print(f"columns {chunk.start}-{chunk.stop} of {n_cols}")
+        chunk_dict = columns_sel(flat_acts[:, chunk], label_seqs[:, col_ts[chunk]], n_cats,
+                                 act_func=act_func, zhou_selects=col_zhou[chunk],
+                                 hi_val_thr=hi_val_thr)
+        for measure in tensor_measures:
+            flat_dict[measure][:, chunk] = chunk_dict[measure]
+
+    tensor_dict = {measure: values.T.reshape(timesteps, n_units, n_cats)
+                   for measure, values in flat_dict.items()}
+
+    if output_acts is not None:
+        tensor_dict['corr_coef'] = np.zeros((timesteps, n_units, n_cats))
+        tensor_dict['corr_p'] = np.ones((timesteps, n_units, n_cats))
+        for timestep in range(timesteps):
+            items_per_cat = np.bincount(label_seqs[:, timestep], minlength=n_cats)
+            has_items = items_per_cat * (n_items - items_per_cat) > 0
+            coef, p = batch_class_corr(np.asarray(layer_acts[:, timestep, :]),
+                                       output_acts[:, timestep, :])
+            tensor_dict['corr_coef'][timestep][:, has_items] = coef[:, has_items]
+            tensor_dict['corr_p'][timestep][:, has_items] = p[:, has_items]
+
+    return tensor_dict
+
+
+def tensor_sel_max(tensor_dict):
+    """
+    Most selective class for each measure, for every timestep and unit (as sel_unit_max()).
+    NaNs are ignored and ties go to the lowest class.
+    max_info_(count, thr, sens, spec, prec) are for the max_informed class,
+    zhou_selects and zhou_thr for the zhou_prec class.
+
+    :param tensor_dict: from tensor_sel(), {measure: (timesteps, units, n_cats)}
+
+    :return: dict {measure: (timesteps, units), f'{measure}_c': (timesteps, units)}
+    """
+    max_dict = dict()
+    for measure, values in tensor_dict.items():
+        values = np.asarray(values, dtype=float)
+        max_class = np.argmax(np.where(np.isnan(values), -np.inf, values), axis=-1)
+        max_dict[measure] = np.take_along_axis(values, max_class[..., None], axis=-1)[..., 0]
+        max_dict[f'{measure}_c'] = max_class
+
+    for measure, use_class in [('max_info_count', 'max_informed_c'),
+                               ('max_info_thr', 'max_informed_c'),
+                               ('max_info_sens', 'max_informed_c'),
+                               ('max_info_spec', 'max_informed_c'),
+                               ('max_info_prec', 'max_informed_c'),
+                               ('zhou_selects', 'zhou_prec_c'),
+                               ('zhou_thr', 'zhou_prec_c')]:
+        max_dict[measure] = np.take_along_axis(np.asarray(tensor_dict[measure], dtype=float),
+                                               max_dict[use_class][..., None], axis=-1)[..., 0]
+        del max_dict[f'{measure}_c']
+
+    return max_dict
+
+
+def letters_sel(acts, y_letters, act_func='relu', zhou_selects=None, hi_val_thr=.5,
+                unit_chunk=64):
+    """
+    Binary (this letter vs not) selectivity for every letter and every unit at once,
+    as rnn_sel(letter_sel=True) does one letter at a time.
+    Items can have several letters, so y_letters is a multi-label (items, n_letters) matrix.
+
+    Each unit is sorted once (descending) and y_letters is put in that order, then the cumulative
+    sum down the items gives true positives for every letter at every threshold
+    (ROC measures as nick_roc_stuff(), see _roc_curve_measures()).
+    Class sums (means, sd, nz, hi_val, ccma) are matrix products with y_letters.
+    Normalisation as columns_sel().
+
+    :param acts: (items, units) activations
+    :param y_letters: (items, n_letters) binary, 1 if the item contains the letter
+    :param act_func: relu, sigmoid or tanh
+    :param zhou_selects: number of top items for zhou_prec.  If None, use default_zhou_selects().
+    :param hi_val_thr: threshold for hi_val measures
+    :param unit_chunk: number of units to do at once (memory is items * unit_chunk * n_letters)
+
+    :return: dict {measure: (n_letters, units) array} for each of tensor_measures
+    """
+    acts = np.asarray(acts, dtype=float)
+    if acts.ndim == 1:
+        acts = acts.reshape(-1, 1)
+    y_letters = np.asarray(y_letters).astype(bool)
+    n_items, n_units = acts.shape
+    n_letters = y_letters.shape[1]
+
+    sel_acts = acts
+    ccma_acts = acts
+    if act_func in ['relu', 'ReLu', 'Relu']:
+        max_act = acts.max(axis=0)
+        sel_acts = ccma_acts = acts / np.where(max_act == 0, 1, max_act)
+    elif act_func == 'tanh':
+        max_act = (acts + 1).max(axis=0)
+        ccma_acts = (acts + 1) / np.where(max_act == 0, 1, max_act)
+    if act_func == 'sigmoid':
+        hi_val_thr = .75
+
+    y_float = y_letters.astype(float)
+    letter_size = y_float.sum(axis=0)[:, None]
+    not_size = n_items - letter_size
+    empty = np.broadcast_to(letter_size * not_size == 0, (n_letters, n_units))
+
+    # # class_sel_basics for the letter class
+    sums = y_float.T @ sel_acts
+    nz_count = y_float.T @ (sel_acts > 0)
+    hi_val_count = y_float.T @ (sel_acts > hi_val_thr)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / letter_size
+        var = (y_float.T @ sel_acts ** 2 - sums * means) / (letter_size - 1)
+        sd = np.sqrt(np.maximum(var, 0))
+        sd[np.broadcast_to(letter_size < 2, sd.shape)] = 0
+        nz_total = np.sum(sel_acts > 0, axis=0)
+        hi_val_total = np.sum(sel_acts > hi_val_thr, axis=0)
+        sel_dict = {'means': np.where(letter_size > 0, means, 0),
+                    'sd': sd,
+                    'nz_count': nz_count,
+                    'nz_prop': np.where(letter_size > 0, nz_count / letter_size, 0),
+                    'nz_prec': np.where(nz_count > 0, nz_count / nz_total, 0),
+                    'hi_val_count': hi_val_count,
+                    'hi_val_prop': np.where(letter_size > 0, hi_val_count / letter_size, 0),
+                    'hi_val_prec': np.where(hi_val_count > 0, hi_val_count / hi_val_total, 0)}
+
+        # # ccma
+        ccma_sums = y_float.T @ ccma_acts
+        class_mean = ccma_sums / letter_size
+        not_class_mean = (ccma_acts.sum(axis=0) - ccma_sums) / not_size
+        ccma = (class_mean - not_class_mean) / (class_mean + not_class_mean)
+    ccma[empty] = np.nan
+    sel_dict['ccma'] = ccma
+
+    if zhou_selects is None:
+        zhou_selects = default_zhou_selects(n_items)
+    zhou_selects = int(np.clip(zhou_selects, 1, n_items))
+
+    for measure in tensor_measures:
+        if measure not in sel_dict:
+            sel_dict[measure] = np.zeros((n_letters, n_units))
+
+    pos = np.arange(n_items)
+    for start in range(0, n_units, unit_chunk):
+        units = np.arange(start, min(start + unit_chunk, n_units))
+
+        order = np.argsort(-sel_acts[:, units], axis=0, kind='stable')
+        sorted_acts = np.take_along_axis(sel_acts[:, units], order, axis=0)
+        sorted_ccma = np.take_along_axis(ccma_acts[:, units], order, axis=0)
+        run_start, run_end, _ = _tie_runs(sorted_acts)
+        last_in_run = run_end == pos[:, None] + 1
+
+        # # (items, units, letters): letters in sorted order, and true positives above each item
+        sorted_y = y_letters[order]
+        tp = np.cumsum(sorted_y, axis=0, dtype=np.int32)
+
+        # # roc_auc from rank sums, ranks ascending from 1 (item order)
+        ranks = np.empty(order.shape)
+        np.put_along_axis(ranks, order, n_items - (run_start + run_end - 1) / 2, axis=0)
+        rank_sums = y_float.T @ ranks
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sel_dict['roc_auc'][:, units] = ((rank_sums - letter_size * (letter_size + 1) / 2) /
+                                             (letter_size * not_size))
+
+        roc_dict = _roc_curve_measures(tp, letter_size.T, not_size.T, sorted_acts, last_in_run)
+        for measure, values in roc_dict.items():
+            sel_dict.setdefault(measure, np.zeros((n_letters, n_units)))[:, units] = values.T
+
+        # # b_sel: first/last letter (and not letter) item in sorted order give max/min
+        first_in = np.argmax(sorted_y, axis=0)
+        last_in = n_items - 1 - np.argmax(sorted_y[::-1], axis=0)
+        first_out = np.argmax(~sorted_y, axis=0)
+        last_out = n_items - 1 - np.argmax(~sorted_y[::-1], axis=0)
+        unit_cols = np.arange(len(units))[:, None]
+        b_sel_on = sorted_ccma[last_in, unit_cols] - sorted_ccma[first_out, unit_cols]
+        b_sel_off = sorted_ccma[last_out, unit_cols] - sorted_ccma[first_in, unit_cols]
+        sel_dict['b_sel'][:, units] = np.where(b_sel_on >= b_sel_off, b_sel_on, b_sel_off).T
+        sel_dict['b_sel_off'][:, units] = (b_sel_on < b_sel_off).T
+
+        # # zhou_prec
+        sel_dict['zhou_prec'][:, units] = tp[zhou_selects - 1].T / zhou_selects
+        sel_dict['zhou_selects'][:, units] = zhou_selects
+        sel_dict['zhou_thr'][:, units] = sorted_acts[zhou_selects - 1]
+
+    sel_dict['b_sel_off'] = sel_dict['b_sel_off'].astype(bool)
+    for measure in sel_dict:
+        if measure in ['ccma', 'b_sel', 'zhou_thr']:
+            sel_dict[measure][empty] = np.nan
+        elif measure == 'max_info_spec':
+            sel_dict[measure][empty] = 0
+        elif measure not in ['means', 'sd', 'nz_count', 'nz_prop', 'nz_prec',
+                             'hi_val_count', 'hi_val_prop', 'hi_val_prec']:
+            sel_dict[measure][empty] = 0
+
+    return sel_dict
+
+
+def tensor_letters_sel(layer_acts, y_letters, act_func='relu', zhou_selects=None,
+                       hi_val_thr=.5, unit_chunk=64, verbose=False):
+    """
+    letters_sel() for a whole RNN layer, one timestep at a time.
+
+    :param layer_acts: (items, timesteps, units) activations (can be a memmap)
+    :param y_letters: (items, timesteps, n_letters) binary
+    :param act_func: relu, sigmoid or tanh
+    :param zhou_selects: int, or (timesteps, ) array
+    :param hi_val_thr: threshold for hi_val measures
+    :param unit_chunk: number of units to do at once (memory)
+    :param verbose: how much to print to screen
+
+    :return: dict {measure: (timesteps, units, n_letters) array}
+    """
+    if verbose:
+        print("\n**** tensor_letters_sel() ****")
+
+    n_items, timesteps, n_units = np.shape(layer_acts)
+    if zhou_selects is None:
+        zhou_selects = default_zhou_selects(n_items)
+    ts_zhou = np.broadcast_to(zhou_selects, timesteps)
+
+    tensor_dict = dict()
+    for timestep in range(timesteps):
+        ts_dict = letters_sel(np.asarray(layer_acts[:, timestep, :]), y_letters[:, timestep],
+                              act_func=act_func, zhou_selects=ts_zhou[timestep],
+                              hi_val_thr=hi_val_thr, unit_chunk=unit_chunk)
+        for measure, values in ts_dict.items():
+            if measure not in tensor_dict:
+                tensor_dict[measure] = np.zeros((timesteps, n_units, values.shape[0]),
+                                                dtype=values.dtype)
+            tensor_dict[measure][timestep] = values.T
+
+    return tensor_dict
@@ -0,0 +1,220 @@
+import os
+import pickle
+import sqlite3
+
+import numpy as np
+
+
+'''Append-only store for selectivity results.
+
+rnn_sel used to re-pickle the whole all_sel_dict and max_sel_dict after every unit/timestep,
+which writes O(N^2) bytes over a run and means unpickling everything to resume.
+
+Here, each unit/timestep is appended as rows to a sqlite db (one transaction per unit/timestep).
+    sel_values: layer, unit, timestep, measure, class, value   (all_sel_dict)
+    sel_max:    layer, unit, timestep, measure, value          (max_sel_dict)
+    sel_layers: layer, layer_order                             (network order of layers)
+
+Resuming is an index lookup on (layer, unit).
+The nested dicts (same layout as the old pickles) are only made on demand.
+'''
+
+# # timestep value used for non-sequence data (sqlite primary keys and NULL don't mix)
+no_ts = -1
+
+
+def _to_py(value):
+    """sqlite3 won't take numpy ints/bools, so convert numpy scalars to python types."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def open_sel_store(store_path, verbose=False):
+    """
+    Open (or make) a sqlite selectivity store.
+
+    :param store_path: path to .db file
+    :param verbose: how much to print to screen
+
+    :return: sqlite3 connection
+    """
+    if verbose:
+        print("\n**** open_sel_store() ****")
+
+    new_store = not os.path.isfile(store_path)
+
+    conn = sqlite3.connect(store_path)
+
+    # # class and value columns have no declared type so ints, floats and strings are kept as is.
+    conn.execute("CREATE TABLE IF NOT EXISTS sel_values ("
+                 "layer TEXT NOT NULL, unit INTEGER NOT NULL, timestep INTEGER NOT NULL, "
+                 "measure TEXT NOT NULL, class NOT NULL, value, "
+                 "PRIMARY KEY (layer, unit, timestep, measure, class))")
+    conn.execute("CREATE TABLE IF NOT EXISTS sel_max ("
+                 "layer TEXT NOT NULL, unit INTEGER NOT NULL, timestep INTEGER NOT NULL, "
+                 "measure TEXT NOT NULL, value, "
+                 "PRIMARY KEY (layer, unit, timestep, measure))")
+    conn.execute("CREATE TABLE IF NOT EXISTS sel_layers ("
+                 "layer TEXT PRIMARY KEY, layer_order INTEGER NOT NULL)")
+    conn.commit()
+
+    if verbose:
+        if new_store:
+            print(f"made new sel store: {store_path}")
+        else:
+            print(f"opened sel store: {store_path}")
+
+    return conn
+
+
+def append_unit_sel(conn, layer_name, unit_index, timestep,
+                    unit_ts_dict, max_sel_p_unit_dict):
+    """
+    Append the results for one unit/timestep to the store.
+    Written as a single transaction, so a crash never leaves half a unit/timestep.
+    Re-running a unit/timestep replaces the old rows.
+
+    :param conn: sqlite3 connection from open_sel_store()
+    :param layer_name: name of layer
+    :param unit_index: unit number
+    :param timestep: timestep number or None for non-sequence data
+    :param unit_ts_dict: {measure: {class: value}}
+    :param max_sel_p_unit_dict: {measure: value} from sel_unit_max()
+    """
+    if timestep is None:
+        timestep = no_ts
+    unit_index = int(unit_index)
+    timestep = int(timestep)
+
+    value_rows = [(layer_name, unit_index, timestep, measure, _to_py(this_class), _to_py(value))
+                  for measure, class_dict in unit_ts_dict.items()
+                  for this_class, value in class_dict.items()]
+
+    max_rows = [(layer_name, unit_index, timestep, measure, _to_py(value))
+                for measure, value in max_sel_p_unit_dict.items()]
+
+    with conn:
+        # # layers are numbered as they are first seen, so the dicts keep network order
+        conn.execute("INSERT OR IGNORE INTO sel_layers VALUES (?, (SELECT COUNT(*) FROM sel_layers))",
+                     (layer_name,))
+        conn.executemany("INSERT OR REPLACE INTO sel_values VALUES (?, ?, ?, ?, ?, ?)", value_rows)
+        conn.executemany("INSERT OR REPLACE INTO sel_max VALUES (?, ?, ?, ?, ?)", max_rows)
+
+
+def get_already_completed(conn, timesteps=None, verbose=False):
+    """
+    Find the last completed unit in each layer (for loop_thru_acts(already_completed)).
+    If a unit doesn't have all of its timesteps it is not complete, so it'll be run again.
+
+    :param conn: sqlite3 connection from open_sel_store()
+    :param timesteps: number of timesteps per unit (None for non-sequence data)
+    :param verbose: how much to print to screen
+
+    :return: dict {layer_name: last completed unit}
+    """
+    if verbose:
+        print("\n**** get_already_completed() ****")
+
+    n_ts = 1
+    if timesteps is not None:
+        n_ts = timesteps
+
+    already_completed = dict()
+    rows = conn.execute("SELECT layer, unit, COUNT(DISTINCT timestep) FROM sel_max "
+                        "GROUP BY layer, unit ORDER BY layer, unit").fetchall()
+
+    for layer_name, unit_index, ts_done in rows:
+        # # units are run in order, so only the last one can be partial (it'll be run again).
+        # # dead units are never stored, so there can be gaps.
+        if ts_done < n_ts:
+            continue
+        already_completed[layer_name] = unit_index
+
+    if verbose:
+        print(f"already_completed: {already_completed}")
+
+    return already_completed
+
+
+def sel_store_to_dicts(store_path, sequence_data=True, layer_name=None, verbose=False):
+    """
+    Make the nested dicts from the store, same layout as the old pickles.
+    Layers are in the order they were analysed (network order), measures and classes as appended.
+        sequence data:  [layer][unit][ts_name][measure][class]
+        otherwise:      [layer][unit][measure][class]
+
+    :param store_path: path to .db file (or a sqlite3 connection)
+    :param sequence_data: if True, add timestep level, e.g., 'ts0'
+    :param layer_name: if not None, only get this layer
+    :param verbose: how much to print to screen
+
+    :return: all_sel_dict, max_sel_dict
+    """
+    if verbose:
+        print("\n**** sel_store_to_dicts() ****")
+
+    if type(store_path) is sqlite3.Connection:
+        conn = store_path
+    else:
+        conn = sqlite3.connect(store_path)
+
+    where = ''
+    params = ()
+    if layer_name is not None:
+        where = ' WHERE s.layer = ?'
+        params = (layer_name,)
+
+    all_sel_dict = dict()
+    for layer, unit, timestep, measure, this_class, value in conn.execute(
+            f"SELECT s.* FROM sel_values AS s JOIN sel_layers AS l ON s.layer = l.layer{where} "
+            f"ORDER BY l.layer_order, s.unit, s.timestep, s.rowid", params):
+        unit_dict = all_sel_dict.setdefault(layer, dict()).setdefault(unit, dict())
+        if sequence_data:
+            unit_dict = unit_dict.setdefault(f"ts{timestep}", dict())
+        unit_dict.setdefault(measure, dict())[this_class] = value
+
+    max_sel_dict = dict()
+    for layer, unit, timestep, measure, value in conn.execute(
+            f"SELECT s.* FROM sel_max AS s JOIN sel_layers AS l ON s.layer = l.layer{where} "
+            f"ORDER BY l.layer_order, s.unit, s.timestep, s.rowid", params):
+        unit_dict = max_sel_dict.setdefault(layer, dict()).setdefault(unit, dict())
+        if sequence_data:
+            unit_dict = unit_dict.setdefault(f"ts{timestep}", dict())
+        unit_dict[measure] = value
+
+    if type(store_path) is not sqlite3.Connection:
+        conn.close()
+
+    return all_sel_dict, max_sel_dict
+
+
+def sel_store_to_pickles(store_path, all_sel_dict_name, max_sel_dict_name,
+                         sequence_data=True, verbose=False):
+    """
+    Write the legacy all_sel_dict and max_sel_dict pickles from the store (once, at the end),
+    so get_sel_summaries() etc can still use them.
+
+    :param store_path: path to .db file (or a sqlite3 connection)
+    :param all_sel_dict_name: path to save all_sel_dict pickle
+    :param max_sel_dict_name: path to save max_sel_dict pickle
+    :param sequence_data: if True, add timestep level, e.g., 'ts0'
+    :param verbose: how much to print to screen
+
+    :return: all_sel_dict, max_sel_dict
+    """
+    if verbose:
+        print("\n**** sel_store_to_pickles() ****")
+
+    all_sel_dict, max_sel_dict = sel_store_to_dicts(store_path, sequence_data=sequence_data,
+                                                    verbose=verbose)
+
+    with open(all_sel_dict_name, "wb") as pickle_out:
+        pickle.dump(all_sel_dict, pickle_out, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(max_sel_dict_name, "wb") as pickle_out:
+        pickle.dump(max_sel_dict, pickle_out, protocol=pickle.HIGHEST_PROTOCOL)
+
+    if verbose:
+        print(f"saved:\n{all_sel_dict_name}\n{max_sel_dict_name}")
+
+    return all_sel_dict, max_sel_dict
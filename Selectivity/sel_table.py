@@ -0,0 +1,344 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from tools.dicts import load_dict
+
+
+'''Columnar selectivity results.
+
+Nested sel_per_unit dicts ([layer][unit]([ts])[measure][class]) are flattened into
+one row per layer/unit/timestep/measure/class, stored as typed columns:
+    layer       int16   (code into layer_names)
+    unit        int32
+    timestep    int16   (-1 for non-sequence data)
+    measure     int16   (code into measure_names)
+    class       labels as given (int, or str if any labels are strings, e.g., 'total')
+    value       float32
+
+Saved with np.savez_compressed, so each column can be loaded on its own.
+The query functions (top_k_units, filter_sel_units, best_unit_per_class, layer_class_values)
+are vectorized and don't need the nested dict.
+'''
+
+sel_table_columns = ['layer', 'unit', 'timestep', 'measure', 'class', 'value']
+
+
+def _make_sel_table(layer_list, unit_list, ts_list, measure_list, class_list, value_list):
+    """turn lists of row values into typed column arrays and name tables"""
+    # # names are kept in the order they first appear (network layer order), not sorted
+    layer_codes, layer_names = pd.factorize(np.array(layer_list, dtype=str))
+    measure_codes, measure_names = pd.factorize(np.array(measure_list, dtype=str))
+
+    # # class labels keep their own dtype (may be strings, or 'total' alongside ints)
+    sel_table = {'layer': layer_codes.astype(np.int16),
+                 'unit': np.array(unit_list, dtype=np.int32),
+                 'timestep': np.array(ts_list, dtype=np.int16),
+                 'measure': measure_codes.astype(np.int16),
+                 'class': np.asarray(class_list),
+                 'value': np.array(value_list, dtype=np.float32),
+                 'layer_names': np.asarray(layer_names).astype(str),
+                 'measure_names': np.asarray(measure_names).astype(str)}
+    return sel_table
+
+
+def sel_dict_to_table(sel_per_unit_dict, verbose=False):
+    """
+    Flatten a nested sel_per_unit dict into a columnar sel_table.
+    Works for ff_sel ([layer][unit][measure][class]) and
+    rnn_sel ([layer][unit][ts_name][measure][class]) layouts.
+    Layer 'means', unit 'max' dicts and dead units are skipped.
+
+    :param sel_per_unit_dict: nested dict (or path to pickle)
+    :param verbose: how much to print to screen
+
+    :return: sel_table: dict of column arrays plus 'layer_names' and 'measure_names'
+    """
+    if verbose:
+        print("\n**** sel_dict_to_table() ****")
+
+    if type(sel_per_unit_dict) is str:
+        sel_per_unit_dict = load_dict(sel_per_unit_dict)
+
+    layer_list, unit_list, ts_list = [], [], []
+    measure_list, class_list, value_list = [], [], []
+
+    def add_rows(layer_name, unit_index, timestep, measure_dict):
+        for measure, class_dict in measure_dict.items():
+            if measure == 'max' or type(class_dict) is not dict:
+                continue
+            n_classes = len(class_dict)
+            layer_list.extend([layer_name] * n_classes)
+            unit_list.extend([unit_index] * n_classes)
+            ts_list.extend([timestep] * n_classes)
+            measure_list.extend([measure] * n_classes)
+            class_list.extend(class_dict.keys())
+            value_list.extend(class_dict.values())
+
+    for layer_name, layer_dict in sel_per_unit_dict.items():
+        for unit_index, unit_dict in layer_dict.items():
+            # # skip 'means', layer info and dead units
+            if not isinstance(unit_index, (int, np.integer)) or type(unit_dict) is not dict:
+                continue
+
+            ts_keys = [k for k in unit_dict.keys() if str(k).startswith('ts')]
+            if ts_keys:
+                for ts_name in ts_keys:
+                    add_rows(layer_name, unit_index, int(ts_name[2:]), unit_dict[ts_name])
+            else:
+                add_rows(layer_name, unit_index, -1, unit_dict)
+
+    sel_table = _make_sel_table(layer_list, unit_list, ts_list,
+                                measure_list, class_list, value_list)
+
+    if verbose:
+        print(f"sel_table: {len(sel_table['value'])} rows, "
+              f"{len(sel_table['layer_names'])} layers, {len(sel_table['measure_names'])} measures")
+
+    return sel_table
+
+
+def sel_store_to_table(store_path, verbose=False):
+    """
+    Make a sel_table straight from an rnn_sel sqlite store (see sel_store.py),
+    without making the nested dict.
+
+    :param store_path: path to .db file
+    :param verbose: how much to print to screen
+
+    :return: sel_table
+    """
+    if verbose:
+        print("\n**** sel_store_to_table() ****")
+
+    conn = sqlite3.connect(store_path)
+    # # layers in the order they were added, as in sel_store_to_dicts()
+    rows = conn.execute("SELECT s.layer, s.unit, s.timestep, s.measure, s.class, s.value "
+                        "FROM sel_values AS s LEFT JOIN sel_layers AS l ON s.layer = l.layer "
+                        "ORDER BY l.layer_order, s.unit, s.timestep, s.rowid").fetchall()
+    conn.close()
+
+    if rows:
+        layer_list, unit_list, ts_list, measure_list, class_list, value_list = zip(*rows)
+    else:
+        layer_list, unit_list, ts_list, measure_list, class_list, value_list = [], [], [], [], [], []
+
+    # # None values (e.g., no corr_coef) are saved as NaN
+    value_list = [np.nan if v is None else v for v in value_list]
+
+    return _make_sel_table(layer_list, unit_list, ts_list, measure_list, class_list, value_list)
+
+
+def save_sel_table(sel_table, sel_table_name, verbose=False):
+    """
+    Save sel_table as compressed, typed columns (.npz).
+
+    :param sel_table: dict from sel_dict_to_table() or sel_store_to_table()
+    :param sel_table_name: path to save to, '.npz' is added if missing
+    :param verbose: how much to print to screen
+
+    :return: sel_table_name
+    """
+    if not sel_table_name.endswith('.npz'):
+        sel_table_name = f"{sel_table_name}.npz"
+
+    np.savez_compressed(sel_table_name, **sel_table)
+
+    if verbose:
+        print(f"saved sel_table: {sel_table_name}")
+
+    return sel_table_name
+
+
+def load_sel_table(sel_table_name, columns=None, verbose=False):
+    """
+    Load sel_table columns.  Only the requested columns are decompressed.
+
+    :param sel_table_name: path to .npz file
+    :param columns: list of columns to load, or None for all
+    :param verbose: how much to print to screen
+
+    :return: sel_table
+    """
+    if verbose:
+        print("\n**** load_sel_table() ****")
+
+    if not os.path.isfile(sel_table_name):
+        raise FileNotFoundError(sel_table_name)
+
+    if columns is None:
+        columns = sel_table_columns
+
+    with np.load(sel_table_name) as npz:
+        sel_table = {col: npz[col] for col in columns}
+        sel_table['layer_names'] = npz['layer_names']
+        sel_table['measure_names'] = npz['measure_names']
+
+    if verbose:
+        print(f"loaded {list(sel_table.keys())} from {sel_table_name}")
+
+    return sel_table
+
+
+def _get_code(names, name, name_type):
+    """get int code for a layer or measure name"""
+    code = np.flatnonzero(names == name)
+    if len(code) == 0:
+        raise ValueError(f"{name_type} '{name}' not in sel_table: {list(names)}")
+    return code[0]
+
+
+def _row_mask(sel_table, measure, layer=None, timestep=None):
+    """boolean mask of rows for this measure (and optionally layer/timestep)"""
+    mask = sel_table['measure'] == _get_code(sel_table['measure_names'], measure, 'measure')
+    if layer is not None:
+        mask &= sel_table['layer'] == _get_code(sel_table['layer_names'], layer, 'layer')
+    if timestep is not None:
+        mask &= sel_table['timestep'] == timestep
+    return mask
+
+
+def _rows_to_df(sel_table, rows, measure):
+    """make a DataFrame of selected rows"""
+    return pd.DataFrame({'layer': sel_table['layer_names'][sel_table['layer'][rows]],
+                         'unit': sel_table['unit'][rows],
+                         'timestep': sel_table['timestep'][rows],
+                         'class': sel_table['class'][rows],
+                         measure: sel_table['value'][rows]})
+
+
+def max_class_per_unit(sel_table, measure, layer=None, timestep=None):
+    """
+    For each layer/unit/timestep, find the row with the most selective class for this measure.
+    NaNs are ignored (as in sel_unit_max()).
+
+    :param sel_table: sel_table dict
+    :param measure: e.g., 'max_informed', 'ccma', 'b_sel'
+    :param layer: if not None, only this layer
+    :param timestep: if not None, only this timestep
+
+    :return: array of row indices (one per unit/timestep)
+    """
+    rows = np.flatnonzero(_row_mask(sel_table, measure, layer=layer, timestep=timestep))
+    rows = rows[~np.isnan(sel_table['value'][rows])]
+    if len(rows) == 0:
+        return rows
+
+    # # sort by unit key then value, the last row of each unit is its max
+    layer_col = sel_table['layer'][rows]
+    unit_col = sel_table['unit'][rows]
+    ts_col = sel_table['timestep'][rows]
+    order = np.lexsort((sel_table['value'][rows], ts_col, unit_col, layer_col))
+    rows = rows[order]
+
+    unit_key = np.stack((layer_col[order], unit_col[order], ts_col[order]), axis=1)
+    last_of_unit = np.ones(len(rows), dtype=bool)
+    last_of_unit[:-1] = np.any(unit_key[1:] != unit_key[:-1], axis=1)
+
+    return rows[last_of_unit]
+
+
+def top_k_units(sel_table, measure, k=10, layer=None, timestep=None):
+    """
+    Get the k most selective units (max over classes) for a measure.
+
+    :param sel_table: sel_table dict
+    :param measure: e.g., 'max_informed', 'ccma', 'b_sel'
+    :param k: number of units to return
+    :param layer: if not None, only this layer
+    :param timestep: if not None, only this timestep
+
+    :return: DataFrame: layer, unit, timestep, class, measure
+    """
+    rows = max_class_per_unit(sel_table, measure, layer=layer, timestep=timestep)
+    values = sel_table['value'][rows]
+    if k < len(rows):
+        top = np.argpartition(-values, k - 1)[:k]
+        rows = rows[top]
+        values = values[top]
+    rows = rows[np.argsort(-values, kind='stable')]
+
+    return _rows_to_df(sel_table, rows, measure).reset_index(drop=True)
+
+
+def filter_sel_units(sel_table, measure, threshold, layer=None, timestep=None):
+    """
+    Get all units where the max over classes for this measure is at least threshold.
+
+    :param sel_table: sel_table dict
+    :param measure: e.g., 'max_informed', 'ccma', 'b_sel'
+    :param threshold: min value
+    :param layer: if not None, only this layer
+    :param timestep: if not None, only this timestep
+
+    :return: DataFrame: layer, unit, timestep, class, measure (sorted by descending value)
+    """
+    rows = max_class_per_unit(sel_table, measure, layer=layer, timestep=timestep)
+    rows = rows[sel_table['value'][rows] >= threshold]
+    rows = rows[np.argsort(-sel_table['value'][rows], kind='stable')]
+
+    return _rows_to_df(sel_table, rows, measure).reset_index(drop=True)
+
+
+def best_unit_per_class(sel_table, measure, layer=None, timestep=None):
+    """
+    For each class, get the unit with the highest value for this measure.
+
+    :param sel_table: sel_table dict
+    :param measure: e.g., 'max_informed', 'ccma', 'b_sel'
+    :param layer: if not None, only this layer
+    :param timestep: if not None, only this timestep
+
+    :return: DataFrame: layer, unit, timestep, class, measure (one row per class)
+    """
+    rows = np.flatnonzero(_row_mask(sel_table, measure, layer=layer, timestep=timestep))
+    rows = rows[~np.isnan(sel_table['value'][rows])]
+
+    # # sort by class then value, the last row of each class is its best unit
+    class_col = sel_table['class'][rows]
+    rows = rows[np.lexsort((sel_table['value'][rows], class_col))]
+    class_col = sel_table['class'][rows]
+    last_of_class = np.ones(len(rows), dtype=bool)
+    last_of_class[:-1] = class_col[1:] != class_col[:-1]
+
+    return _rows_to_df(sel_table, rows[last_of_class], measure).reset_index(drop=True)
+
+
+def _class_index(class_col):
+    """class labels as int indices, -1 for rows that aren't a class (e.g., 'total')"""
+    if class_col.dtype.kind in 'iu':
+        return class_col.astype(np.int64)
+    class_str = class_col.astype(str)
+    is_class = np.char.isdigit(class_str)
+    class_index = np.full(len(class_col), -1, dtype=np.int64)
+    class_index[is_class] = class_str[is_class].astype(np.int64)
+    return class_index
+
+
+def layer_class_values(sel_table, measure, layer, n_cats, timestep=None, fill_value=0.):
+    """
+    Get a units x classes array of values for one measure in one layer.
+    Rows that aren't a class (e.g., 'total', 'perplexity') are dropped,
+    missing classes are set to fill_value.
+
+    :param sel_table: sel_table dict
+    :param measure: e.g., 'max_informed', 'ccma', 'b_sel'
+    :param layer: layer name
+    :param n_cats: number of classes
+    :param timestep: for sequence data, which timestep to use
+    :param fill_value: value for missing classes
+
+    :return: units (array of unit numbers), values (array: n_units x n_cats)
+    """
+    rows = np.flatnonzero(_row_mask(sel_table, measure, layer=layer, timestep=timestep))
+    units, unit_index = np.unique(sel_table['unit'][rows], return_inverse=True)
+
+    class_index = _class_index(sel_table['class'][rows])
+    is_class = (class_index >= 0) & (class_index < n_cats)
+
+    values = np.full((len(units), n_cats), fill_value, dtype=float)
+    values[unit_index[is_class], class_index[is_class]] = sel_table['value'][rows[is_class]]
+
+    return units, values
@@ -11,8 +11,8 @@ from tensorflow.keras.applications.vgg16 import preprocess_input
 from tensorflow.keras.applications.vgg16 import VGG16
 
 from tools.dicts import load_dict, focussed_dict_print, print_nested_round_floats
-from tools.data import load_x_data, load_y_data, nick_to_csv, nick_read_csv
-from tools.network import get_scores, VGG_get_scores
+from tools.data import load_x_data, load_y_data, nick_to_csv, nick_read_csv, nick_to_table
+from tools.network import get_scores, VGG_get_scores, sparse_confusion, sparse_conf_class_counts
 
 
 
@@ -95,7 +95,8 @@ def lesion_2020(gha_dict_path,
 
     x_data = load_x_data(x_data_path)
     # x_data = tf.cast(x_data, tf.float32)
-    x_data = np.array(x_data).astype(np.float32)
+    # # no copy if x_data is already float32 (e.g., memory-mapped csv cache)
+    x_data = np.asarray(x_data, dtype=np.float32)
 
     if verbose:
         if test_run:
@@ -106,6 +107,7 @@ def lesion_2020(gha_dict_path,
 
 
     y_df, y_label_list = load_y_data(y_data_path)
+    true_cat = np.array(y_label_list)
 
     if verbose is True:
         print(f"y_df: {y_df.shape}\n{y_df.head()}\n"
@@ -152,7 +154,8 @@ def lesion_2020(gha_dict_path,
     print(f"model_architecture_name: {model_architecture_name}")
     if model_architecture_name == 'VGG16':
         original_model = VGG16(weights='imagenet')
-        x_data = preprocess_input(x_data)  # preprocess the inputs loaded as RGB to BGR
+        # # preprocess_input works in place, so copy (x_data may be read-only memory-map)
+        x_data = preprocess_input(np.array(x_data))  # preprocess the inputs loaded as RGB to BGR
     else:
         model_path = os.path.join(training_dir, trained_model_name)
         original_model = load_model(model_path)
@@ -322,6 +325,12 @@ def lesion_2020(gha_dict_path,
 
     item_correct_MASTER = copy.copy(item_correct_df)
 
+    # # top-k correct per item (VGG16 only), stored per lesioned unit rather than saved by VGG_get_scores
+    if model_architecture_name == 'VGG16':
+        top_k_correct_MASTER = item_correct_df.loc[:, ['item', 'class']].copy()
+        top_k_correct_MASTER['full_model'] = scores_dict['top_k_correct']
+        top_k = scores_dict['top_k']
+
     lesion_means_dict = dict()
 
     # # # set dir to save lesion stuff stuff # # #
@@ -358,6 +367,8 @@ def lesion_2020(gha_dict_path,
         # # make places to save layer details
         count_per_cat_dict[layer_name] = dict()
         item_correct_LAYER = copy.copy(item_correct_MASTER)
+        if model_architecture_name == 'VGG16':
+            top_k_correct_LAYER = copy.copy(top_k_correct_MASTER)
         prop_change_dict[layer_name] = dict()
         class_change_dict[layer_name] = dict()
         just_drops_dict[layer_name] = dict()
@@ -376,6 +387,9 @@ def lesion_2020(gha_dict_path,
         if model_architecture_name != 'VGG16':
             flat_conf_LAYER = copy.copy(flat_conf_MASTER)
 
+        # # sparse confusion matrix (COO triplets) for each lesioned unit, for any number of classes
+        sparse_conf_LAYER = {'unit': [], 'true': [], 'pred': [], 'count': []}
+
 
         weights_n_biases = row['weights_layer']
         print(f"weights_n_biases: {weights_n_biases}")
@@ -423,9 +437,16 @@ def lesion_2020(gha_dict_path,
             # # # get scores
             predicted_outputs = original_model.predict(x_data)
 
+            unit_sparse_conf = sparse_confusion(true_cat, np.argmax(predicted_outputs, axis=1), n_cats)
+            for key in ['true', 'pred', 'count']:
+                sparse_conf_LAYER[key].append(unit_sparse_conf[key])
+            sparse_conf_LAYER['unit'].append(np.full(len(unit_sparse_conf['count']), unit))
+
             if model_architecture_name == 'VGG16':
                 item_correct_df, scores_dict, incorrect_items = VGG_get_scores(predicted_outputs, y_df, output_filename,
-                                                                               save_all_csvs=True)
+                                                                               save_all_csvs=False)
+                top_k_correct_LAYER[layer_and_unit] = scores_dict['top_k_correct']
+                nick_to_table(top_k_correct_LAYER, f"{output_filename}_{layer_name}_top_{top_k}_correct.tbl")
             else:
                 item_correct_df, scores_dict, incorrect_items = get_scores(predicted_outputs, y_df, output_filename,
                                                                            save_all_csvs=False, return_flat_conf=True)
@@ -440,12 +461,12 @@ def lesion_2020(gha_dict_path,
 
             item_correct_LAYER[layer_and_unit] = item_correct_df['full_model']
             # item_correct_LAYER.to_csv("{}_{}_item_correct.csv".format(output_filename, layer_name), index=False)
-            nick_to_csv(item_correct_LAYER, f"{output_filename}_{layer_name}_item_correct.csv")
+            nick_to_table(item_correct_LAYER, f"{output_filename}_{layer_name}_item_correct.tbl")
 
             if model_architecture_name != 'VGG16':
                 flat_conf_LAYER[layer_and_unit] = scores_dict['flat_conf']['full_model']
                 # flat_conf_LAYER.to_csv("{}_{}_flat_conf.csv".format(output_filename, layer_name))
-                nick_to_csv(flat_conf_LAYER, f"{output_filename}_{layer_name}_flat_conf.csv")
+                nick_to_table(flat_conf_LAYER, f"{output_filename}_{layer_name}_flat_conf.tbl")
 
             # # make item change per laye df
             """# # four possible states
@@ -649,56 +670,36 @@ def lesion_2020(gha_dict_path,
                   f"full_model_CPC: {full_model_CPC}\n"
                   f"corr_per_cat_dict: {corr_per_cat_dict}\n")
 
-            unit_bal_acc_dict = dict()
-            unit_rel_bal_act_dict = dict()
-
-            flat_conf = scores_dict['flat_conf']
-
-
-            for this_class in range(n_cats):
-                tp = corr_per_cat_dict[this_class]
-
-                # # first values for traditional balanced acc (based on dataset class sizes)
-                class_items = items_per_cat[this_class]
-                non_class_items = items_per_cat['total'] - class_items
-                fn = class_items - tp
-                fp_df = flat_conf.loc[flat_conf['conf_matrix'].isin([f't0_p{this_class}',
-                                                                     f't1_p{this_class}',
-                                                                     f't2_p{this_class}',
-                                                                     f't3_p{this_class}',
-                                                                     f't4_p{this_class}',
-                                                                     f't5_p{this_class}',
-                                                                     f't6_p{this_class}',
-                                                                     f't7_p{this_class}',
-                                                                     f't8_p{this_class}',
-                                                                     f't9_p{this_class}'])]
-                fp_list = list(fp_df.full_model)
-                class_pred_tot = sum([int(i) for i in fp_list])
-                fp = class_pred_tot - tp
-                tn = non_class_items - fp
-                print(f"\ntn: {tn}")
-
-                print(f"\nclass: {this_class}\ntp: {tp}\nclass_items: {class_items}\n"
-                      f"non_class_items: {non_class_items}\ntn: ")
-
-                print(f"\t\tpred_A\tpred_notA\ttot\n"
-                      f"A\t\t{tp}\t{fn}\t\t{class_items}\n"
-                      f"notA\t{fp}\t\t{tn}\t{non_class_items}")
-                
-                trad_bal_acc = ((tp/class_items) + (tn/non_class_items)) / 2
-                unit_bal_acc_dict[this_class] = trad_bal_acc
-
-                
-                # # for a relative balanced acc based on full model correct per class
-                # # full_mod_items is class total correct in full model
-                full_mod_class_items = full_model_CPC[this_class]
-                full_mod_non_class_items = scores_dict['n_correct'] - full_mod_class_items
-                rel_fn = full_mod_class_items - tp
-                fp = class_pred_tot - tp  # same - not changed
-                rel_tn = full_mod_non_class_items - fp
-                
-                rel_bal_acc = ((tp/full_mod_class_items) + (rel_tn/full_mod_non_class_items)) / 2
-                unit_rel_bal_act_dict[this_class] = rel_bal_acc
+            # # fp and tn come from the (sparse) confusion matrix, so this works for 1000 classes too
+            tp = np.array([corr_per_cat_dict[this_class] for this_class in range(n_cats)])
+            _, _, class_pred_tot = sparse_conf_class_counts(unit_sparse_conf)
+            fp = class_pred_tot - tp
+
+            # # first values for traditional balanced acc (based on dataset class sizes)
+            class_items = np.array([items_per_cat[this_class] for this_class in range(n_cats)])
+            non_class_items = items_per_cat['total'] - class_items
+            fn = class_items - tp
+            tn = non_class_items - fp
+
+            # # for a relative balanced acc based on full model correct per class
+            # # full_mod_items is class total correct in full model
+            full_mod_class_items = np.array([full_model_CPC[this_class] for this_class in range(n_cats)])
+            full_mod_non_class_items = scores_dict['n_correct'] - full_mod_class_items
+            rel_tn = full_mod_non_class_items - fp
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                trad_bal_acc = ((tp / class_items) + (tn / non_class_items)) / 2
+                rel_bal_acc = ((tp / full_mod_class_items) + (rel_tn / full_mod_non_class_items)) / 2
+
+            if verbose:
+                for this_class in range(n_cats):
+                    print(f"\nclass: {this_class}\n"
+                          f"\t\tpred_A\tpred_notA\ttot\n"
+                          f"A\t\t{tp[this_class]}\t{fn[this_class]}\t\t{class_items[this_class]}\n"
+                          f"notA\t{fp[this_class]}\t\t{tn[this_class]}\t{non_class_items[this_class]}")
+
+            unit_bal_acc_dict = dict(zip(range(n_cats), trad_bal_acc.tolist()))
+            unit_rel_bal_act_dict = dict(zip(range(n_cats), rel_bal_acc.tolist()))
 
             unit_bal_acc_dict['total'] = sum(unit_bal_acc_dict.values())/n_cats
             unit_rel_bal_act_dict['total'] = sum(unit_rel_bal_act_dict.values())/n_cats
@@ -782,6 +783,11 @@ def lesion_2020(gha_dict_path,
         if verbose:
             print(f"\n\nrel_bal_acc_df:\n{rel_bal_acc_df.head()}")
 
+        # # sparse confusion for all units in layer: row i is unit[i], true[i], pred[i], count[i]
+        if sparse_conf_LAYER['unit']:
+            np.savez_compressed(f"{output_filename}_{layer_name}_sparse_conf.npz", n_cats=n_cats,
+                                **{key: np.concatenate(values) for key, values in sparse_conf_LAYER.items()})
+
 
         # # HIGHLIGHTS dict (for each layer)
         layer_highlights_dict = dict()
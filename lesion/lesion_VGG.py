@@ -10,7 +10,7 @@ from tensorflow.keras.models import load_model
 from tensorflow.keras.applications.vgg16 import VGG16
 
 from tools.dicts import load_dict, focussed_dict_print, print_nested_round_floats
-from tools.data import load_x_data, load_y_data, nick_to_csv, nick_read_csv
+from tools.data import load_x_data, load_y_data, nick_to_csv, nick_read_csv, nick_to_table
 from tools.hdf import hdf_pred_scores
 
 
@@ -133,6 +133,13 @@ def lesion_study(gha_dict_path,
         with open(count_p_cat_dict_name, "wb") as pickle_out:
             pickle.dump(count_per_cat_dict, pickle_out)
 
+    # count_per_cat_top_k_dict is for storing n_items_correct (true class in top-k) for the lesion study
+    count_p_cat_top_k_dict_name = f"{lesion_path}/{output_filename}_count_p_cat_top_k_dict.pickle"
+    if not os.path.isfile(count_p_cat_top_k_dict_name):
+        count_per_cat_top_k_dict = dict()
+        with open(count_p_cat_top_k_dict_name, "wb") as pickle_out:
+            pickle.dump(count_per_cat_top_k_dict, pickle_out)
+
     # prop_change dict - to compare with Zhou_2018
     prop_change_dict_name = f"{lesion_path}/{output_filename}_prop_change_dict.pickle"
     if not os.path.isfile(prop_change_dict_name):
@@ -366,6 +373,16 @@ def lesion_study(gha_dict_path,
         with open(count_p_cat_dict_name, "wb") as pickle_out:
             pickle.dump(count_per_cat_dict, pickle_out)
 
+    # # top-k scores per class for full model
+    full_model_top_k_CPC = scores_dict['corr_per_cat_top_k_dict']
+    full_model_top_k_CPC['total'] = scores_dict['n_correct_top_k']
+
+    with open(count_p_cat_top_k_dict_name, "rb") as pickle_load:
+        count_per_cat_top_k_dict = pickle.load(pickle_load)
+        count_per_cat_top_k_dict['full_model'] = full_model_top_k_CPC
+        with open(count_p_cat_top_k_dict_name, "wb") as pickle_out:
+            pickle.dump(count_per_cat_top_k_dict, pickle_out)
+
     # # use these (unlesioned) pages as the basis for LAYER pages
     # flat_conf_MASTER = scores_dict.loc[:, 'flat_conf']
     if model_architecture_name != 'VGG16':
@@ -406,6 +423,12 @@ def lesion_study(gha_dict_path,
             with open(count_p_cat_dict_name, "wb") as pickle_out:
                 pickle.dump(count_per_cat_dict, pickle_out)
 
+        with open(count_p_cat_top_k_dict_name, "rb") as pickle_load:
+            count_per_cat_top_k_dict = pickle.load(pickle_load)
+            count_per_cat_top_k_dict[layer_name] = dict()
+            with open(count_p_cat_top_k_dict_name, "wb") as pickle_out:
+                pickle.dump(count_per_cat_top_k_dict, pickle_out)
+
         with open(prop_change_dict_name, "rb") as pickle_load:
             # read dict as it is so far
             prop_change_dict = pickle.load(pickle_load)
@@ -485,6 +508,7 @@ def lesion_study(gha_dict_path,
             item_correct_df, scores_dict, incorrect_items = hdf_pred_scores(model=original_model,
                                                                             output_filename=output_filename,
                                                                             df_name=layer_and_unit,
+                                                                            save_pred_vals=False,
                                                                             test_run=test_run,
                                                                             verbose=verbose)
             if verbose is True:
@@ -501,14 +525,24 @@ def lesion_study(gha_dict_path,
                 with open(count_p_cat_dict_name, "wb") as pickle_out:
                     pickle.dump(count_per_cat_dict, pickle_out)
 
+            # # top-k scores per class for this layer
+            corr_per_cat_top_k_dict = scores_dict['corr_per_cat_top_k_dict']
+            corr_per_cat_top_k_dict['total'] = scores_dict['n_correct_top_k']
+
+            with open(count_p_cat_top_k_dict_name, "rb") as pickle_load:
+                count_per_cat_top_k_dict = pickle.load(pickle_load)
+                count_per_cat_top_k_dict[layer_name][unit] = corr_per_cat_top_k_dict
+                with open(count_p_cat_top_k_dict_name, "wb") as pickle_out:
+                    pickle.dump(count_per_cat_top_k_dict, pickle_out)
+
             item_correct_LAYER[layer_and_unit] = item_correct_df['full_model']
             # item_correct_LAYER.to_csv(f"{output_filename}_{layer_name}_item_correct.csv", index=False)
-            nick_to_csv(item_correct_LAYER, f"{output_filename}_{layer_name}_item_correct.csv")
+            nick_to_table(item_correct_LAYER, f"{output_filename}_{layer_name}_item_correct.tbl")
 
             if model_architecture_name != 'VGG16':
                 flat_conf_LAYER[layer_and_unit] = scores_dict['flat_conf']['full_model']
                 # flat_conf_LAYER.to_csv("{}_{}_flat_conf.csv".format(output_filename, layer_name))
-                nick_to_csv(flat_conf_LAYER, f"{output_filename}_{layer_name}_flat_conf.csv")
+                nick_to_table(flat_conf_LAYER, f"{output_filename}_{layer_name}_flat_conf.tbl")
 
             # # make item change per laye df
             """# # four possible states
@@ -616,6 +650,8 @@ def lesion_study(gha_dict_path,
 
         count_per_cat_df = pd.DataFrame.from_dict(count_per_cat_dict[layer_name])
         count_per_cat_df.to_csv(f"{output_filename}_{layer_name}_count_per_cat.csv")
+        count_per_cat_top_k_df = pd.DataFrame.from_dict(count_per_cat_top_k_dict[layer_name])
+        count_per_cat_top_k_df.to_csv(f"{output_filename}_{layer_name}_count_per_cat_top_k.csv")
         with open(count_p_cat_dict_name, "wb") as pickle_out:
             pickle.dump(count_per_cat_dict, pickle_out)
 
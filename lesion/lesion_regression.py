@@ -25,6 +25,7 @@ from keras.utils.np_utils import to_categorical
 import statsmodels.api as sm
 
 from tools.dicts import load_dict, focussed_dict_print, print_nested_round_floats
+from Selectivity.sel_table import load_sel_table, layer_class_values
 
 
 # todo: Rather than correlating max_class_drop with selectivity,
@@ -34,6 +35,59 @@ from tools.dicts import load_dict, focussed_dict_print, print_nested_round_float
 # todo:  I need something about how often the most selective class was the max_class_drop class
 
 
+def _sel_info_class_values(sel_layer_info, sel_measure, n_cats, old_sel_dict):
+    """
+    Get (unit, [value per class]) for each unit in a layer of a nested sel_info dict.
+    Only used for sel dicts saved without a sel_table.
+
+    :param sel_layer_info: sel_info[layer]
+    :param sel_measure: measure to get
+    :param n_cats: number of classes
+    :param old_sel_dict: if True, measures are in unit_sel['sel'] or unit_sel['class_sel_basics']
+
+    :return: list of (unit, sel_values)
+    """
+    unit_sel_values = []
+    for unit, unit_sel in sel_layer_info.items():
+
+        if unit == 'means':
+            continue
+
+        if old_sel_dict:
+            if sel_measure in unit_sel['sel']:
+                sel_items = unit_sel['sel'][sel_measure]
+            elif sel_measure in unit_sel['class_sel_basics']:
+                sel_items = unit_sel['class_sel_basics'][sel_measure]
+        else:
+            sel_items = unit_sel[sel_measure]
+
+        # # just check it is just classes in there
+        if 'total' in sel_items.keys():
+            del sel_items['total']
+        if 'perplexity' in sel_items.keys():
+            del sel_items['perplexity']
+
+        if len(list(sel_items.keys())) != n_cats:
+            # print("\nERROR, {} hasn't got enough classes".format(sel_measure))
+            # print("error found", sel_items)
+            for i in range(n_cats):
+                if i not in sel_items:
+                    sel_items[i] = 0.0
+            ordered_dict = dict()
+            for j in range(n_cats):
+                ordered_dict[j] = sel_items[j]
+
+            sel_items = dict()
+            sel_items = ordered_dict
+            # print('sel_items should be sorted now', sel_items)
+
+        sel_values = list(sel_items.values())
+
+        unit_sel_values.append((unit, sel_values))
+
+    return unit_sel_values
+
+
 def lesion_sel_regression(lesion_dict_path, sel_dict_path,
                           lesion_meas='prop_change',
                           use_relu=False, test_run=False, verbose=False):
@@ -111,13 +165,21 @@ def lesion_sel_regression(lesion_dict_path, sel_dict_path,
         print('\n found old sel dict layout')
         old_sel_dict = True
         sel_info = sel_dict['sel_info']
+        sel_table = None
         short_sel_measures_list = list(sel_info[key_lesion_layers_list[0]][0]['sel'].keys())
         csb_list = list(sel_info[key_lesion_layers_list[0]][0]['class_sel_basics'].keys())
         sel_measures_list = short_sel_measures_list + csb_list
+    elif 'sel_table_name' in sel_dict['sel_info']:
+        print('\n found NEW sel dict layout, using sel_table')
+        old_sel_dict = False
+        sel_table = load_sel_table(sel_dict['sel_info']['sel_table_name'])
+        sel_info = None
+        sel_measures_list = list(sel_table['measure_names'])
     else:
         print('\n found NEW sel dict layout')
         old_sel_dict = False
         sel_info = load_dict(sel_dict['sel_info']['sel_per_unit_pickle_name'])
+        sel_table = None
         sel_measures_list = list(sel_info[key_lesion_layers_list[0]][0].keys())
 
     # # remove measures that I don't want
@@ -139,7 +201,10 @@ def lesion_sel_regression(lesion_dict_path, sel_dict_path,
 
     if use_relu is True:
         # # get key_relu_layers_list
-        key_relu_layers_list = list(sel_info.keys())
+        if sel_table is not None:
+            key_relu_layers_list = list(sel_table['layer_names'])
+        else:
+            key_relu_layers_list = list(sel_info.keys())
 
         # # # remove unnecessary items from key layers list
         if 'sel_analysis_info' in key_relu_layers_list:
@@ -219,52 +284,16 @@ def lesion_sel_regression(lesion_dict_path, sel_dict_path,
             if verbose:
                 print(f"\n\tsel_layer: {sel_layer}\tlesion_layer: {lesion_layer}")
 
-            sel_layer_info = sel_info[sel_layer]
-
-            if 'means' in sel_layer_info.keys():
-                del sel_layer_info['means']
-
             '''get sel_layer unit sel values'''
             # get array of sel values for regression model
-            layer_sel_array = []
-            for unit, unit_sel in sel_layer_info.items():
-
-                if unit == 'means':
-                    continue
-
-                if old_sel_dict:
-                    if sel_measure in unit_sel['sel']:
-                        sel_items = unit_sel['sel'][sel_measure]
-                    elif sel_measure in unit_sel['class_sel_basics']:
-                        sel_items = unit_sel['class_sel_basics'][sel_measure]
-                else:
-                    sel_items = unit_sel[sel_measure]
-
-                # # just check it is just classes in there
-
-                if 'total' in sel_items.keys():
-                    del sel_items['total']
-                if 'perplexity' in sel_items.keys():
-                    del sel_items['perplexity']
-
-                if len(list(sel_items.keys())) != n_cats:
-                    # print("\nERROR, {} hasn't got enough classes".format(sel_measure))
-                    # print("error found", sel_items)
-                    for i in range(n_cats):
-                        if i not in sel_items:
-                            sel_items[i] = 0.0
-                    ordered_dict = dict()
-                    for j in range(n_cats):
-                        ordered_dict[j] = sel_items[j]
-
-                    sel_items = dict()
-                    sel_items = ordered_dict
-                    # print('sel_items should be sorted now', sel_items)
-
-                sel_values = list(sel_items.values())
-
-                layer_sel_array.append(sel_values)
-                # print(unit, sel_values)
+            if sel_table is not None:
+                layer_sel_units, layer_sel_values = layer_class_values(sel_table, sel_measure, sel_layer, n_cats)
+                layer_sel_units = layer_sel_units.tolist()
+                layer_sel_array = layer_sel_values.tolist()
+            else:
+                unit_sel_values = _sel_info_class_values(sel_info[sel_layer], sel_measure, n_cats, old_sel_dict)
+                layer_sel_units = [unit for unit, sel_values in unit_sel_values]
+                layer_sel_array = [sel_values for unit, sel_values in unit_sel_values]
 
             all_layer_sel_array = all_layer_sel_array + layer_sel_array
 
@@ -314,7 +343,7 @@ def lesion_sel_regression(lesion_dict_path, sel_dict_path,
             # if use_relu:  # now trying if for any runs, not just if using different layers
             if sel_units != les_units:
                 if len(lesion_unit_cat_list) > sel_units:
-                    available_sel_units = list(sel_layer_info.keys())
+                    available_sel_units = layer_sel_units
                     masked_class_drops = [lesion_unit_cat_list[i] for i in available_sel_units]
                     lesion_unit_cat_list = masked_class_drops
 
@@ -701,13 +730,22 @@ def item_act_fail_regression(sel_dict_path, lesion_dict_path, plot_type='classes
         key_relu_layers_list = list(sel_dict['sel_info'].keys())
         old_sel_dict = True
         sel_info = sel_dict['sel_info']
+        sel_table = None
         short_sel_measures_list = list(sel_info[key_lesion_layers_list[0]][0]['sel'].keys())
         csb_list = list(sel_info[key_lesion_layers_list[0]][0]['class_sel_basics'].keys())
         sel_measures_list = short_sel_measures_list + csb_list
+    elif 'sel_table_name' in sel_dict['sel_info']:
+        print('\n found NEW sel dict layout, using sel_table')
+        old_sel_dict = False
+        sel_table = load_sel_table(sel_dict['sel_info']['sel_table_name'])
+        sel_info = None
+        sel_measures_list = list(sel_table['measure_names'])
+        key_relu_layers_list = list(sel_table['layer_names'])
     else:
         print('\n found NEW sel dict layout')
         old_sel_dict = False
         sel_info = load_dict(sel_dict['sel_info']['sel_per_unit_pickle_name'])
+        sel_table = None
         sel_measures_list = list(sel_info[key_lesion_layers_list[0]][0].keys())
         key_relu_layers_list = list(sel_info.keys())
         # print(sel_info.keys())
@@ -904,6 +942,15 @@ def item_act_fail_regression(sel_dict_path, lesion_dict_path, plot_type='classes
 
             units_per_layer = len(hid_acts_df.columns)
 
+            if sel_table is not None:
+                # # {measure: {unit: values per class}} for this layer
+                n_cats = lesion_dict['data_info']['n_cats']
+                layer_sel_values = dict()
+                for measure in sel_measures:
+                    sel_units, sel_values = layer_class_values(sel_table, measure, use_layer_name, n_cats,
+                                                               fill_value=np.nan)
+                    layer_sel_values[measure] = dict(zip(sel_units.tolist(), sel_values))
+
             print("\n\n\t**** loop through units ****")
             for unit_index, unit in enumerate(hid_acts_df.columns):
 
@@ -970,6 +1017,9 @@ def item_act_fail_regression(sel_dict_path, lesion_dict_path, plot_type='classes
                     # # includes if statement since some units have not score (dead relu?)
                     if old_sel_dict:
                         sel_measure_dict = sel_dict['sel_info'][use_layer_name][unit][measure]
+                    elif sel_table is not None:
+                        if unit in layer_sel_values[measure]:
+                            sel_measure_dict = dict(enumerate(layer_sel_values[measure][unit]))
                     else:
                         if unit in sel_info[use_layer_name]:
                             sel_measure_dict = sel_info[use_layer_name][unit][measure]
@@ -1504,13 +1554,21 @@ def class_acc_sel_corr(lesion_dict_path, sel_dict_path,
         print('\n found old sel dict layout')
         old_sel_dict = True
         sel_info = sel_dict['sel_info']
+        sel_table = None
         short_sel_measures_list = list(sel_info[key_lesion_layers_list[0]][0]['sel'].keys())
         csb_list = list(sel_info[key_lesion_layers_list[0]][0]['class_sel_basics'].keys())
         auto_sel_measures = short_sel_measures_list + csb_list
+    elif 'sel_table_name' in sel_dict['sel_info']:
+        print('\n found NEW sel dict layout, using sel_table')
+        old_sel_dict = False
+        sel_table = load_sel_table(sel_dict['sel_info']['sel_table_name'])
+        sel_info = None
+        auto_sel_measures = list(sel_table['measure_names'])
     else:
         print('\n found NEW sel dict layout')
         old_sel_dict = False
         sel_info = load_dict(sel_dict['sel_info']['sel_per_unit_pickle_name'])
+        sel_table = None
         auto_sel_measures = list(sel_info[key_lesion_layers_list[0]][0].keys())
 
     '''get rid of measures that I've had trouble with'''
@@ -1521,7 +1579,10 @@ def class_acc_sel_corr(lesion_dict_path, sel_dict_path,
 
     if use_relu is True:
         # # get key_relu_layers_list
-        key_relu_layers_list = list(sel_info.keys())
+        if sel_table is not None:
+            key_relu_layers_list = list(sel_table['layer_names'])
+        else:
+            key_relu_layers_list = list(sel_info.keys())
         # # remove unnecessary items from key layers list
         if 'sel_analysis_info' in key_relu_layers_list:
             key_relu_layers_list.remove('sel_analysis_info')
@@ -1611,8 +1672,6 @@ def class_acc_sel_corr(lesion_dict_path, sel_dict_path,
             if verbose:
                 print(f"\n\tsel_layer: {sel_layer}\tlesion_layer: {lesion_layer}")
 
-            sel_layer_info = sel_info[sel_layer]
-
             layer_les_sel_pairs = []
 
             # sel_corr_dict[lesion_layer] = dict()
@@ -1656,43 +1715,18 @@ def class_acc_sel_corr(lesion_dict_path, sel_dict_path,
 
             '''get sel_layer sel values'''
             # get array of sel values
-            layer_sel_array = []
-
-            for unit, unit_sel in sel_layer_info.items():
+            if sel_table is not None:
+                layer_sel_units, layer_sel_values = layer_class_values(sel_table, sel_measure, sel_layer, n_cats)
+                unit_sel_values = zip(layer_sel_units.tolist(), layer_sel_values.tolist())
+            else:
+                unit_sel_values = _sel_info_class_values(sel_info[sel_layer], sel_measure, n_cats, old_sel_dict)
 
-                if unit == 'means':
-                    continue
+            layer_sel_array = []
+            layer_sel_units = []
 
-                if old_sel_dict:
-                    if sel_measure in unit_sel['sel']:
-                        sel_items = unit_sel['sel'][sel_measure]
-                    elif sel_measure in unit_sel['class_sel_basics']:
-                        sel_items = unit_sel['class_sel_basics'][sel_measure]
-                else:
-                    sel_items = unit_sel[sel_measure]
-
-                # # just check it is just classes in there
-                if 'total' in sel_items.keys():
-                    del sel_items['total']
-                if 'perplexity' in sel_items.keys():
-                    del sel_items['perplexity']
-
-                if len(list(sel_items.keys())) != n_cats:
-                    # print("\nERROR, {} hasn't got enough classes".format(sel_measure))
-                    # print("error found", sel_items)
-                    for i in range(n_cats):
-                        if i not in sel_items:
-                            sel_items[i] = 0.0
-                    ordered_dict = dict()
-                    for j in range(n_cats):
-                        ordered_dict[j] = sel_items[j]
-
-                    sel_items = dict()
-                    sel_items = ordered_dict
-                    # print('sel_items should be sorted now', sel_items)
-
-                sel_values = list(sel_items.values())
+            for unit, sel_values in unit_sel_values:
 
+                layer_sel_units.append(unit)
                 layer_sel_array.append(sel_values)
 
                 les_drop_class = int(lesion_cat_p_u_dict[unit]['l_min_class'])
@@ -1720,7 +1754,7 @@ def class_acc_sel_corr(lesion_dict_path, sel_dict_path,
                     print(f"sel_units: {sel_units}\nles_units: {les_units}")
 
                     if len(lesion_unit_cat_list) > sel_units:
-                        available_sel_units = list(sel_layer_info.keys())
+                        available_sel_units = layer_sel_units
                         masked_class_drops = [lesion_unit_cat_list[i] for i in available_sel_units]
                         lesion_unit_cat_list = masked_class_drops
 
@@ -68,6 +68,183 @@ class mlp:
 
 
 
+class StackedDense(tf.keras.layers.Layer):
+    """
+    n_models Dense layers of the same shape, as one layer with a leading model axis.
+        kernel: (n_models, input_dim, units), bias: (n_models, units)
+    Input is (batch, input_dim) (the same input for all models) or (batch, n_models, input_dim).
+    Output is (batch, n_models, units), from one batched matmul (einsum).
+    Each model's kernel is initialised separately with kernel_initializer (as a Dense kernel would be).
+    """
+    def __init__(self, n_models, units, activation=None, use_bias=True,
+                 kernel_initializer='GlorotUniform', **kwargs):
+        super(StackedDense, self).__init__(**kwargs)
+        self.n_models = n_models
+        self.units = units
+        self.activation = tf.keras.activations.get(activation)
+        self.use_bias = use_bias
+        self.kernel_initializer = tf.keras.initializers.get(kernel_initializer)
+
+    def build(self, input_shape):
+        input_dim = int(input_shape[-1])
+
+        def init_kernel(shape, dtype=None):
+            # # a new initializer per model, so unseeded initializers don't give identical kernels
+            init_config = self.kernel_initializer.get_config()
+            return tf.stack([self.kernel_initializer.__class__.from_config(init_config)(
+                (input_dim, self.units), dtype=dtype) for model in range(self.n_models)])
+
+        self.kernel = self.add_weight(name='kernel', shape=(self.n_models, input_dim, self.units),
+                                      initializer=init_kernel, trainable=True)
+        if self.use_bias:
+            self.bias = self.add_weight(name='bias', shape=(self.n_models, self.units),
+                                        initializer='zeros', trainable=True)
+        super(StackedDense, self).build(input_shape)
+
+    def call(self, inputs):
+        if len(inputs.shape) == 2:
+            outputs = tf.einsum('bi,mio->bmo', inputs, self.kernel)
+        else:
+            outputs = tf.einsum('bmi,mio->bmo', inputs, self.kernel)
+        if self.use_bias:
+            outputs = outputs + self.bias
+        return self.activation(outputs)
+
+    def get_config(self):
+        config = super(StackedDense, self).get_config()
+        config.update({'n_models': self.n_models,
+                       'units': self.units,
+                       'activation': tf.keras.activations.serialize(self.activation),
+                       'use_bias': self.use_bias,
+                       'kernel_initializer': tf.keras.initializers.serialize(self.kernel_initializer),
+                       })
+        return config
+
+
+class stacked_mlp:
+    """
+    n_models copies of mlp, trained together as one model.
+    Same layers and names as mlp, but with StackedDense layers, so the output is (batch, n_models, classes).
+    Use stacked_loss() and stacked_metrics() to compile, and split_stacked_mlp() to get the mlps back.
+    """
+    @staticmethod
+    def build(n_models, features, classes, n_layers=1, units_per_layer=200,
+              act_func='relu', y_1hot=True, weight_init='GlorotUniform',
+              use_bias=True, dropout=0.0, batch_norm=True, output_act='softmax'):
+
+        if weight_init == 'taxo':
+            weight_init = RandomUniform(minval=-0.01, maxval=0.01, seed=None)
+
+        model = Sequential(name=f"h{n_layers}_u{units_per_layer}_x{n_models}")
+        model.add(tf.keras.layers.InputLayer(input_shape=(features, )))
+
+        for layer in range(n_layers):
+            if layer == 0:  # first layer
+                batch_norm = False
+                dropout = False
+
+            if batch_norm is True:
+                # # normalise each model's units separately
+                model.add(BatchNormalization(axis=[1, 2], name=f'bn_{layer}'))
+
+            if dropout > 0:
+                model.add(Dropout(rate=dropout, name=f'dropout_{layer}'))
+
+            model.add(StackedDense(n_models, units_per_layer,
+                                   use_bias=use_bias,
+                                   kernel_initializer=weight_init,
+                                   activation=act_func,
+                                   name=f"hid{layer}",))
+
+        if y_1hot:
+            output_act = 'softmax'
+        model.add(StackedDense(n_models, classes, name='output', activation=output_act,
+                               use_bias=use_bias,
+                               kernel_initializer=weight_init,
+                               ))
+
+        return model
+
+
+def stacked_loss(loss_func):
+    """
+    Loss for a stacked model: sum of each model's own loss,
+    so each model gets the same gradients as it would if trained alone.
+
+    :param loss_func: keras loss name, e.g., 'categorical_crossentropy'
+
+    :return: loss function for y_true (batch, classes) and y_pred (batch, n_models, classes)
+    """
+    base_loss = tf.keras.losses.get(loss_func)
+
+    def loss(y_true, y_pred):
+        y_true = tf.broadcast_to(tf.expand_dims(y_true, 1), tf.shape(y_pred))
+        return tf.reduce_sum(base_loss(y_true, y_pred), axis=-1)
+
+    loss.__name__ = f'stacked_{loss_func}'
+    return loss
+
+
+def stacked_metrics(loss_func, n_models):
+    """
+    Per-model loss and accuracy metrics for a stacked model,
+    in history as 'loss_m0', 'acc_m0', 'loss_m1' ... (and 'val_loss_m0' etc).
+
+    :param loss_func: keras loss name, e.g., 'categorical_crossentropy'
+    :param n_models: number of stacked models
+
+    :return: list of metric functions
+    """
+    base_loss = tf.keras.losses.get(loss_func)
+
+    def make_metrics(member):
+        def member_loss(y_true, y_pred):
+            return base_loss(y_true, y_pred[:, member])
+
+        def member_acc(y_true, y_pred):
+            if loss_func == 'categorical_crossentropy':
+                return tf.keras.metrics.categorical_accuracy(y_true, y_pred[:, member])
+            return tf.keras.metrics.binary_accuracy(y_true, y_pred[:, member])
+
+        member_loss.__name__ = f'loss_m{member}'
+        member_acc.__name__ = f'acc_m{member}'
+        return [member_loss, member_acc]
+
+    return [metric for member in range(n_models) for metric in make_metrics(member)]
+
+
+def split_stacked_mlp(stacked_model, member_weights=None, **mlp_kwargs):
+    """
+    Make n_models mlps from a stacked_mlp.
+
+    :param stacked_model: trained stacked_mlp model
+    :param member_weights: None to use the stacked_model weights,
+                           or list (per model) of {layer_name: [weight arrays]}, e.g., from StackedBestWeights
+    :param mlp_kwargs: kwargs for mlp.build (same as for stacked_mlp.build, without n_models)
+
+    :return: list of (uncompiled) mlp models
+    """
+    n_models = stacked_model.get_layer('output').n_models
+
+    member_models = []
+    for member in range(n_models):
+        model = mlp.build(**mlp_kwargs)
+        model.build((None, mlp_kwargs['features']))
+
+        for layer in stacked_model.layers:
+            if not layer.weights:
+                continue
+            if member_weights is None or not member_weights[member]:
+                weights = [w[member] for w in layer.get_weights()]
+            else:
+                weights = member_weights[member][layer.name]
+            model.get_layer(layer.name).set_weights(weights)
+
+        member_models.append(model)
+
+    return member_models
+
+
 class fc1:
     @staticmethod
     def build(classes, units_per_layer, batch_norm=True, dropout=True):
@@ -9,6 +9,92 @@ from tensorflow.keras.initializers import he_normal, RandomUniform
 
 # from keras import backend as K
 
+def constant_initial_state(rnn_class):
+    """
+    Make a subclass of a keras RNN layer (SimpleRNN, GRU, LSTM) where the initial state is
+    a constant (e.g., .5 as in LENS), made in-graph for any batch size and unit count.
+    This replaces setting the states of a stateful layer from a callback before every batch.
+
+    extra layer kwargs:
+        initial_state_value: value for all states at the start of each sequence (None for zeros)
+        learn_initial_state: if True, the initial state is a trainable vector (per state),
+                             starting at initial_state_value
+
+    :param rnn_class: keras RNN layer class
+
+    :return: layer class, e.g., InitSimpleRNN
+    """
+    class InitStateRNN(rnn_class):
+        def __init__(self, *args, initial_state_value=None, learn_initial_state=False, **kwargs):
+            super(InitStateRNN, self).__init__(*args, **kwargs)
+            self.initial_state_value = initial_state_value
+            self.learn_initial_state = learn_initial_state
+
+        def _state_sizes(self):
+            state_size = self.cell.state_size
+            if isinstance(state_size, int):
+                return [state_size]
+            return list(state_size)
+
+        def build(self, input_shape):
+            super(InitStateRNN, self).build(input_shape)
+            if self.learn_initial_state:
+                init_value = 0. if self.initial_state_value is None else self.initial_state_value
+                self.initial_state_weights = [
+                    self.add_weight(name=f'initial_state_{index}', shape=(size, ),
+                                    initializer=tf.keras.initializers.Constant(init_value),
+                                    trainable=True)
+                    for index, size in enumerate(self._state_sizes())]
+
+        def get_initial_state(self, inputs):
+            if self.initial_state_value is None and not self.learn_initial_state:
+                return super(InitStateRNN, self).get_initial_state(inputs)
+
+            batch_size = tf.shape(inputs)[0]
+            if self.learn_initial_state:
+                return [tf.tile(tf.expand_dims(weights, 0), [batch_size, 1])
+                        for weights in self.initial_state_weights]
+            return [tf.fill([batch_size, size], tf.cast(self.initial_state_value, inputs.dtype))
+                    for size in self._state_sizes()]
+
+        def get_config(self):
+            config = super(InitStateRNN, self).get_config()
+            config.update({'initial_state_value': self.initial_state_value,
+                           'learn_initial_state': self.learn_initial_state})
+            return config
+
+    InitStateRNN.__name__ = f"Init{rnn_class.__name__}"
+    return InitStateRNN
+
+
+InitSimpleRNN = constant_initial_state(SimpleRNN)
+InitGRU = constant_initial_state(GRU)
+InitLSTM = constant_initial_state(LSTM)
+
+# # to load models with these layers, use load_model(path, custom_objects=rnn_custom_objects)
+rnn_custom_objects = {'InitSimpleRNN': InitSimpleRNN, 'InitGRU': InitGRU, 'InitLSTM': InitLSTM}
+
+
+def get_rnn_layer(rnn_class, initial_state=None, learn_initial_state=False):
+    """
+    Get the layer class and kwargs for a recurrent layer.
+    The plain keras layer is used unless there is an initial state,
+    so saved models only need rnn_custom_objects if they use one.
+
+    :param rnn_class: SimpleRNN, GRU or LSTM
+    :param initial_state: None (zeros) or constant initial state value, e.g., .5
+    :param learn_initial_state: if True, initial state is trainable
+
+    :return: layer class, dict of extra kwargs
+    """
+    if initial_state is None and not learn_initial_state:
+        return rnn_class, dict()
+
+    init_classes = {SimpleRNN: InitSimpleRNN, GRU: InitGRU, LSTM: InitLSTM}
+    return init_classes[rnn_class], {'initial_state_value': initial_state,
+                                     'learn_initial_state': learn_initial_state}
+
+
 """
 To use the model call it somethig like this...from 
 /home/nm13850/Documents/PhD/Python/learning_new_functions/CNN_sim_script/conv_march_2019/conv_tutorial3/train_vgg.py
@@ -27,7 +113,8 @@ class Bowers14rnn:
     @staticmethod
     def build(features, classes, timesteps, batch_size, n_layers=1, units_per_layer=200,
               serial_recall=True, act_func='sigmoid', y_1hot=False, dropout=0.0,
-              weight_init='GlorotUniform', unroll=False):
+              weight_init='GlorotUniform', unroll=False,
+              initial_state=None, learn_initial_state=False):
         """
         :param features: input shape, which is n_letters (30) + 1, for end_of_seq_cue.
         :param classes: Vocab size (either 30 or 300)
@@ -36,12 +123,16 @@ class Bowers14rnn:
         :param act_func: Jeff Used Sigmoids, typically SimpleRNN uses Tanh
         :param y_1hot: If output is 1hot/softmax
         :param dropout: Not used
+        :param initial_state: None (zeros) or constant initial state, e.g., .5 for LENS
+        :param learn_initial_state: if True, initial state is trainable (starting at initial_state)
 
         :return:
         """
         model = Sequential(name="Bowers14rnn")
 
-        model.add(SimpleRNN(units=units_per_layer,
+        rnn_layer, init_kwargs = get_rnn_layer(SimpleRNN, initial_state, learn_initial_state)
+
+        model.add(rnn_layer(units=units_per_layer,
 
                             # input_shape=(timesteps, features),
 
@@ -56,7 +147,7 @@ class Bowers14rnn:
                             # stateful=True,
                             activation=act_func, dropout=dropout, name="hid0",
 
-                            unroll=unroll))
+                            unroll=unroll, **init_kwargs))
 
         if y_1hot:
             model.add(Dense(classes, name='output', activation='softmax'))
@@ -249,7 +340,8 @@ class SimpleRNNn:
               masking=False,
               weight_init='GlorotUniform',
               init_range=1,
-              unroll=False, stateful=False):
+              unroll=False, stateful=False,
+              initial_state=None, learn_initial_state=False):
         """
         :param features: input shape, which is n_letters (30) + 1, for end_of_seq_cue.
         :param classes: Vocab size (either 30 or 300)
@@ -267,12 +359,16 @@ class SimpleRNNn:
         :param unroll: uses more memory but trains faster
         :param stateful: stateful RNN does not reset states after each sequence.
             I need to set this to True in order to set the state to a given value at the start of
-            a sequences as in Bowers 14.
+            a sequences as in Bowers 14.  (or use initial_state)
+        :param initial_state: None (zeros) or constant initial state, e.g., .5 for LENS
+        :param learn_initial_state: if True, initial state is trainable (starting at initial_state)
 
         :return: model
         """
         model = Sequential(name="SimpleRNNn")
 
+        rnn_layer, init_kwargs = get_rnn_layer(SimpleRNN, initial_state, learn_initial_state)
+
         if weight_init == 'LENS':
             weight_init = RandomUniform(minval=-init_range, maxval=init_range, seed=None)
 
@@ -289,7 +385,7 @@ class SimpleRNNn:
             if layer == n_layers-1:  # last layer
                 layer_seqs = serial_recall
 
-            model.add(SimpleRNN(units=units_per_layer,
+            model.add(rnn_layer(units=units_per_layer,
 
                                 kernel_initializer=weight_init,
 
@@ -307,7 +403,7 @@ class SimpleRNNn:
 
                                 activation=act_func, dropout=dropout, name=f"hid{layer}",
 
-                                unroll=unroll))
+                                unroll=unroll, **init_kwargs))
 
         if y_1hot:
             model.add(Dense(classes, name='output', activation='softmax'))
@@ -323,7 +419,8 @@ class GRUn:
     def build(features, classes, timesteps, batch_size, n_layers=1, units_per_layer=200,
               serial_recall=True, act_func='tanh', y_1hot=False, dropout=0.0,
               masking=False,
-              weight_init='glorot_uniform', unroll=False, stateful=False):
+              weight_init='glorot_uniform', unroll=False, stateful=False,
+              initial_state=None, learn_initial_state=False):
         """
         :param features: input shape, which is n_letters (30) + 1, for end_of_seq_cue.
         :param classes: Vocab size (either 30 or 300)
@@ -340,12 +437,16 @@ class GRUn:
         :param unroll: uses more memory but trains faster
         :param stateful: stateful RNN does not reset states after each sequence.
             I need to set this to True in order to set the state to a given value at the start of
-            a sequences as in Bowers 14.
+            a sequences as in Bowers 14.  (or use initial_state)
+        :param initial_state: None (zeros) or constant initial state, e.g., .5 for LENS
+        :param learn_initial_state: if True, initial state is trainable (starting at initial_state)
 
         :return: model
         """
         model = Sequential(layers=n_layers, name="GRUn")
 
+        rnn_layer, init_kwargs = get_rnn_layer(GRU, initial_state, learn_initial_state)
+
         layer_seqs = True
         l_input_width = units_per_layer
 
@@ -359,7 +460,7 @@ class GRUn:
             if layer == n_layers - 1:  # last layer
                 layer_seqs = serial_recall
 
-            model.add(GRU(units=units_per_layer,
+            model.add(rnn_layer(units=units_per_layer,
                           batch_input_shape=(batch_size, timesteps, l_input_width),
                           kernel_initializer=weight_init,
 
@@ -369,7 +470,7 @@ class GRUn:
                           # stateful=True,
                           activation=act_func, dropout=dropout, name=f"hid{layer}",
 
-                          unroll=unroll))
+                          unroll=unroll, **init_kwargs))
 
         if y_1hot:
             model.add(Dense(classes, name='output', activation='softmax'))
@@ -387,7 +488,8 @@ class LSTMn:
     def build(features, classes, timesteps, batch_size, n_layers=1, units_per_layer=200,
               serial_recall=True, act_func='tanh', y_1hot=False, dropout=0.0,
               masking=False,
-              weight_init='glorot_uniform', unroll=False, stateful=False):
+              weight_init='glorot_uniform', unroll=False, stateful=False,
+              initial_state=None, learn_initial_state=False):
         """
         :param features: input shape, which is n_letters (30) + 1, for end_of_seq_cue.
         :param classes: Vocab size (either 30 or 300)
@@ -404,11 +506,15 @@ class LSTMn:
         :param unroll: uses more memory but trains faster
         :param stateful: stateful RNN does not reset states after each sequence.
             I need to set this to True in order to set the state to a given value at the start of
-            a sequences as in Bowers 14.
+            a sequences as in Bowers 14.  (or use initial_state)
+        :param initial_state: None (zeros) or constant initial state, e.g., .5 for LENS
+        :param learn_initial_state: if True, initial state is trainable (starting at initial_state)
 
         :return: model
         """
         model = Sequential(name="LSTMn")
+
+        rnn_layer, init_kwargs = get_rnn_layer(LSTM, initial_state, learn_initial_state)
         # model = Sequential(layers=n_layers, name="LSTMn")
         # model = tf.keras.models.Sequential(layers=n_layers, name="LSTMn")
 
@@ -425,7 +531,7 @@ class LSTMn:
             if layer == n_layers - 1:  # last layer
                 layer_seqs = serial_recall
 
-            model.add(LSTM(units=units_per_layer,
+            model.add(rnn_layer(units=units_per_layer,
 
                            # input_shape=(timesteps, l_input_width),
 
@@ -439,7 +545,7 @@ class LSTMn:
                            stateful=stateful,
                            activation=act_func, dropout=dropout, name=f"hid{layer}",
 
-                           unroll=unroll))
+                           unroll=unroll, **init_kwargs))
 
         if y_1hot:
             model.add(Dense(classes, name='output', activation='softmax'))
@@ -1,10 +1,9 @@
 import os
 import numpy as np
-import itertools
-import more_itertools
 import pandas as pd
 import tensorflow as tf
-from tensorflow.keras.models import load_model, Model
+from tensorflow.keras.models import load_model, Model, Sequential
+from tensorflow.keras.layers import Input
 
 from tools.dicts import load_dict, focussed_dict_print, print_nested_round_floats
 from tools.data import running_on_laptop, switch_home_dirs
@@ -12,9 +11,14 @@ from tools.data import running_on_laptop, switch_home_dirs
 
 
 def get_label_seqs(n_labels=30, seq_len=3, repetitions=False, n_seqs=1, cycles=False,
+                   seed=None,
                    ):
     """
     Generate random sequences of labels for STM_RNN project.
+    All seqs are drawn at once with a numpy Generator:
+        no repetitions: argsort of random values (a random permutation per seq), first seq_len,
+            or for short seqs, random ints with any seqs containing repeats drawn again.
+        repetitions: random ints.
 
     :param n_labels: number of labels to select from
     :param seq_len: Number of labels to select for each seq
@@ -22,54 +26,36 @@ def get_label_seqs(n_labels=30, seq_len=3, repetitions=False, n_seqs=1, cycles=F
         If False, items may only appear in each sequence once.
     :param n_seqs: number of sequences to generate.
     :param cycles: default=False: All seqs same len,
-                    True: seqs of [1, 2, 3,... n]
+                    True: seqs of [1, 2, 3,... n], padded (post) with n_labels.
+    :param seed: int (or np.random.Generator) for np.random.default_rng
 
     :return: 2d numpy array (n_seqs, seq_len)
     """
-    class_list = np.arange(n_labels)
-
-    sequences = []
+    rng = np.random.default_rng(seed)
+
+    if not repetitions and n_labels < seq_len:
+        raise ValueError(f"Can not produce seqs (max_len {seq_len}) with no repetitions using only {n_labels} labels")
+
+    if repetitions:
+        sequences = rng.integers(0, n_labels, size=(n_seqs, seq_len))
+    elif seq_len * (seq_len - 1) < n_labels:
+        # # short seqs from many labels: draw with replacement, redraw seqs with a repeat
+        # # (each set of distinct labels, in each order, is equally likely)
+        sequences = rng.integers(0, n_labels, size=(n_seqs, seq_len))
+        redraw = np.any(np.diff(np.sort(sequences, axis=1), axis=1) == 0, axis=1)
+        while redraw.any():
+            sequences[redraw] = rng.integers(0, n_labels, size=(int(redraw.sum()), seq_len))
+            redraw[redraw] = np.any(np.diff(np.sort(sequences[redraw], axis=1), axis=1) == 0, axis=1)
+    else:
+        sequences = np.argsort(rng.random((n_seqs, n_labels)), axis=1)[:, :seq_len]
 
     if cycles:
-        max_len = seq_len
-        seq_len_list = (list(range(1, max_len + 1)))
-        seq_len_gen = itertools.cycle(seq_len_list)
-
-        for s in range(n_seqs):
-            this_len = next(seq_len_gen)
-            # print(f'seq: {s}, this_len: {this_len}')
-
-            if repetitions:
-                # print('repetions')
-                this_seq = more_itertools.random_product(class_list, repeat=this_len)
-            else:
-                # print('no repetions')
-                if n_labels < max_len:
-                    raise ValueError(f"Can not produce seqs (max_len {max_len}) with no repetitions using only {n_labels} labels")
-                this_seq = more_itertools.random_permutation(iterable=class_list, r=this_len)
-
-            sequences.append(this_seq)
-
-        padded = tf.keras.preprocessing.sequence.pad_sequences(sequences,
-                                                               maxlen=max_len,
-                                                               dtype='int32',
-                                                               padding='post',
-                                                               truncating='pre',
-                                                               value=n_labels)
-        # print(f"padded:\n{padded}")
-        sequences = padded
-
-    else:
-        for s in range(n_seqs):
-            if repetitions:
-                # print('repetions')
-                this_seq = more_itertools.random_product(class_list, repeat=seq_len)
-            else:
-                # print('no repetions')
-                this_seq = more_itertools.random_permutation(iterable=class_list, r=seq_len)
-            sequences.append(this_seq)
+        # # seq lengths cycle [1, 2, 3... seq_len], the rest is padding
+        seq_lens = np.arange(n_seqs) % seq_len + 1
+        is_pad = np.arange(seq_len)[None, :] >= seq_lens[:, None]
+        sequences = np.where(is_pad, n_labels, sequences).astype('int32')
 
-    return np.array(sequences)
+    return sequences
 
 
 # # # test get_label_seqs
@@ -223,6 +209,114 @@ def get_X_and_Y_data_from_seq(vocab_dict,
 
     return np.array(x_data), np.array(y_data)
 
+def get_vocab_tables(vocab_dict, x_data_types=('dist_letter_X', 'local_word_X', 'local_letter_X')):
+    """
+    Turn vocab_dict into dense lookup tables (once), for encode_label_seqs().
+    Row n is word n.  There is an extra row of zeros at the end (index n_words) for pad items.
+
+    :param vocab_dict: Dict containing the codes for Y and Y data (or path to it)
+    :param x_data_types: which codes to make tables for
+
+    :return: vocab_tables: dict {'n_words': n_words, x_data_type: (n_words + 1, x_size) array}
+    """
+    if type(vocab_dict) is str:
+        vocab_dict = load_dict(vocab_dict)
+
+    n_words = max(list(vocab_dict.keys())) + 1
+    vocab_tables = {'n_words': n_words}
+
+    for x_data_type in x_data_types:
+        codes = np.array([vocab_dict[word][x_data_type] for word in range(n_words)])
+        vocab_tables[x_data_type] = np.vstack((codes, np.zeros((1, codes.shape[1]),
+                                                               dtype=codes.dtype)))
+
+    return vocab_tables
+
+
+def encode_label_seqs(label_seqs, vocab_tables,
+                      serial_recall=False,
+                      output_type='classes',
+                      x_data_type='dist_letter_X',
+                      end_seq_cue=False,
+                      train_cycles=False,
+                      pad_label=None,
+                      ):
+    """
+    X and Y data for a whole array of label seqs, as get_X_and_Y_data_from_seq() does for one seq,
+    with one fancy-indexing lookup into the vocab tables.
+
+    Note: with train_cycles and output_type 'classes', Y has n_words + 1 units
+    (the last one is for the pad_label).
+
+    :param label_seqs: (n_seqs, seq_len) array of labels
+    :param vocab_tables: from get_vocab_tables()
+    :param x_data_type: 'local_word_X', 'local_letter_X', 'dist_letter_X'.
+    :param serial_recall: if True, Y array is a list of vectors
+                        If False, y-array is a single vector  e.g., activate all words simultaneously
+    :param output_type: default 'classes': output units represent class labels
+                        'letters' output units correspond to letters
+    :param end_seq_cue: if True, add input unit which is activated for the last item in each seq
+    :param train_cycles: default=False: All seqs same len,
+                    True: seqs of [1, 2, 3,... n]
+    :param pad_label: label used for padding with train_cycles
+
+    :return: numpy arrays of X_data (n_seqs, seq_len, x_size) and y_data
+    """
+
+    if type(output_type) is not str:
+        raise ValueError(f"output_type should be string: 'classes', or 'letters'")
+    if output_type == 'words':
+        output_type = 'classes'
+    elif output_type not in ['classes', 'letters']:
+        raise ValueError(f"output_type should be string: 'classes', or 'letters'")
+
+    if not serial_recall and output_type == 'letters':
+        raise ValueError(f"You can not have serial_recall=False and output_type='letters'\n"
+                         f"This would require reporting all letters in the list at a single timestep")
+
+    label_seqs = np.asarray(label_seqs)
+    if label_seqs.ndim == 1:
+        label_seqs = label_seqs.reshape(1, -1)
+    n_seqs, seq_len = label_seqs.shape
+    n_words = vocab_tables['n_words']
+
+    # # pad items use the row of zeros at the end of each table
+    seq_rows = label_seqs
+    if train_cycles:
+        if type(pad_label) is not int:
+            raise ValueError(f"for train cycles enter int for pad_label which gives the class of the pad")
+        seq_rows = np.where(label_seqs == pad_label, n_words, label_seqs)
+
+    # # X data
+    x_data = vocab_tables[x_data_type][seq_rows]
+    if end_seq_cue:
+        # this doesn't give a specific cue at the end of the seq
+        x_data = np.concatenate((x_data, np.zeros((n_seqs, seq_len, 1), dtype=x_data.dtype)),
+                                axis=2)
+
+    # # Y data
+    if serial_recall:
+        if output_type == 'classes':
+            # # 1hot class labels for each item
+            n_items = n_words
+            if train_cycles:
+                n_items = n_words + 1
+            y_data = np.eye(n_items, dtype=int)[seq_rows]
+        else:
+            # # use local-letter-x for output vectors
+            y_data = vocab_tables['local_letter_X'][seq_rows]
+            if end_seq_cue:
+                y_data = np.concatenate((y_data, np.zeros((n_seqs, seq_len, 1),
+                                                          dtype=y_data.dtype)), axis=2)
+    else:
+        # # free-recall: a single vector per seq, with all items in the seq activated
+        y_data = np.zeros((n_seqs, n_words + 1), dtype=int)
+        y_data[np.arange(n_seqs)[:, None], seq_rows] = 1
+        y_data = y_data[:, :n_words]
+
+    return x_data, y_data
+
+
 # # test get_X_and_Y_data_from_seq
 # print("\ntest get_X_and_Y_data_from_seq")
 # vocab_dict = load_dict('/home/nm13850/Documents/PhD/python_v2/datasets/RNN/bowers14_rep/vocab_30_dict.txt')
@@ -319,55 +413,154 @@ def generate_STM_RNN_seqs(data_dict,
               f"serial_recall={serial_recall}\noutput_type={output_type}\n"
               f"x_data_type={x_data_type}\nend_seq_cue={end_seq_cue}\ntrain_cycles: {train_cycles}")
 
-    # load vocab dict
-    vocab_dict = load_dict(os.path.join(data_dict['data_path'], data_dict['vocab_dict']))
+    # load vocab dict (as lookup tables, made once)
+    vocab_tables = get_vocab_tables(os.path.join(data_dict['data_path'], data_dict['vocab_dict']))
     n_cats = data_dict['n_cats']
     # class_list = list(range(n_cats))
 
+    if train_cycles:
+        pad_label = n_cats
+
     while True:      # this allows it to go on forever
-        x_batch = []
-        y_batch = []
 
-        if train_cycles:
-            # # generate a whole batch of seqs at once, then get x and y one-at-a-time
-            pad_label = n_cats
-            batch_of_seqs = get_label_seqs(n_labels=n_cats, seq_len=seq_len, repetitions=repetitions,
-                                           n_seqs=batch_size,
-                                           cycles=True)
+        # # generate a whole batch of seqs at once, then get x and y for the whole batch
+        batch_of_seqs = get_label_seqs(n_labels=n_cats, seq_len=seq_len, repetitions=repetitions,
+                                       n_seqs=batch_size,
+                                       cycles=train_cycles)
 
-        for items in range(batch_size):
+        x_batch, y_batch = encode_label_seqs(batch_of_seqs, vocab_tables,
+                                             x_data_type=x_data_type,
+                                             serial_recall=serial_recall,
+                                             output_type=output_type,
+                                             end_seq_cue=end_seq_cue,
+                                             train_cycles=train_cycles,
+                                             pad_label=pad_label,
+                                             )
 
-            if train_cycles:
-                this_seq = batch_of_seqs[items]
-            else:
-                this_seq = get_label_seqs(n_labels=n_cats, seq_len=seq_len, repetitions=repetitions)
+        if verbose:
+            print(f'\nbatch_of_seqs: {batch_of_seqs}\n'
+                  f'x_batch:\n{x_batch}\n'
+                  f'y_batch:\n{y_batch}\n')
 
-            # get input and output data from vocab dict for this_seq
-            get_X, get_Y = get_X_and_Y_data_from_seq(vocab_dict=vocab_dict,
-                                                     seq_line=this_seq,
-                                                     x_data_type=x_data_type,
-                                                     serial_recall=serial_recall,
-                                                     output_type=output_type,
-                                                     end_seq_cue=end_seq_cue,
-                                                     train_cycles=train_cycles,
-                                                     pad_label=pad_label,
-                                                     )
+        # yeild returns a generator not an array.
+        yield x_batch, y_batch
+
+def make_STM_RNN_dataset(data_dict,
+                         seq_len,
+                         batch_size=16,
+                         repetitions=False,
+                         serial_recall=False,
+                         output_type='classes',
+                         x_data_type='dist_letter_X',
+                         end_seq_cue=False,
+                         train_cycles=False,
+                         seed=None,
+                         verbose=False,
+                         ):
+    """
+    tf.data version of generate_STM_RNN_seqs(), for model.fit().
 
+    Each batch is made in-graph: labels are sampled for the whole batch at once
+    (argsort of random values for no repetitions, random ints with repetitions),
+    then X and Y are looked up from the vocab tables (see encode_label_seqs()).
+    Batches are made with map(num_parallel_calls=AUTOTUNE) and prefetched.
+    Random ops are stateless, seeded with (seed, batch number), so a seed gives the same batches
+    whatever the number of parallel calls.
 
-            x_batch.append(get_X)
-            y_batch.append(get_Y)
+    :param data_dict: dict for this dataset with links to vocab_dict
+    :param seq_len: Or time-steps.  number of items per seq.
+    :param batch_size: number of seqs per batch
+    :param repetitions: if True a sequence may contain an item more than once e.g. [0, 1, 0]
+        If False, items may only appear in each sequence once.
+    :param serial_recall: if True, Y array is a list of vectors
+                        If False, y-array is a single vector  e.g., activate all words simultaneously
+    :param output_type: default 'classes': output units represent class labels
+                        'letters' output units correspond to letters
+    :param x_data_type: 'local_word_X', 'local_letter_X', 'dist_letter_X'.
+    :param end_seq_cue: if True, add input unit which is activated for the last item in each seq
+    :param train_cycles: if False, all lists lengths = timesteps.
+                        If True, seqs in each batch have lengths [1, 2, 3,...timesteps],
+                        padded (post) with label n_cats.
+    :param seed: int for reproducible batches.  If None, a random seed is used.
+    :param verbose: how much to print to screen
 
-            # print(f"testing end seq cue")
-            # print(f"get_X: {get_X}")
-            # print(f"get_Y: {get_Y}")
+    :return: tf.data.Dataset of (x_batch, y_batch), float32, repeats forever.
+    """
 
-            if verbose:
-                print(f'\nthis seq: {this_seq}\n'
-                      f'x_batch:\n{x_batch}\n'
-                      f'y_batch:\n{y_batch}\n')
+    if verbose:
+        print(f'\n*** running make_STM_RNN_dataset() ***')
+        print(f"seq_len={seq_len}\nbatch_size={batch_size}\nrepetitions={repetitions}\n"
+              f"serial_recall={serial_recall}\noutput_type={output_type}\n"
+              f"x_data_type={x_data_type}\nend_seq_cue={end_seq_cue}\ntrain_cycles: {train_cycles}\n"
+              f"seed: {seed}")
+
+    if output_type == 'words':
+        output_type = 'classes'
+    if not serial_recall and output_type == 'letters':
+        raise ValueError(f"You can not have serial_recall=False and output_type='letters'\n"
+                         f"This would require reporting all letters in the list at a single timestep")
+
+    vocab_tables = get_vocab_tables(os.path.join(data_dict['data_path'], data_dict['vocab_dict']))
+    n_cats = data_dict['n_cats']
+    n_words = vocab_tables['n_words']
+
+    if not repetitions and n_cats < seq_len:
+        raise ValueError(f"Can not produce seqs (max_len {seq_len}) with no repetitions using only {n_cats} labels")
+
+    if seed is None:
+        seed = np.random.randint(2 ** 31 - 1)
+
+    x_table = tf.constant(vocab_tables[x_data_type], dtype=tf.float32)
+    letter_table = tf.constant(vocab_tables['local_letter_X'], dtype=tf.float32)
+
+    # # for train_cycles, seq lengths cycle [1, 2, 3... seq_len] through each batch
+    seq_lens = np.arange(batch_size) % seq_len + 1
+    is_pad = tf.constant(np.arange(seq_len)[None, :] >= seq_lens[:, None])
+
+    def make_batch(batch_number):
+        batch_seed = tf.stack([tf.constant(seed, dtype=tf.int64), batch_number])
+
+        # # labels for the whole batch
+        if repetitions:
+            label_seqs = tf.random.stateless_uniform([batch_size, seq_len], seed=batch_seed,
+                                                     minval=0, maxval=n_cats, dtype=tf.int32)
+        else:
+            # # random permutation per seq, keep the first seq_len
+            rand_vals = tf.random.stateless_uniform([batch_size, n_cats], seed=batch_seed)
+            label_seqs = tf.argsort(rand_vals, axis=1, stable=True)[:, :seq_len]
+
+        # # pad items use the row of zeros at the end of each table
+        seq_rows = label_seqs
+        if train_cycles:
+            seq_rows = tf.where(is_pad, n_words, label_seqs)
+
+        x_batch = tf.gather(x_table, seq_rows)
+        if end_seq_cue:
+            # this doesn't give a specific cue at the end of the seq
+            x_batch = tf.pad(x_batch, [[0, 0], [0, 0], [0, 1]])
+
+        if serial_recall:
+            if output_type == 'classes':
+                n_items = n_words
+                if train_cycles:
+                    n_items = n_words + 1
+                y_batch = tf.one_hot(seq_rows, n_items)
+            else:
+                y_batch = tf.gather(letter_table, seq_rows)
+                if end_seq_cue:
+                    y_batch = tf.pad(y_batch, [[0, 0], [0, 0], [0, 1]])
+        else:
+            # # free-recall: all items in the seq activated in a single vector
+            y_batch = tf.reduce_max(tf.one_hot(seq_rows, n_words + 1), axis=1)[:, :n_words]
+
+        return x_batch, y_batch
+
+    dataset = tf.data.Dataset.range(2 ** 62)
+    dataset = dataset.map(make_batch, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+    return dataset
 
-        # yeild returns a generator not an array.
-        yield np.asarray(x_batch), np.asarray(y_batch)
 
 ######################################
 # print("\ntest generate_STM_RNN_seqs")
@@ -558,6 +751,93 @@ def generate_STM_seq2seqs(data_dict,
 # print(f"\ny_data: {type(y_data)}  {np.shape(y_data)}")
 # # print(y_data)
 
+def label_seqs_to_sets(label_seqs, n_cats):
+    """
+    Encode the set of labels in each seq as a row of a boolean matrix.
+    Labels outside 0 to n_cats-1 (e.g., pad labels or -1) are ignored.
+
+    :param label_seqs: 2d array (n_seqs, seq_len) of int labels
+    :param n_cats: number of classes
+
+    :return: boolean array (n_seqs, n_cats)
+    """
+    label_seqs = np.asarray(label_seqs, dtype=int)
+    n_seqs = len(label_seqs)
+
+    # # invalid labels go in an extra column which is dropped
+    cols = np.where((label_seqs >= 0) & (label_seqs < n_cats), label_seqs, n_cats)
+    label_sets = np.zeros((n_seqs, n_cats + 1), dtype=bool)
+    label_sets[np.arange(n_seqs)[:, np.newaxis], cols] = True
+
+    return label_sets[:, :n_cats]
+
+
+def get_iou_scores(true_sets, pred_sets, n_wrong=None):
+    """
+    IoU per seq from boolean (n_seqs, n_cats) label set matrices.
+        intersection = labels in both true and pred sets.
+        union = labels in either set (plus n_wrong).
+    If union is empty (no true or predicted labels) IoU is 1.0.
+
+    :param true_sets: boolean array (n_seqs, n_cats)
+    :param pred_sets: boolean array (n_seqs, n_cats)
+    :param n_wrong: None or int array (n_seqs, ), number of predicted labels
+        that are not in true_sets and are not coded in pred_sets.
+
+    :return: float array (n_seqs, ) of IoU scores
+    """
+    intersection = np.count_nonzero(true_sets & pred_sets, axis=1)
+    union = np.count_nonzero(true_sets | pred_sets, axis=1)
+    if n_wrong is not None:
+        union = union + n_wrong
+
+    iou_scores = np.ones(len(union))
+    np.divide(intersection, union, out=iou_scores, where=union > 0)
+
+    return iou_scores
+
+
+def seq_IoU(y_true, y_pred):
+    """
+    In-graph IoU metric for model.compile(metrics=[seq_IoU]).
+    Same scoring as get_iou_scores(), keras gives the mean over seqs (mean_IoU).
+        free recall (batch, n_cats): label sets are units > .5.
+        serial recall (batch, timesteps, n_cats): predicted labels are argmax per timestep,
+            timesteps with no target (e.g., padding) are ignored.
+
+    :param y_true: target tensor
+    :param y_pred: output tensor
+
+    :return: IoU per seq
+    """
+    if len(y_pred.shape) == 3:
+        n_cats = tf.shape(y_pred)[-1]
+        has_target = tf.reduce_max(y_true, axis=-1, keepdims=True) > .5
+        pred_1hot = tf.one_hot(tf.argmax(y_pred, axis=-1), n_cats) > .5
+        true_sets = tf.reduce_any(y_true > .5, axis=1)
+        pred_sets = tf.reduce_any(tf.logical_and(pred_1hot, has_target), axis=1)
+    else:
+        true_sets = y_true > .5
+        pred_sets = y_pred > .5
+
+    intersection = tf.reduce_sum(tf.cast(tf.logical_and(true_sets, pred_sets), tf.float32), axis=-1)
+    union = tf.reduce_sum(tf.cast(tf.logical_or(true_sets, pred_sets), tf.float32), axis=-1)
+
+    return tf.where(union > 0, intersection / tf.maximum(union, 1.), tf.ones_like(union))
+
+
+def seq_corr(y_true, y_pred):
+    """
+    In-graph metric: 1.0 for seqs where IoU == 1.0, keras gives the mean over seqs (prop_seq_corr).
+
+    :param y_true: target tensor
+    :param y_pred: output tensor
+
+    :return: 1.0 or 0.0 per seq
+    """
+    return tf.cast(tf.equal(seq_IoU(y_true, y_pred), 1.), tf.float32)
+
+
 # get test scores.
 def get_test_scores(model, data_dict, test_label_seqs,
                     x_data_type='dist_letter_X',
@@ -586,6 +866,9 @@ def get_test_scores(model, data_dict, test_label_seqs,
     For free recall - IoU is already set up/ (sort Y-True)
     For serial, turn predictions into seq labels (don't sort)
 
+    True and predicted labels are encoded as boolean (n_seqs, n_cats) sets
+    (label_seqs_to_sets()), and scored all at once with get_iou_scores().
+
     :param model: trained model
     :param data_dict: dict with relevant info including link to vocab dict
     :param test_label_seqs: sequence of labels to test on
@@ -604,31 +887,25 @@ def get_test_scores(model, data_dict, test_label_seqs,
         print("\n**** get_test_scores() ****")
 
     # # load x and y data from vocab dict.
-    vocab_dict = load_dict(os.path.join(data_dict['data_path'], data_dict['vocab_dict']))
+    vocab_tables = get_vocab_tables(os.path.join(data_dict['data_path'], data_dict['vocab_dict']))
 
 
-    # with test_labels get x and y data from get_x_and_Y_data_from_seq
+    # with test_labels get x and y data for all seqs at once
     labels_test = test_label_seqs
     if len(np.shape(labels_test)) == 2:
         n_seqs, seq_len = np.shape(labels_test)
 
-    x_test = []
-    y_test = []
-    for this_seq in labels_test:
-        get_x, get_y = get_X_and_Y_data_from_seq(vocab_dict=vocab_dict,
-                                                 seq_line=this_seq,
-                                                 serial_recall=serial_recall,
-                                                 output_type=output_type,
-                                                 x_data_type=x_data_type,
-                                                 end_seq_cue=end_seq_cue,
-                                                 train_cycles=False,
-                                                 pad_label=None,
-                                                 )
-        x_test.append(get_x)
-        y_test.append(get_y)
-
-    x_test = np.array(x_test).astype(np.float32)
-    y_test = np.array(y_test).astype(np.float32)
+    x_test, y_test = encode_label_seqs(labels_test, vocab_tables,
+                                       serial_recall=serial_recall,
+                                       output_type=output_type,
+                                       x_data_type=x_data_type,
+                                       end_seq_cue=end_seq_cue,
+                                       train_cycles=False,
+                                       pad_label=None,
+                                       )
+
+    x_test = x_test.astype(np.float32)
+    y_test = y_test.astype(np.float32)
 
     if verbose:
         print(f"\nlabels_test: {np.shape(labels_test)}\n{labels_test[0]}\n"
@@ -641,10 +918,14 @@ def get_test_scores(model, data_dict, test_label_seqs,
 
 
 
-    # # get class labels for predictions
+    n_cats = vocab_tables['n_words']
+    true_sets = label_seqs_to_sets(labels_test, n_cats)
+    n_wrong = None
+
+    # # get sets of predicted labels
     if serial_recall:
         # print("predicting classes")
-        if output_type is 'letters':
+        if output_type == 'letters':
             print(f"output_type: {output_type}\n")
 
             # print("predicting y_values")
@@ -653,54 +934,27 @@ def get_test_scores(model, data_dict, test_label_seqs,
             if verbose:
                 print(f"\npred_y_values: {np.shape(pred_y_values)}\n{pred_y_values[0]}\n")
 
-            # # get labels for classes where value is greater than .5
-            all_pred_labels = []
-
-
-            for index, seq in enumerate(pred_y_values):
-                # print(f"\n{index}. seq: {seq}\n")
-                these_pred_labels = []
-                for idx, item in enumerate(seq):
-                    # binarise at .5
-                    bin_item = [1. if x > .5 else 0. for x in item]
-                    print(f"\n\nbin_item: {bin_item}")
-
-                    # print(f"index: {index}, idx: {idx}, item:\n{item}\nbin_item:\n{bin_item}\n")
-                    true_item = y_test[index][idx]
-                    print(f"true_item: {true_item}")
-
-                    true_label = labels_test[index][idx]
-                    print(f"true_label: {true_label}")
-
-
-                    if np.array_equal(bin_item, true_item):
-                        pred_label = true_item
-                    elif sum(bin_item) == 0.0:
-                        pred_label = -999
-                    else:
-                        pred_label = -true_label
-
-                    print(f"pred_label: {pred_label}")
-
-                    these_pred_labels.append(pred_label)
-
-                    # print(f"these_pred_labels: \n{these_pred_labels}")
-
-
-                all_pred_labels.append(these_pred_labels)
-
+            # # binarise at .5, each item is either correct (same as y_test),
+            # # blank (all zero, coded as -999) or wrong (coded as -true_label).
+            bin_items = pred_y_values > .5
+            item_correct = np.all(bin_items == (y_test > .5), axis=2)
+            item_blank = ~np.any(bin_items, axis=2)
+            item_wrong = ~item_correct & ~item_blank
 
+            pred_sets = label_seqs_to_sets(np.where(item_correct, labels_test, -1), n_cats)
 
+            # # wrong and blank labels are never in the true set, so only add to the union
+            # # (as sets, repeats of a wrong label or of -999 are only counted once).
+            n_wrong = np.count_nonzero(label_seqs_to_sets(np.where(item_wrong, labels_test, -1),
+                                                          n_cats), axis=1)
+            n_wrong += np.any(item_blank, axis=1)
 
         else:
             print(f"output_type: {output_type}")
 
-            all_pred_labels = model.predict_classes(x_test, batch_size=batch_size, verbose=1)
-
-
-        # # sanitycheck
-        # pred_y_values = model.predict(x_test, batch_size=batch_size, verbose=verbose)
-
+            pred_y_values = model.predict(x_test, batch_size=batch_size, verbose=1)
+            all_pred_labels = np.argmax(pred_y_values, axis=-1)
+            pred_sets = label_seqs_to_sets(all_pred_labels, n_cats)
 
     else:
         # print("predicting y_values")
@@ -710,61 +964,27 @@ def get_test_scores(model, data_dict, test_label_seqs,
             print(f"pred_y_values: {np.shape(pred_y_values)}")
 
         # # get labels for classes where value is greater than .5
-        all_pred_labels = []
-        for seq in range(n_seqs):
-            these_pred_labels = np.argwhere(pred_y_values[seq] > .5)
-
-            # flatted predictions
-            if len(np.shape(these_pred_labels)) > 1:
-                these_pred_labels = np.ravel(these_pred_labels).tolist()
-            all_pred_labels.append(these_pred_labels)
-
-        # print(f"\npred_y_values: {np.shape(pred_y_values)}")
-        # print(f"y_test: {np.shape(y_test)}")
-        # for seq in range(n_seqs):
-        #     print(f"\npred_y_values: {pred_y_values[seq]}")
-        #     print(f"all_pred_labels: {all_pred_labels[seq]}")
-        #     print(f"y_test: {y_test[seq]}")
+        pred_sets = pred_y_values > .5
 
     if verbose:
-        print(f"all_pred_labels: {np.shape(all_pred_labels)}\n{all_pred_labels[0]}\n")
+        print(f"pred_sets: {np.shape(pred_sets)}\n{np.flatnonzero(pred_sets[0])}\n")
         print(f"y_test: {np.shape(y_test)}")
 
     if verbose:
         print("\nIoU acc")
-    iou_scores = []
-    seq_corr_list = []
-    for seq in range(n_seqs):
-
-        true_labels = labels_test[seq, :]
-        pred_labels = all_pred_labels[seq]
-
-        # make set to get intersection and union
-        pred_labels = set(pred_labels)
-
-        intersection = pred_labels.intersection(true_labels)
-        union = pred_labels.union(true_labels)
-
-        IoU = len(intersection) / len(union)
-        iou_scores.append(IoU)
-
-        if IoU == 1.0:
-            seq_corr_list.append(int(1))
-        else:
-            seq_corr_list.append(int(0))
-
-        if verbose:
-            print(f"{seq}: pred: {pred_labels} true: {true_labels} len(intersection): {len(intersection)} IoU: {IoU}")
+    iou_scores = get_iou_scores(true_sets, pred_sets, n_wrong=n_wrong)
+    seq_corr_list = (iou_scores == 1.0).astype(int).tolist()
 
     # get the average of all IoUs (per seq/batch etc
-    mean_IoU = sum(iou_scores) / len(iou_scores)
+    mean_IoU = float(np.mean(iou_scores))
 
     # # get prop of seqs where IoU == 1.0
     n_seq_corr = sum(seq_corr_list)
-    # print(f"n_seq_corr: {n_seq_corr}")
-    # print(f"len(seq_corr_list): {len(seq_corr_list)}")
     prop_seq_corr = n_seq_corr / len(seq_corr_list)
 
+    if verbose:
+        print(f"0: true: {labels_test[0]} IoU: {iou_scores[0]}")
+
 
     scores_dict = {"n_seqs": n_seqs,
                    "mean_IoU": mean_IoU,
@@ -840,8 +1060,8 @@ def free_rec_acc(y_true, y_pred, get_prop_corr=False):
     1. Input is y_pred and y_true arrays.
         for free recall these will be a single vector per item
     2. Covert y_pred to binary array where elements are greater than .5
-    3. convert y+pred and y-true to lists of indices where vector is 1.
-    4. Compare these to get IoU list
+    3. convert y+pred and y-true to boolean label sets where vector is 1.
+    4. Compare these to get IoU list (get_iou_scores)
 
     5. either: get mean of IoU list
                 get proportion of items where IoU == 1.0
@@ -859,71 +1079,15 @@ def free_rec_acc(y_true, y_pred, get_prop_corr=False):
         print(f"\ny_true\ntype: {type(y_true)}\n{y_true}")
         raise ValueError(f"y_true ({np.shape(y_true)}) and y_pred ({np.shape(y_pred)}) should be same shape")
 
-    n_seqs, n_cats = np.shape(y_pred)
-
-    # # check shapes
-    # print(f"\ny_pred: {np.shape(y_pred)}.  y_true: {np.shape(y_true)}")
-
-    # # get labels for classes where value is greater than .5
-    predicted_labels = []
-    true_labels = []
-    for seq in range(n_seqs):
-        these_pred_labels = np.argwhere(y_pred[seq] > .5)
-        these_true_labels = np.argwhere(y_true[seq] > .5)
-
-        # flatted predictions
-        if len(np.shape(these_pred_labels)) > 1:
-            these_pred_labels = np.ravel(these_pred_labels).tolist()
-        predicted_labels.append(these_pred_labels)
-
-        # flatted predictions
-        if len(np.shape(these_true_labels)) > 1:
-            these_true_labels = np.ravel(these_true_labels).tolist()
-        true_labels.append(these_true_labels)
-
-    # # check labels
-    # for seq in range(n_seqs):
-        # print(f"\npredicted_labels: {predicted_labels[seq]}")
-        # print(f"true_labels: {true_labels[seq]}")
-    # print(f"\npredicted_labels: {predicted_labels}")
-    # print(f"true_labels: {true_labels}")
-
-    labels_test = true_labels
-
-    iou_scores = []
-    seq_corr_list = []
-    count_corr = 0
-    for seq in range(n_seqs):
-
-        these_true_labels = labels_test[seq]
-        # make set to get intersection and union
-        these_pred_labels = set(predicted_labels[seq])
-
-        intersection = these_pred_labels.intersection(these_true_labels)
-        union = these_pred_labels.union(these_true_labels)
-
-        IoU = len(intersection) / len(union)
-
-        if get_prop_corr:
-            if IoU == 1.0:
-                count_corr += 1
-        else:
-            iou_scores.append(IoU)
-
-        # if IoU == 1.0:
-        #     seq_corr_list.append(int(1))
-        # else:
-        #     seq_corr_list.append(int(0))
-        #
-        # if verbose:
-        #     print(f"{seq}: pred: {these_pred_labels} true: {these_true_labels} len(intersection): {len(intersection)} IoU: {IoU}")
+    # # label sets are classes where value is greater than .5
+    iou_scores = get_iou_scores(np.asarray(y_true) > .5, np.asarray(y_pred) > .5)
 
     if get_prop_corr:
         # get proportion of seqs where IoU == 1.0
-        accuracy = count_corr/n_seqs
+        accuracy = np.count_nonzero(iou_scores == 1.0) / len(iou_scores)
     else:
         # get the average of all IoUs (per seq/batch etc
-        accuracy = sum(iou_scores) / len(iou_scores)
+        accuracy = float(np.mean(iou_scores))
 
     return accuracy
 
@@ -955,23 +1119,70 @@ def free_rec_acc(y_true, y_pred, get_prop_corr=False):
 ####################
 
 
-def get_layer_acts(model, layer_name, data_dict, test_label_seqs,
-                   serial_recall=False,
-                   end_seq_cue=False,
-                   batch_size=16,
-                   verbose=True):
+def get_acts_model(model, layer_names, verbose=False):
     """
-    Get test hidden activations for the model for test_labels.
+    Make one model that outputs the activations of all layers in layer_names.
 
-    The layer being recorded from will ALWAYS have return_sequences=True,
-    so that I can record activations fro each timestep.
+    Recorded recurrent layers with return_sequences=False are rebuilt (from config) with
+    return_sequences=True and the trained weights are copied in with set_weights(),
+    so there are activations for each timestep.
+    The next layer gets the last timestep, as it would from the original layer.
+    All other layers are the trained layers (shared weights, nothing is copied).
 
-    1. First get x and y data from get_x_and_Y_data_from_seq
-    2. change return_sequences=True, if necessary
-    3. predictions to get layer activations
+    :param model: trained (Sequential) model
+    :param layer_names: list of layers to record from
+    :param verbose: how much to print to screen
+
+    :return: Model with one output per layer in layer_names (in that order)
+    """
+    if verbose:
+        print(f"\n**** get_acts_model({layer_names}) ****")
+
+    # # only Sequential models can be re-wired layer by layer
+    if not isinstance(model, Sequential):
+        return Model(inputs=model.input,
+                     outputs=[model.get_layer(name).output for name in layer_names])
+
+    x = inputs = Input(batch_shape=model.input_shape)
+    layer_outputs = dict()
+    for layer in model.layers:
+        if layer.name in layer_names and getattr(layer, 'return_sequences', None) is False:
+            layer_config = layer.get_config()
+            layer_config['return_sequences'] = True
+            seq_layer = layer.__class__.from_config(layer_config)
+            seq_acts = seq_layer(x)
+            seq_layer.set_weights(layer.get_weights())
+            if verbose:
+                print(f"{layer.name}: return_sequences=True, weights copied")
+
+            layer_outputs[layer.name] = seq_acts
+            x = seq_acts[:, -1, :]
+        else:
+            x = layer(x)
+            if layer.name in layer_names:
+                layer_outputs[layer.name] = x
+
+    missing = [name for name in layer_names if name not in layer_outputs]
+    if missing:
+        raise ValueError(f"layers not in model: {missing}")
+
+    return Model(inputs=inputs, outputs=[layer_outputs[name] for name in layer_names])
+
+
+def get_all_layer_acts(model, layer_names, data_dict, test_label_seqs,
+                       serial_recall=False,
+                       end_seq_cue=False,
+                       batch_size=16,
+                       verbose=True):
+    """
+    Get test hidden activations for several layers at once.
+
+    1. encode test_label_seqs once (encode_label_seqs)
+    2. one multi-output model with return_sequences=True on recorded recurrent layers (get_acts_model)
+    3. one predict for all layers
 
     :param model: trained model
-    :param layer_name: name of layer to get activations from
+    :param layer_names: list of layers to get activations from
     :param data_dict: dict with relevant info including link to vocab dict
     :param test_label_seqs: sequence of labels to test on
     :param serial_recall: Type of recall
@@ -979,64 +1190,71 @@ def get_layer_acts(model, layer_name, data_dict, test_label_seqs,
     :param batch_size: batch to predict at once
     :param verbose:
 
-    :return: np.array of activations at each timestep
+    :return: dict {layer_name: np.array of activations (seqs, timesteps, units)}
     """
 
-    print(f"\n**** get_layer_acts({layer_name}) ****")
-
+    print(f"\n**** get_all_layer_acts({layer_names}) ****")
 
     # # load x and y data from vocab dict.
-    vocab_dict = load_dict(os.path.join(data_dict['data_path'], data_dict['vocab_dict']))
+    vocab_tables = get_vocab_tables(os.path.join(data_dict['data_path'], data_dict['vocab_dict']))
 
-    # with test_label_seqs get x and y data from get_x_and_Y_data_from_seq
-    x_test = []
-    y_test = []
-    for this_seq in test_label_seqs:
-        get_x, get_y = get_X_and_Y_data_from_seq(vocab_dict=vocab_dict,
-                                                 seq_line=this_seq,
-                                                 serial_recall=serial_recall,
-                                                 end_seq_cue=end_seq_cue)
-        x_test.append(get_x)
-        y_test.append(get_y)
-
-    x_test = np.array(x_test)
-    y_test = np.array(y_test)
+    # with test_label_seqs get x and y data for all seqs at once
+    x_test, y_test = encode_label_seqs(test_label_seqs, vocab_tables,
+                                       serial_recall=serial_recall,
+                                       end_seq_cue=end_seq_cue)
 
     if verbose:
         print(f"\nx_test: {np.shape(x_test)}\ny_test: {np.shape(y_test)}\n"
               f"test_label_seqs: {np.shape(test_label_seqs)}")
 
-    # # make new model
-    gha_model = Model(inputs=model.input, outputs=model.get_layer(layer_name).output)
+    acts_model = get_acts_model(model, layer_names, verbose=verbose)
 
+    all_layer_acts = acts_model.predict(x_test, batch_size=batch_size, verbose=verbose)
+    if len(layer_names) == 1:
+        all_layer_acts = [all_layer_acts]
 
-    # # get hid acts for each timestep even if output is free-recall
-    # print("\nchanging layer attribute: return_sequnces")
-    # print(f"target layer_name: {layer_name}")
-    for layer in gha_model.layers:
-        # set to return sequences = True
-        # print(f"this layer name: {layer.name}")
-        if layer.name == layer_name:
-            # print("layer matches")
-            try:
-                layer.return_sequences = True
-                # print(layer.name, layer.return_sequences)
-            except AttributeError:
-                print(f"can't change return seqs on {layer.name}")
+    layer_acts_dict = dict(zip(layer_names, all_layer_acts))
 
-    # # get dict for updated model
-    gha_model_config = gha_model.get_config()
-    # focussed_dict_print(gha_model_config)
+    if verbose:
+        for layer_name, layer_activations in layer_acts_dict.items():
+            print(f"{layer_name} layer_activations: {np.shape(layer_activations)}")
 
-    # # I have to reload the model from the dict for the changes to actually take place!
-    gha_model = Model.from_config(gha_model_config)
+    return layer_acts_dict
 
-    layer_activations = gha_model.predict(x_test, batch_size=batch_size, verbose=verbose)
 
-    if verbose:
-        print(f"layer_activations: {np.shape(layer_activations)}")
+def get_layer_acts(model, layer_name, data_dict, test_label_seqs,
+                   serial_recall=False,
+                   end_seq_cue=False,
+                   batch_size=16,
+                   verbose=True):
+    """
+    Get test hidden activations for the model for test_labels.
+
+    The layer being recorded from will ALWAYS have return_sequences=True,
+    so that I can record activations fro each timestep.
+    To record from several layers, use get_all_layer_acts().
+
+    :param model: trained model
+    :param layer_name: name of layer to get activations from
+    :param data_dict: dict with relevant info including link to vocab dict
+    :param test_label_seqs: sequence of labels to test on
+    :param serial_recall: Type of recall
+    :param end_seq_cue: whether extra input unit is added
+    :param batch_size: batch to predict at once
+    :param verbose:
+
+    :return: np.array of activations at each timestep
+    """
+
+    layer_acts_dict = get_all_layer_acts(model=model, layer_names=[layer_name],
+                                         data_dict=data_dict,
+                                         test_label_seqs=test_label_seqs,
+                                         serial_recall=serial_recall,
+                                         end_seq_cue=end_seq_cue,
+                                         batch_size=batch_size,
+                                         verbose=verbose)
 
-    return layer_activations
+    return layer_acts_dict[layer_name]
 
 # ####################
 # print("\nTesting get_layer_acts")
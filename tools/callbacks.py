@@ -0,0 +1,209 @@
+import sys
+import time
+import resource
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.callbacks import Callback
+
+
+'''Training instrumentation.
+
+TrainingStatsCallback records the cost of training, not just loss and accuracy.
+Per epoch:
+    epoch_time          wall time (s) for the epoch (including validation)
+    step_time           time (s) inside train steps (batch begin to batch end)
+    steps_per_sec, items_per_sec
+    input_cost          time (s) the input pipeline takes to make this epoch's batches (upper bound on waiting)
+    compute_time        step_time - input_cost (lower bound on compute)
+    peak_rss_mb         peak resident memory of the process so far
+
+Keras fetches each batch inside the train step, so the input pipeline is timed on its own
+(probe_input_time() on the training data, before training starts).
+input_cost is then the probed input time per step, capped at the measured step time.
+This is the cost of making batches, not time spent waiting for them: with prefetch or workers,
+batches are made while the model computes, so the real wait can be much less than input_cost.
+If input_cost_frac is small, the run is not generator-bound; if it is close to 1 it might be.
+'''
+
+
+def peak_rss_mb():
+    """peak resident set size of this process in MB (ru_maxrss is bytes on mac, KB on linux)"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss / 1024 ** 2
+    return max_rss / 1024
+
+
+def probe_input_time(input_data, n_batches=20, verbose=False):
+    """
+    Time how long the input pipeline takes to make a batch, without any training.
+    The first batch is not timed (warm up).
+
+    :param input_data: tf.data.Dataset, keras Sequence (e.g., ImageDataGenerator.flow) or generator
+    :param n_batches: number of batches to time
+    :param verbose: how much to print to screen
+
+    :return: mean seconds per batch (NaN if input_data has too few batches)
+    """
+    if verbose:
+        print("\n**** probe_input_time() ****")
+
+    if isinstance(input_data, tf.data.Dataset):
+        batch_iter = iter(input_data.take(n_batches + 1))
+    elif isinstance(input_data, tf.keras.utils.Sequence):
+        batch_iter = (input_data[i] for i in range(min(n_batches + 1, len(input_data))))
+    else:
+        batch_iter = iter(input_data)
+
+    times = []
+    try:
+        next(batch_iter)
+        for batch in range(n_batches):
+            t_start = time.perf_counter()
+            next(batch_iter)
+            times.append(time.perf_counter() - t_start)
+    except StopIteration:
+        pass
+
+    if not times:
+        return np.nan
+
+    sec_per_batch = float(np.mean(times))
+
+    if verbose:
+        print(f"input: {sec_per_batch:.6f} sec per batch ({len(times)} batches)")
+
+    return sec_per_batch
+
+
+class TrainingStatsCallback(Callback):
+    """
+    Records per-epoch wall time, steps/sec, items/sec, input cost vs compute time and peak RSS.
+    Per-epoch stats are in self.epoch_stats (list of dicts), get_summary() gives a dict
+    for the training_info csv / sim_dict.
+
+    :param batch_size: items per step
+    :param input_data: training data to probe (see probe_input_time), or None to skip input timing
+    :param n_probe_batches: batches to time in the probe
+    """
+    def __init__(self, batch_size, input_data=None, n_probe_batches=20):
+        super(TrainingStatsCallback, self).__init__()
+        self.batch_size = batch_size
+        self.input_data = input_data
+        self.n_probe_batches = n_probe_batches
+        self.input_sec_per_step = np.nan
+        self.epoch_stats = []
+        self.train_time = None
+
+    def on_train_begin(self, logs=None):
+        self.epoch_stats = []
+        self.train_time = None
+        if self.input_data is not None:
+            self.input_sec_per_step = probe_input_time(self.input_data, n_batches=self.n_probe_batches)
+        self.train_start = time.perf_counter()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.perf_counter()
+        self.step_time = 0.0
+        self.n_steps = 0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step_time += time.perf_counter() - self.batch_start
+        self.n_steps += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_time = time.perf_counter() - self.epoch_start
+
+        input_cost = np.nan
+        compute_time = self.step_time
+        if not np.isnan(self.input_sec_per_step):
+            input_cost = min(self.input_sec_per_step * self.n_steps, self.step_time)
+            compute_time = self.step_time - input_cost
+
+        steps_per_sec = self.n_steps / self.step_time if self.step_time > 0 else np.nan
+
+        self.epoch_stats.append({'epoch': epoch,
+                                 'epoch_time': epoch_time,
+                                 'step_time': self.step_time,
+                                 'steps': self.n_steps,
+                                 'steps_per_sec': steps_per_sec,
+                                 'items_per_sec': steps_per_sec * self.batch_size,
+                                 'input_cost': input_cost,
+                                 'compute_time': compute_time,
+                                 'peak_rss_mb': peak_rss_mb(),
+                                 })
+
+    def on_train_end(self, logs=None):
+        self.train_time = time.perf_counter() - self.train_start
+
+    def get_summary(self):
+        """
+        Summary of training cost (means over epochs, peak RSS at the end).
+        Always has the same keys: if no epochs ran, the times and rates are None,
+        and train_time is None if training didn't finish.
+
+        :return: dict of floats (or None)
+        """
+        train_time = None if self.train_time is None else float(self.train_time)
+
+        if not self.epoch_stats:
+            return {'train_time': train_time,
+                    'epoch_time': None,
+                    'steps_per_sec': None,
+                    'items_per_sec': None,
+                    'input_cost_frac': None,
+                    'peak_rss_mb': float(peak_rss_mb()),
+                    }
+
+        step_time = sum(e['step_time'] for e in self.epoch_stats)
+        input_cost = np.nan
+        if not np.isnan(self.input_sec_per_step):
+            input_cost = sum(e['input_cost'] for e in self.epoch_stats)
+
+        return {'train_time': train_time,
+                'epoch_time': float(np.mean([e['epoch_time'] for e in self.epoch_stats])),
+                'steps_per_sec': float(np.mean([e['steps_per_sec'] for e in self.epoch_stats])),
+                'items_per_sec': float(np.mean([e['items_per_sec'] for e in self.epoch_stats])),
+                'input_cost_frac': float(input_cost / step_time) if step_time > 0 else np.nan,
+                'peak_rss_mb': float(self.epoch_stats[-1]['peak_rss_mb']),
+                }
+
+
+class StackedBestWeights(Callback):
+    """
+    For stacked models (models/mlps.stacked_mlp), keep each model's weights from its own best epoch
+    (lowest monitor_m{member}, e.g., 'loss_m0' or 'val_loss_m0').
+    self.member_weights is a list (per model) of {layer_name: [weight arrays]} for split_stacked_mlp(),
+    self.best_epochs is the best epoch for each model.
+
+    :param n_models: number of stacked models
+    :param monitor: 'loss' or 'val_loss'
+    """
+    def __init__(self, n_models, monitor='loss'):
+        super(StackedBestWeights, self).__init__()
+        self.n_models = n_models
+        self.monitor = monitor
+        self.best = [np.inf] * n_models
+        self.best_epochs = [0] * n_models
+        self.member_weights = [dict() for member in range(n_models)]
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        layer_weights = None
+        for member in range(self.n_models):
+            current = logs.get(f'{self.monitor}_m{member}')
+            if current is None or current >= self.best[member]:
+                continue
+
+            if layer_weights is None:
+                layer_weights = {layer.name: layer.get_weights() for layer in self.model.layers
+                                 if layer.weights}
+
+            self.best[member] = current
+            self.best_epochs[member] = epoch
+            self.member_weights[member] = {name: [w[member].copy() for w in weights]
+                                           for name, weights in layer_weights.items()}
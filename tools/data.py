@@ -1,5 +1,7 @@
 import csv
+import json
 import os.path
+import shutil
 import sys
 import numpy as np
 import pandas as pd
@@ -80,21 +82,224 @@ def nick_read_csv(path):
     # return pd.read_csv(path, dtype=dtypes, parse_dates=parse_dates, skiprows=[1])
 
 
-def load_x_data(x_filename):
-    """will open the xdata from npy or csv format and return a numpy.ndarray"""
+def get_table_path(path):
+    """path for a binary table (directory), e.g., item_correct.csv -> item_correct.tbl"""
+    root, ext = os.path.splitext(path)
+    if ext == '.tbl':
+        return path
+    return f"{root}.tbl"
+
+
+def nick_to_table(df, path):
+    """
+    Typed binary version of nick_to_csv.
+    Saves each column as an npy file (in a .tbl directory, see get_table_path), with a json header
+    of column names and dtypes.  Dtypes are kept natively (no dtype row), and numeric columns are
+    written straight from the dataframe (no copy of the whole df).
+    The table is written to a temp dir then renamed, so readers never see a half-written table.
+    Like nick_to_csv, the index is not saved.
+
+    :param df: dataframe
+    :param path: save path (e.g., 'item_correct.tbl', a '.csv' path is saved as 'item_correct.tbl')
+    :return: table path
+    """
+    table_path = get_table_path(path)
+    tmp_path = "{}.{}.tmp".format(table_path, os.getpid())
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    table_info = {'n_rows': len(df), 'columns': [], 'files': [], 'dtypes': [], 'kinds': []}
+    for index, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+        kind = 'array'
+        if values.dtype == object:
+            if pd.api.types.infer_dtype(values, skipna=False) == 'string':
+                values = values.astype(str)
+                kind = 'str'
+            else:
+                kind = 'object'
+
+        column_file = f"col_{index}.npy"
+        np.save(os.path.join(tmp_path, column_file), values, allow_pickle=(kind == 'object'))
+
+        # # json keeps int column names (e.g., units) as ints
+        table_info['columns'].append(int(column) if isinstance(column, (int, np.integer)) else str(column))
+        table_info['files'].append(column_file)
+        table_info['dtypes'].append(str(df[column].dtype))
+        table_info['kinds'].append(kind)
+
+    with open(os.path.join(tmp_path, 'table_info.json'), 'w') as fp:
+        json.dump(table_info, fp)
+
+    # # a directory can't be replaced by another one, so move an older table aside first
+    if os.path.isdir(table_path):
+        old_path = "{}.{}.old".format(table_path, os.getpid())
+        os.replace(table_path, old_path)
+        os.replace(tmp_path, table_path)
+        shutil.rmtree(old_path)
+    else:
+        os.replace(tmp_path, table_path)
+
+    return table_path
+
+
+def nick_read_table(path, columns=None, index_col=0, mmap_mode='r', as_arrays=False):
+    """
+    Read a table saved by nick_to_table, or a legacy csv (with nick_read_csv).
+    Numeric columns are memory-mapped (np.load(mmap_mode=mmap_mode)), so only the pages that are
+    used get read.  String and object columns can't be mapped, so they are loaded.
+    The dataframe is made with copy=False, so numeric columns are not consolidated into one block
+    and keep their memmaps (pandas >= 1.3, older pandas copies them; use as_arrays there).
+
+    :param path: path used to save (e.g., item_correct.tbl), or an old .csv path.
+        If there is no .tbl, the csv is loaded.
+    :param columns: list of columns to load (default all).  Other columns are not read.
+    :param index_col: use this column as the index (as nick_read_csv does), or None
+    :param mmap_mode: for numeric columns, e.g., 'r'.  None loads them into memory.
+    :param as_arrays: if True, return a dict {column: array} (memmaps for numeric columns)
+        of the requested columns, rather than a dataframe (index_col is not used).
+
+    :return: dataframe (or dict of arrays)
+    """
+    table_path = get_table_path(path)
+    table_info_path = os.path.join(table_path, 'table_info.json')
+    if not os.path.isfile(table_info_path):
+        csv_path = path
+        if os.path.splitext(path)[1] == '.tbl':
+            csv_path = "{}.csv".format(os.path.splitext(path)[0])
+        open_csv = nick_read_csv(csv_path)
+        if columns is not None:
+            open_csv = open_csv[[c for c in columns if c in list(open_csv)]]
+        if as_arrays:
+            return {column: open_csv[column].to_numpy() for column in open_csv.columns}
+        return open_csv
+
+    with open(table_info_path, 'r') as fp:
+        table_info = json.load(fp)
+
+    all_columns = table_info['columns']
+    use_columns = list(all_columns) if columns is None else list(columns)
+    if not as_arrays and index_col is not None and all_columns[index_col] not in use_columns:
+        use_columns = [all_columns[index_col]] + use_columns
+
+    table_data = dict()
+    for column in use_columns:
+        position = all_columns.index(column)
+        kind = table_info['kinds'][position]
+        column_path = os.path.join(table_path, table_info['files'][position])
+        if kind == 'array':
+            values = np.load(column_path, mmap_mode=mmap_mode)
+        else:
+            values = np.load(column_path, allow_pickle=(kind == 'object')).astype(object)
+        table_data[column] = values
+
+    if as_arrays:
+        return table_data
+
+    table_df = pd.DataFrame(table_data, columns=use_columns, copy=False)
+
+    if index_col is not None:
+        table_df = table_df.set_index(all_columns[index_col])
+
+    return table_df
+
+
+def get_npy_cache_path(csv_path, dtype='float32'):
+    """path for the cached npy version of a csv dataset, e.g., X_data.csv -> X_data_float32.npy"""
+    return "{}_{}.npy".format(os.path.splitext(csv_path)[0], np.dtype(dtype).name)
+
+
+def cache_csv_as_npy(csv_path, dtype='float32', verbose=True):
+    """
+    Convert a csv dataset to npy once, so it can be memory-mapped (rather than parsed) next time.
+    The cache is re-made if the csv is newer than it.
+    The file is written to a temp name then renamed, so parallel jobs never read a half-written cache.
+
+    :param csv_path: path to csv (no header)
+    :param dtype: dtype to save as
+    :param verbose: how much to print to screen
+
+    :return: path to npy cache
+    """
+    npy_path = get_npy_cache_path(csv_path, dtype)
+
+    if os.path.isfile(npy_path) and os.path.getmtime(npy_path) >= os.path.getmtime(csv_path):
+        return npy_path
+
+    if verbose:
+        print("caching csv as {} npy: {}".format(np.dtype(dtype).name, npy_path))
+
+    dataset = pd.read_csv(csv_path, header=None, dtype=dtype).to_numpy()
+    if dataset.shape[1] == 1:
+        # # same shape as np.loadtxt for a single column
+        dataset = dataset.ravel()
+
+    tmp_path = "{}.{}.tmp".format(npy_path, os.getpid())
+    with open(tmp_path, 'wb') as npy_file:
+        np.save(npy_file, dataset)
+    os.replace(tmp_path, npy_path)
+
+    return npy_path
+
+
+def load_npy(npy_path, mmap_mode='r'):
+    """np.load, memory-mapped if possible (object arrays can't be)"""
+    if mmap_mode is not None:
+        try:
+            return np.load(npy_path, mmap_mode=mmap_mode)
+        except ValueError:
+            pass
+    return np.load(npy_path, allow_pickle=True)
+
+
+def load_x_data(x_filename, mmap_mode='r', csv_dtype='float32'):
+    """
+    will open the xdata from npy or csv format and return a numpy.ndarray
+
+    csv files are converted once to a cached npy (see cache_csv_as_npy).
+    npy files are memory-mapped (read only) by default, so training, GHA and lesion
+    (and parallel jobs) share one page-cached copy rather than each loading the whole thing.
+    Use x_data_batches() to convert dtype/scale a batch at a time.
+
+    :param x_filename: path to csv or npy
+    :param mmap_mode: 'r' (default) or None to load into memory
+    :param csv_dtype: dtype for csv cache
+
+    :return: x_data (np.memmap if mmap_mode)
+    """
     print("\n**** load_x_data() ****")
 
     if x_filename[-3:] == 'csv':
-        x_data = np.loadtxt(x_filename, delimiter=",")
+        x_data = load_npy(cache_csv_as_npy(x_filename, dtype=csv_dtype), mmap_mode=mmap_mode)
         print("loaded X as csv: {} {}".format(x_filename, np.shape(x_data)))
     elif x_filename[-3:] == 'npy':
-        x_data = np.load(x_filename)
+        x_data = load_npy(x_filename, mmap_mode=mmap_mode)
         print("loaded X as npy: {} {}".format(x_filename, np.shape(x_data)))
     else:
         print("unknown X_data file type: {}".format(x_filename[-3:]))
     return x_data
 
 
+def x_data_batches(x_data, batch_size=32, dtype='float32', scale=None):
+    """
+    Generator of x_data batches, converted to dtype (and divided by scale) one batch at a time,
+    e.g., for model.predict(x_data_batches(x_data, batch_size), steps=n_batches).
+    The last batch may be smaller.
+
+    :param x_data: array (e.g., memory-mapped from load_x_data)
+    :param batch_size: items per batch
+    :param dtype: dtype for model
+    :param scale: if not None, batches are divided by this (e.g., max value for uint8 images)
+
+    :return: generator of arrays
+    """
+    for start in range(0, len(x_data), batch_size):
+        x_batch = np.asarray(x_data[start:start + batch_size], dtype=dtype)
+        if scale is not None:
+            x_batch = x_batch / np.asarray(scale, dtype=dtype)
+        yield x_batch
+
 
 def load_y_data(y_label_path):
     """will open the y_data from npy or csv format and return:
@@ -237,28 +442,29 @@ def load_y_data(y_label_path):
 #     return dataset
 
 
-def load_data_no_dict(dataset_name):
+def load_data_no_dict(dataset_name, mmap_mode='r', csv_dtype='float32'):
     """
     load x or y data from filename (data has no dict).
-    If y returns a dict with {"y_df": y_df, 'y_label_list': y_label_list}
+    csv files are cached as npy and npy files are memory-mapped (see load_x_data).
     :param dataset_name: str(name)
-    :param x_y: str specific X/x or Y/y
-    :param test_train_val: str 'train_set', 'test_set' or 'val_set'
+    :param mmap_mode: 'r' (default) or None to load into memory
+    :param csv_dtype: dtype for csv cache
     :return: dataset
     """
 
     if dataset_name[-3:] == 'csv':
-        dataset = np.loadtxt(dataset_name, delimiter=",")
+        dataset = load_npy(cache_csv_as_npy(dataset_name, dtype=csv_dtype), mmap_mode=mmap_mode)
         print("loaded dataset as csv: {} {}".format(dataset_name, np.shape(dataset)))
     elif os.path.isfile("{}.csv".format(dataset_name)):
-        dataset = np.loadtxt("{}.csv".format(dataset_name), delimiter=",")
+        dataset = load_npy(cache_csv_as_npy("{}.csv".format(dataset_name), dtype=csv_dtype),
+                           mmap_mode=mmap_mode)
         print("loaded dataset as csv: {} {}".format(dataset_name, np.shape(dataset)))
 
     elif dataset_name[-3:] == 'npy':
-        dataset = np.load(dataset_name)
+        dataset = load_npy(dataset_name, mmap_mode=mmap_mode)
         print("loaded dataset as npy: {} {}".format(dataset_name, np.shape(dataset)))
     elif os.path.isfile("{}.npy".format(dataset_name)):
-        dataset = np.load("{}.npy".format(dataset_name))
+        dataset = load_npy("{}.npy".format(dataset_name), mmap_mode=mmap_mode)
         print("loaded dataset as npy: {} {}".format(dataset_name, np.shape(dataset)))
     else:
         print("unknown dataset file type: {}".format(dataset_name[-3:]))
@@ -1,4 +1,8 @@
 import datetime
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import h5py
 import pandas as pd
 import numpy as np
@@ -8,7 +12,7 @@ import matplotlib.pyplot as plt
 from tensorflow.keras.models import Model
 from tensorflow.keras.applications.vgg16 import preprocess_input
 
-from tools.dicts import focussed_dict_print
+from tools.network import get_top_k, sparse_confusion, sparse_conf_to_dense
 
 tools_date = int(datetime.datetime.now().strftime("%y%m%d"))
 tools_time = int(datetime.datetime.now().strftime("%H%M"))
@@ -38,6 +42,108 @@ def hdf_df_string_clean(df):
     return df
 
 
+def hdf_batch_reader(data_hdf_path, total_items=None, batch_size=50,
+                     x_path='x_data', y_paths=(), use_vgg_colours=True,
+                     n_workers=2, prefetch=4, verbose=False):
+    """
+    Batches from an hdf5 file, read and preprocessed in the background.
+
+    The file is opened once (in a reader thread) and x data is read in contiguous slabs
+    of whole hdf5 chunks, so each chunk is only read (and decompressed) once.
+    Slabs are split into batches and preprocessed (preprocess_input) in a thread pool.
+    Up to prefetch batches are queued, so the next batch is usually ready when predict() returns.
+    The last batch has the remaining items (total_items doesn't need to be a multiple of batch_size).
+
+    :param data_hdf_path: path to hdf5 file
+    :param total_items: number of items to use (default: all items in x_path)
+    :param batch_size: items per batch
+    :param x_path: on hdf5 file
+    :param y_paths: other datasets to slice for each batch (e.g., 'y_labels' or 'y_df/table').
+                    These are not preprocessed.
+    :param use_vgg_colours: preprocess RBG to BRG
+    :param n_workers: number of preprocessing threads
+    :param prefetch: max number of batches waiting in the queue
+    :param verbose: If True, print details to screen
+
+    :Yield: idx_from, idx_to, x_data, list of y_data (one per y_path)
+    """
+    batch_queue = queue.Queue(maxsize=prefetch)
+    stop_reading = threading.Event()
+    end_of_data = object()
+
+    def put(item):
+        # # don't block forever if the consumer has stopped early
+        while not stop_reading.is_set():
+            try:
+                batch_queue.put(item, timeout=.1)
+                return
+            except queue.Full:
+                continue
+
+    def preprocess(x_data):
+        if use_vgg_colours:
+            return preprocess_input(x_data)
+        return x_data
+
+    def read_batches(pool):
+        try:
+            with h5py.File(data_hdf_path, 'r') as dataset:
+                x_dset = dataset[x_path]
+                n_items = len(x_dset)
+                if total_items is not None:
+                    n_items = min(total_items, n_items)
+
+                # # read whole chunks, at least one batch at a time
+                chunk_items = x_dset.chunks[0] if x_dset.chunks else batch_size
+                slab_items = int(np.ceil(batch_size / chunk_items)) * chunk_items
+
+                # # items read but not batched yet
+                x_read = np.empty((0, ) + x_dset.shape[1:], dtype=x_dset.dtype)
+                read_to = 0
+
+                for idx_from in range(0, n_items, batch_size):
+                    if stop_reading.is_set():
+                        break
+                    idx_to = min(idx_from + batch_size, n_items)
+
+                    while read_to < idx_to:
+                        slab_to = min(read_to + slab_items, n_items)
+                        slab = x_dset[read_to:slab_to, ...]
+                        x_read = slab if not len(x_read) else np.concatenate([x_read, slab])
+                        read_to = slab_to
+
+                    x_data = x_read[:idx_to - idx_from]
+                    x_read = x_read[idx_to - idx_from:]
+
+                    y_data = [dataset[y_path][idx_from:idx_to, ...] for y_path in y_paths]
+
+                    put((idx_from, idx_to, pool.submit(preprocess, x_data), y_data))
+        except Exception as e:
+            put(e)
+        finally:
+            put(end_of_data)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        reader = threading.Thread(target=read_batches, args=(pool, ), daemon=True)
+        reader.start()
+        try:
+            while True:
+                batch = batch_queue.get()
+                if batch is end_of_data:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+
+                idx_from, idx_to, x_future, y_data = batch
+                if verbose:
+                    print(f"batch from {idx_from} to: {idx_to}")
+
+                yield idx_from, idx_to, x_future.result(), y_data
+        finally:
+            stop_reading.set()
+            reader.join()
+
+
 def h5py_data_batches(data_hdf_path='/home/nm13850/Documents/PhD/python_v2/datasets/'
                                     'objects/ILSVRC2012/imagenet_hdf5/imageNet2012Val.h5',
                       total_items=50000,
@@ -52,6 +158,8 @@ def h5py_data_batches(data_hdf_path='/home/nm13850/Documents/PhD/python_v2/datas
 
     """
     Script to load bacthes of data from hdf5 file.  Either just x_data, or x and y_data.
+    Uses hdf_batch_reader (file kept open, background reading and preprocessing).
+    The last batch has the remaining items.
     :param data_hdf_path: path to hdf5 file
     :param total_items: all items in dataset
     :param batch_size:
@@ -68,56 +176,52 @@ def h5py_data_batches(data_hdf_path='/home/nm13850/Documents/PhD/python_v2/datas
     """
 
 
-    batchsize = batch_size
-    batches_in_data = total_items//batchsize
-
-    for i in range(batches_in_data):
-
-        with h5py.File(data_hdf_path, 'r') as dataset:
-
-            # whole dataset would be i in range 1000 with batchsize 50
-            # (50 images should fit in the memory easily)
-            idx_from = i * batchsize
-            idx_to = (i + 1) * batchsize
-            print(f"\n{i}: from {idx_from} to: {idx_to}")
-
-            x_data = dataset[x_path][idx_from:idx_to, ...]
-            if use_vgg_colours:
-                x_data = preprocess_input(x_data)
+    y_paths = []
+    if use_y_data == 'y_labels':
+        y_paths = [y_label_path]
+    elif use_y_data == 'y_df':
+        y_paths = [f'{y_df_path}/table']
 
+    for i, (idx_from, idx_to, x_data, y_data) in enumerate(hdf_batch_reader(data_hdf_path,
+                                                                            total_items=total_items,
+                                                                            batch_size=batch_size,
+                                                                            x_path=x_path,
+                                                                            y_paths=y_paths,
+                                                                            use_vgg_colours=use_vgg_colours)):
+        print(f"\n{i}: from {idx_from} to: {idx_to}")
 
-            if use_y_data == 'y_labels':
-                y_labels = dataset[y_label_path][idx_from:idx_to, ...]
+        if use_y_data == 'y_labels':
+            y_labels = y_data[0]
 
-                if verbose:
-                    print(f"x_data: {x_data.shape}")
-                    print(f"y_labels: {y_labels.shape}\n{y_labels}")
+            if verbose:
+                print(f"x_data: {x_data.shape}")
+                print(f"y_labels: {y_labels.shape}\n{y_labels}")
 
-                yield x_data, y_labels
+            yield x_data, y_labels
 
 
-            elif use_y_data == 'y_df':
-                y_df_tuples = dataset[y_df_path]['table'][idx_from:idx_to, ...]
+        elif use_y_data == 'y_df':
+            y_df_tuples = y_data[0]
 
-                # convert list fo tuples to list of lists
-                y_df_lists = [list(elem) for elem in y_df_tuples]
+            # convert list fo tuples to list of lists
+            y_df_lists = [list(elem) for elem in y_df_tuples]
 
-                y_df = pd.DataFrame(y_df_lists, columns=['item', 'cat', 'filename', 'class_name'])
-                y_df = y_df.set_index('item')
+            y_df = pd.DataFrame(y_df_lists, columns=['item', 'cat', 'filename', 'class_name'])
+            y_df = y_df.set_index('item')
 
-                if verbose:
-                    print(f"x_data: {x_data.shape}")
-                    print(f"y_df: {y_df.shape}")
-                    print(f"y_df: {y_df}")
+            if verbose:
+                print(f"x_data: {x_data.shape}")
+                print(f"y_df: {y_df.shape}")
+                print(f"y_df: {y_df}")
 
 
-                yield x_data, y_df
+            yield x_data, y_df
 
-            else:
-                if verbose:
-                    print(f"x_data: {x_data.shape}")
+        else:
+            if verbose:
+                print(f"x_data: {x_data.shape}")
 
-                yield x_data
+            yield x_data
 
 
 
@@ -132,17 +236,25 @@ def hdf_pred_scores(model,
                     y_df_path='y_df',
                     use_vgg_colours=True,
                     df_name='item_correct_df',
+                    save_pred_vals=True,
+                    top_k=5,
                     test_run=False,
                     verbose=False,
                     ):
     """
     Script to get predictions from slices of X data on a model.
-    For each slice, then also get the item correct on this slice.
-
-    save pred_out, item correct etc into new hdf file as I go.
-
-    keep a counter of n_items and n_correct to give accuracy
-    or just get acc on the whole thing on the end.
+    Each slice is scored as it goes.
+
+    Item results are written to preallocated datasets in {output_filename}_scores.h5
+    (in group df_name), which is kept open for the whole run:
+        true_cat, pred_cat, full_model (1 if correct),
+        top_k (top_k classes, highest first), full_model_top_k (1 if true class in top_k),
+        pred_vals (if save_pred_vals) and, at the end, the confusion matrix as sparse triplets
+        (conf_true, conf_pred, conf_count) and dense conf_matrix (true x pred) if n_cats <= 100.
+    Items per cat and correct per cat (top-1 and top-k) are accumulated with np.bincount,
+    the confusion matrix as sparse triplets per batch (see tools.network.sparse_confusion),
+    so scores_dict comes from the accumulators (not from re-reading the item table).
+    item_correct_df is saved once (not per slice) to the pandas store {output_filename}_gha.h5 for hdf_gha.
 
     :param model:
     :param output_filename:
@@ -151,189 +263,192 @@ def hdf_pred_scores(model,
     :param batch_size:
     :param x_path: on hdf5 file
     :param y_df_path: on hdf5 file (note if made with Pandas, it might also need ['table']
-    :param test_run: If True, don't run whole dataset, just first 64 items
     :param use_vgg_colours: preprocess RBG to BRG
-
+    :param df_name: name for this set of scores (e.g., 'full_model' or layer_and_unit for lesioning)
+    :param save_pred_vals: if True, save predictions (n_items, n_cats) too
+    :param top_k: number of top classes to score (e.g., 5 for ImageNet top-5)
+    :param test_run: If True, don't run whole dataset, just first 64 items
     :param verbose: If True, print details to screen
 
-    :return:
+    :return: item_correct_df, scores_dict, incorrect_items (indices of incorrect items)
     """
 
     if test_run:
         total_items = 64
 
-    batchsize = batch_size
-    batches_in_data = total_items//batchsize
-
-    # # list of all incorrect items added to slice-by-slice
-    incorrect_items = []
-
-    for i in range(batches_in_data):
-        # # step through the data in slices/batches
-
-        with h5py.File(data_hdf_path, 'r') as dataset:
-            # # open the hdf with the x and y data
-
-            # # get indices to slice to/from
-            idx_from = i * batchsize
-            idx_to = (i + 1) * batchsize
+    with h5py.File(data_hdf_path, 'r') as dataset:
+        n_items = min(total_items, len(dataset[x_path]))
+    n_cats = model.output_shape[-1]
+    top_k = min(top_k, n_cats)
+    cat_dtype = np.int16 if n_cats < np.iinfo(np.int16).max else np.int32
+
+    # # accumulators
+    items_per_cat = np.zeros(n_cats, dtype=int)
+    corr_per_cat = np.zeros(n_cats, dtype=int)
+    corr_per_cat_top_k = np.zeros(n_cats, dtype=int)
+    batch_confs = []
+
+    # # y_df columns (item, cat, filename, class_name) for item_correct_df
+    y_columns = []
+
+    scores_hdf_name = f"{output_filename}_scores.h5"
+    with h5py.File(scores_hdf_name, 'a') as scores_store:
+        if df_name in scores_store:
+            del scores_store[df_name]
+        scores_group = scores_store.create_group(df_name)
+
+        true_cat_store = scores_group.create_dataset('true_cat', shape=(n_items, ), dtype=cat_dtype)
+        pred_cat_store = scores_group.create_dataset('pred_cat', shape=(n_items, ), dtype=cat_dtype)
+        correct_store = scores_group.create_dataset('full_model', shape=(n_items, ), dtype=np.uint8)
+        top_k_store = scores_group.create_dataset('top_k', shape=(n_items, top_k), dtype=cat_dtype)
+        top_k_correct_store = scores_group.create_dataset('full_model_top_k', shape=(n_items, ),
+                                                          dtype=np.uint8)
+        scores_group.attrs['top_k'] = top_k
+        if save_pred_vals:
+            pred_vals_store = scores_group.create_dataset('pred_vals', shape=(n_items, n_cats),
+                                                          dtype=np.float32)
+
+        # # step through the data in slices/batches (x_data is preprocessed in the background)
+        for i, (idx_from, idx_to, x_data, y_data) in enumerate(hdf_batch_reader(data_hdf_path,
+                                                                                total_items=n_items,
+                                                                                batch_size=batch_size,
+                                                                                x_path=x_path,
+                                                                                y_paths=[f'{y_df_path}/table'],
+                                                                                use_vgg_colours=use_vgg_colours)):
             print(f"\n{i}: from {idx_from} to: {idx_to}")
 
-            # # slice x_data
-            x_data = dataset[x_path][idx_from:idx_to, ...]
-
-            # # preprocess colours from RGB to BGR
-            if use_vgg_colours:
-                x_data = preprocess_input(x_data)
-
-            # # slice y data
-            y_df_tuples = dataset[y_df_path]['table'][idx_from:idx_to, ...]
-            # convert list fo tuples to list of lists
-            y_df_lists = [list(elem) for elem in y_df_tuples]
-
-            y_df = pd.DataFrame(y_df_lists, columns=['item', 'cat', 'filename', 'class_name'])
-            y_df = y_df.set_index('item')
-
-            if verbose:
-                print(f"x_data: {x_data.shape}")
-                print(f"y_df: {y_df.shape}")
-                print(f"y_df: {y_df}")
-
-            # yield x_data, y_df
-
-            # # get the true cat labels for this slice
-            true_cat = [int(i) for i in y_df['cat'].to_numpy()]
+            # # y table fields are item, cat, filename, class_name
+            y_table = y_data[0]
+            y_columns.append([y_table[field] for field in y_table.dtype.names[:4]])
+            true_cat = y_table[y_table.dtype.names[1]].astype(int)
 
             # # get predictions (per cat) and then pred_labels
             pred_vals = model.predict(x_data)
             pred_cat = np.argmax(pred_vals, axis=1)
+            correct = pred_cat == true_cat
 
-            # # # get item correct and scores (per cat and total)
-            n_items, n_cats = np.shape(pred_vals)
-
-            slice_incorrect_items = [x for x, y in zip(pred_cat, true_cat) if x != y]
-            incorrect_items.extend(slice_incorrect_items)
-            item_score = [1 if x == y else 0 for x, y in zip(pred_cat, true_cat)]
-
-
-            # # append item correct to new hdf file
-            item_correct_df = y_df  # .copy()
-
-            # # convert troublesome columns to string
-            item_correct_df["filename"] = item_correct_df["filename"].map(str)
-            item_correct_df["class_name"] = item_correct_df["class_name"].map(str)
-
-            # # add item_correct column ['full)_model] to item_correct df
-            item_correct_df.insert(2, column="full_model", value=item_score)
+            # # top k classes (highest first) and whether true class is in them
+            top_k_cats, in_top_k = get_top_k(pred_vals, true_cat, top_k=top_k)
 
+            true_cat_store[idx_from:idx_to] = true_cat
+            pred_cat_store[idx_from:idx_to] = pred_cat
+            correct_store[idx_from:idx_to] = correct
+            top_k_store[idx_from:idx_to] = top_k_cats
+            top_k_correct_store[idx_from:idx_to] = in_top_k
+            if save_pred_vals:
+                pred_vals_store[idx_from:idx_to] = pred_vals
 
+            items_per_cat += np.bincount(true_cat, minlength=n_cats)
+            corr_per_cat += np.bincount(true_cat[correct], minlength=n_cats)
+            corr_per_cat_top_k += np.bincount(true_cat[in_top_k == 1], minlength=n_cats)
+            batch_confs.append(sparse_confusion(true_cat, pred_cat, n_cats))
 
             if verbose:
-                print("item_correct_df.shape: {}".format(item_correct_df.shape))
-                print("len(item_score): {}".format(len(item_score)))
-                print(item_correct_df.dtypes)
-                # print(item_correct_df.head())
-
-            # # make output hdf to store item_correct df
-            with pd.HDFStore(f"{output_filename}_gha.h5") as store:
-
-                line_len_dict = {
-                                 # 'item': 0,
-                                 'cat': 0, 'full_model': 0,
-                                 'filename': 35, 'class_name': 35}
-
-                print(store.keys())
-                if f"/{df_name}" not in store.keys():
-                    print(f"creating blank df in {df_name} on store")
-
-                    store.put(f'{df_name}',
-                              pd.DataFrame(data=None,
-                                           columns=['item', 'cat', 'full_model', 'filename', 'class_name']),
-                              format='t', append=True, min_itemsize=line_len_dict)
-
-
-                # # I'm having problems with line length
-                # # trying to work out why
-                line_len_check_dict = {}
-                for c in item_correct_df:
-                    if item_correct_df[c].dtype == 'object':
-                        max_len = item_correct_df[c].map(len).max()
-                        print(f'Max length of column {c}: {max_len}')
-                        line_len_check_dict[c] = max_len
-                    else:
-                        max_len = 0
-                        print(f'Not a string column {c}: {max_len}')
-                        line_len_check_dict[c] = max_len
-
-                line_lengths = list(line_len_check_dict.values())
-                max_line = max(line_lengths)
-
-                if max_line > 30:
-                    focussed_dict_print(line_len_check_dict, 'line_len_check_dict')
+                print(f"x_data: {x_data.shape}\n"
+                      f"correct: {np.sum(correct)} / {len(correct)}")
+
+        # # merge batch confusion triplets
+        sparse_conf = sparse_confusion(np.concatenate([conf['true'] for conf in batch_confs]),
+                                       np.concatenate([conf['pred'] for conf in batch_confs]),
+                                       n_cats,
+                                       counts=np.concatenate([conf['count'] for conf in batch_confs]))
+        scores_group.create_dataset('conf_true', data=sparse_conf['true'].astype(cat_dtype))
+        scores_group.create_dataset('conf_pred', data=sparse_conf['pred'].astype(cat_dtype))
+        scores_group.create_dataset('conf_count', data=sparse_conf['count'])
+        if n_cats <= 100:
+            scores_group.create_dataset('conf_matrix', data=sparse_conf_to_dense(sparse_conf))
+
+        full_model = correct_store[:].astype(int)
 
+    print("\nfinished looping through dataset")
 
-                store.append(f'/{df_name}', item_correct_df, min_itemsize=line_len_dict)
+    # # make item_correct_df from y columns
+    item, cat, filename, class_name = [np.concatenate(column) for column in zip(*y_columns)]
+    if filename.dtype.kind == 'S':
+        filename = np.char.decode(filename, 'utf-8')
+    if class_name.dtype.kind == 'S':
+        class_name = np.char.decode(class_name, 'utf-8')
 
-                if verbose:
-                    print(f"store['item_correct_df'].shape: {store[f'/{df_name}'].shape}")
+    item_correct_df = pd.DataFrame({'item': item, 'cat': cat.astype(int),
+                                    'filename': filename, 'class_name': class_name,
+                                    'full_model': full_model}).set_index('item')
 
+    incorrect_items = np.flatnonzero(full_model == 0).tolist()
 
-    print("\nfinished looping through dataset")
-    incorrect_items_s = pd.Series(incorrect_items)
+    if verbose:
+        print("item_correct_df.shape: {}".format(item_correct_df.shape))
+        print(item_correct_df.dtypes)
 
-    # add incorrect items to output hdf
+    # add item_correct_df and incorrect items to output hdf
     incorrect_items_name = 'incorrect_items'
     if df_name != 'item_correct_df':
         incorrect_items_name = f'incorrect_{df_name}'
 
-    with pd.HDFStore(f"{output_filename}_gha.h5") as store:
+    line_len_dict = {'filename': max(35, int(np.char.str_len(filename.astype(str)).max())),
+                     'class_name': max(35, int(np.char.str_len(class_name.astype(str)).max()))}
 
-        store.put(incorrect_items_name, incorrect_items_s)
+    with pd.HDFStore(f"{output_filename}_gha.h5") as store:
+        store.put(df_name, item_correct_df, format='t', min_itemsize=line_len_dict)
+        store.put(incorrect_items_name, pd.Series(incorrect_items, dtype=int))
 
         print(f"store.keys(): {store.keys()}")
 
-        # if df_name in store.keys():
-        #     pass
-        # elif f"/{df_name}" in store.keys():
-        #     df_name = f'/{df_name}'
-
-        item_correct_df = store[f'/{df_name}']
-
     print(f"item_correct_df.shape: {item_correct_df.shape}")
-    # print(item_correct_df.head())
 
-    full_model = [int(i) for i in item_correct_df['full_model'].to_numpy()]
-    fm_correct = np.sum(full_model)
-    fm_items = len(full_model)
+    fm_items = n_items
+    fm_correct = int(np.sum(corr_per_cat))
 
     gha_acc = np.around(fm_correct / fm_items, decimals=3)
 
-    print("\nitems: {}\ncorrect: {}\nincorrect: {}\naccuracy: {}".
-          format(fm_items, fm_correct, fm_items - fm_correct, gha_acc))
+    n_correct_top_k = int(np.sum(corr_per_cat_top_k))
+    top_k_acc = np.around(n_correct_top_k / fm_items, decimals=3)
+
+    print("\nitems: {}\ncorrect: {}\nincorrect: {}\naccuracy: {}\ntop_{} accuracy: {}".
+          format(fm_items, fm_correct, fm_items - fm_correct, gha_acc, top_k, top_k_acc))
 
     # # get count_correct_per_class
-    corr_per_cat_dict = dict()
-    for cat in range(n_cats):
-        corr_per_cat_dict[cat] = len(item_correct_df[(item_correct_df['cat'] == cat) &
-                                                     (item_correct_df['full_model'] == 1)])
+    corr_per_cat_dict = dict(zip(range(n_cats), corr_per_cat.tolist()))
+    corr_per_cat_top_k_dict = dict(zip(range(n_cats), corr_per_cat_top_k.tolist()))
 
     # # # are any categories missing?
-    category_fail = sum(value == 0 for value in corr_per_cat_dict.values())
-    category_low = sum(value < 3 for value in corr_per_cat_dict.values())
+    category_fail = int(np.sum(corr_per_cat == 0))
+    category_low = int(np.sum(corr_per_cat < 3))
     n_cats_correct = n_cats - category_fail
 
     scores_dict = {"n_items": fm_items, "n_correct": fm_correct, "gha_acc": gha_acc,
                    "category_fail": category_fail, "category_low": category_low,
                    "n_cats_correct": n_cats_correct,
                    "corr_per_cat_dict": corr_per_cat_dict,
+                   "items_per_cat": items_per_cat.tolist(),
+                   "sparse_conf": sparse_conf,
+                   "top_k": top_k, "n_correct_top_k": n_correct_top_k, "top_k_acc": top_k_acc,
+                   "corr_per_cat_top_k_dict": corr_per_cat_top_k_dict,
+                   "scores_hdf_name": scores_hdf_name,
                    # "item_correct_name": item_correct_name,
                    # "flat_conf_name": flat_conf_name,
                    "scores_date": tools_date, 'scores_time': tools_time}
-    
+
 
     return item_correct_df, scores_dict, incorrect_items
 
 
+def load_item_scores(output_filename, df_name='item_correct_df', columns=('full_model', 'full_model_top_k')):
+    """
+    Load item scores saved by hdf_pred_scores (e.g., top-1 and top-k correct for each item)
+    for lesion or selectivity analysis, without running the model again.
+
+    :param output_filename: as used for hdf_pred_scores
+    :param df_name: as used for hdf_pred_scores
+    :param columns: datasets to load, any of: true_cat, pred_cat, full_model, top_k, full_model_top_k,
+                    pred_vals, conf_true, conf_pred, conf_count, conf_matrix (n_cats <= 100)
+
+    :return: dict {column: array}
+    """
+    with h5py.File(f"{output_filename}_scores.h5", 'r') as scores_store:
+        scores_group = scores_store[df_name]
+        return {column: scores_group[column][...] for column in columns}
+
+
 def hdf_gha(model,
             layer_name,
             layer_number,
@@ -363,29 +478,16 @@ def hdf_gha(model,
     if test_run:
         total_items = 64
 
-    batchsize = batch_size
-    batches_in_data = total_items//batchsize
-
-    for i in range(batches_in_data):
-        # # step through the data in slices/batches
-
-        # # get indices to slice to/from
-        idx_from = i * batchsize
-        idx_to = (i + 1) * batchsize
+    # # step through the data in slices/batches (x_data is preprocessed in the background)
+    for i, (idx_from, idx_to, x_data, _) in enumerate(hdf_batch_reader(data_hdf_path,
+                                                                       total_items=total_items,
+                                                                       batch_size=batch_size,
+                                                                       x_path=x_path,
+                                                                       use_vgg_colours=use_vgg_colours)):
         print(f"\n{i}: from {idx_from} to: {idx_to}")
 
-        with h5py.File(data_hdf_path, 'r') as dataset:
-            # # open the hdf with the x and y data
-
-            # # slice x_data
-            x_data = dataset[x_path][idx_from:idx_to, ...]
-
-            # # preprocess colours from RGB to BGR
-            if use_vgg_colours:
-                x_data = preprocess_input(x_data)
-
-            if verbose:
-                print(f"x_data: {x_data.shape}")
+        if verbose:
+            print(f"x_data: {x_data.shape}")
 
 
         # # # which items to run gha on - all or just correct items
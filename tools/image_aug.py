@@ -0,0 +1,239 @@
+import numpy as np
+import tensorflow as tf
+
+
+'''Image augmentation in a tf.data pipeline.
+
+Same random transforms as keras ImageDataGenerator (rotation, width/height shift, shear, zoom),
+but a whole batch is transformed at once (one projective transform op) inside dataset.map,
+with parallel calls and prefetch, rather than image by image in python.
+
+The transform matrices are made the same way as keras' apply_affine_transform:
+    rotation @ shift @ shear @ zoom, about the centre of the image,
+with bilinear interpolation and the same fill modes.
+
+tensorflow 2.0 (ktf.yml) doesn't have a projective transform op with fill modes,
+so transform_images() samples the images with gather and bilinear weights,
+and pixels outside the image are mapped back in (fill_index) the same way as keras' fill_mode.
+'''
+
+
+def random_affine_transforms(batch_size, height, width,
+                             rotation_range=0., width_shift_range=0., height_shift_range=0.,
+                             shear_range=0., zoom_range=0., seed=None):
+    """
+    Random transforms for a batch of images, as used by ImageDataGenerator.random_transform().
+
+    :param batch_size: number of transforms
+    :param height: image height (rows)
+    :param width: image width (cols)
+    :param rotation_range: degrees, rotation is uniform(-rotation_range, rotation_range)
+    :param width_shift_range: fraction of width (or pixels if >= 1)
+    :param height_shift_range: fraction of height (or pixels if >= 1)
+    :param shear_range: shear angle in degrees
+    :param zoom_range: zoom in x and y are (separately) uniform(1 - zoom_range, 1 + zoom_range)
+    :param seed: op seed for tf.random.uniform
+
+    :return: float32 tensor (batch_size, 8) of projective transforms for transform_images()
+    """
+    def uniform(limit, seed_offset):
+        op_seed = None if seed is None else seed + seed_offset
+        return tf.random.uniform([batch_size], -limit, limit, seed=op_seed)
+
+    theta = uniform(np.deg2rad(rotation_range), 0)
+    if height_shift_range < 1:
+        height_shift_range = height_shift_range * height
+    if width_shift_range < 1:
+        width_shift_range = width_shift_range * width
+    tx = uniform(height_shift_range, 1)
+    ty = uniform(width_shift_range, 2)
+    shear = uniform(np.deg2rad(shear_range), 3)
+    zx = 1. + uniform(zoom_range, 4)
+    zy = 1. + uniform(zoom_range, 5)
+
+    zeros = tf.zeros([batch_size])
+    ones = tf.ones([batch_size])
+
+    def matrices(rows):
+        """(batch, 3, 3) from 3 rows of 3 (batch, ) tensors"""
+        return tf.stack([tf.stack(row, axis=-1) for row in rows], axis=1)
+
+    # # keras matrices work on (row, col) coords
+    rotation = matrices([[tf.cos(theta), -tf.sin(theta), zeros],
+                         [tf.sin(theta), tf.cos(theta), zeros],
+                         [zeros, zeros, ones]])
+    shift = matrices([[ones, zeros, tx],
+                      [zeros, ones, ty],
+                      [zeros, zeros, ones]])
+    shear_matrix = matrices([[ones, -tf.sin(shear), zeros],
+                             [zeros, tf.cos(shear), zeros],
+                             [zeros, zeros, ones]])
+    zoom = matrices([[zx, zeros, zeros],
+                     [zeros, zy, zeros],
+                     [zeros, zeros, ones]])
+
+    # # about the centre of the image (transform_matrix_offset_center)
+    o_x = height / 2. - .5
+    o_y = width / 2. - .5
+    offset = tf.constant([[1., 0., o_x], [0., 1., o_y], [0., 0., 1.]])
+    reset = tf.constant([[1., 0., -o_x], [0., 1., -o_y], [0., 0., 1.]])
+
+    m = offset @ rotation @ shift @ shear_matrix @ zoom @ reset
+
+    # # tf transforms map output (x=col, y=row) to input (x', y'), so swap rows and cols
+    return tf.stack([m[:, 1, 1], m[:, 1, 0], m[:, 1, 2],
+                     m[:, 0, 1], m[:, 0, 0], m[:, 0, 2],
+                     zeros, zeros], axis=-1)
+
+
+def fill_index(index, size, fill_mode='nearest'):
+    """
+    Map int pixel indices outside [0, size) back into the image, as keras' fill_mode.
+
+    :param index: int32 tensor of row or col indices
+    :param size: number of rows or cols
+    :param fill_mode: 'nearest' (aaaa|abcd|dddd), 'constant' (kkkk|abcd|kkkk), 'reflect' (dcba|abcd|dcba)
+                        or 'wrap' (abcd|abcd|abcd).  For 'constant', indices are clipped here and
+                        the pixels are replaced with cval in transform_images().
+
+    :return: int32 tensor of indices in [0, size)
+    """
+    if fill_mode in ['nearest', 'constant']:
+        return tf.clip_by_value(index, 0, size - 1)
+    elif fill_mode == 'reflect':
+        period = tf.math.floormod(index, 2 * size)
+        return tf.where(period < size, period, 2 * size - 1 - period)
+    elif fill_mode == 'wrap':
+        return tf.math.floormod(index, size)
+    raise ValueError(f"fill_mode '{fill_mode}' not in ['nearest', 'constant', 'reflect', 'wrap']")
+
+
+def transform_images(images, transforms, fill_mode='nearest', cval=0.):
+    """
+    Apply a projective transform to each image in a batch, with bilinear interpolation.
+    Each transform is [a0, a1, a2, b0, b1, b2, c0, c1]: output (x, y) (col, row) is sampled from
+    input (a0 x + a1 y + a2, b0 x + b1 y + b2) (c0, c1 are not used, they are 0 for affine transforms).
+    Only uses ops in tensorflow 2.0.
+
+    :param images: float32 tensor (batch, height, width, channels)
+    :param transforms: float32 tensor (batch, 8)
+    :param fill_mode: 'nearest', 'constant', 'reflect' or 'wrap' (see fill_index())
+    :param cval: value for fill_mode='constant'
+
+    :return: transformed images (batch, height, width, channels)
+    """
+    height, width, channels = images.shape[1], images.shape[2], images.shape[3]
+    batch_size = tf.shape(images)[0]
+
+    # # output pixel coords, (1, height * width)
+    rows, cols = tf.meshgrid(tf.range(height, dtype=tf.float32), tf.range(width, dtype=tf.float32),
+                             indexing='ij')
+    rows = tf.reshape(rows, [1, -1])
+    cols = tf.reshape(cols, [1, -1])
+
+    # # input coords for each output pixel, (batch, height * width)
+    x_in = transforms[:, 0:1] * cols + transforms[:, 1:2] * rows + transforms[:, 2:3]
+    y_in = transforms[:, 3:4] * cols + transforms[:, 4:5] * rows + transforms[:, 5:6]
+
+    x_0 = tf.floor(x_in)
+    y_0 = tf.floor(y_in)
+    x_weight = (x_in - x_0)[..., tf.newaxis]
+    y_weight = (y_in - y_0)[..., tf.newaxis]
+    x_0 = tf.cast(x_0, tf.int32)
+    y_0 = tf.cast(y_0, tf.int32)
+
+    # # all images as one (batch * height * width, channels) array to gather pixels from
+    flat_images = tf.reshape(images, [-1, channels])
+    image_offset = tf.range(batch_size)[:, tf.newaxis] * (height * width)
+
+    def sample(y, x):
+        """pixels at int coords y, x (batch, height * width) -> (batch, height * width, channels)"""
+        pixels = tf.gather(flat_images, image_offset + fill_index(y, height, fill_mode) * width
+                           + fill_index(x, width, fill_mode))
+        if fill_mode == 'constant':
+            inside = (y >= 0) & (y < height) & (x >= 0) & (x < width)
+            inside = tf.cast(inside, tf.float32)[..., tf.newaxis]
+            pixels = pixels * inside + cval * (1. - inside)
+        return pixels
+
+    transformed = ((1. - y_weight) * ((1. - x_weight) * sample(y_0, x_0) + x_weight * sample(y_0, x_0 + 1))
+                   + y_weight * ((1. - x_weight) * sample(y_0 + 1, x_0) + x_weight * sample(y_0 + 1, x_0 + 1)))
+
+    return tf.reshape(transformed, [batch_size, height, width, channels])
+
+
+def augment_batch(images, rotation_range=0., width_shift_range=0., height_shift_range=0.,
+                  shear_range=0., zoom_range=0., fill_mode='nearest', cval=0., seed=None):
+    """
+    Randomly transform a batch of images (batch, height, width, channels) at once.
+
+    :param images: float32 tensor (batch, height, width, channels)
+    :param rotation_range: see random_affine_transforms()
+    :param width_shift_range: see random_affine_transforms()
+    :param height_shift_range: see random_affine_transforms()
+    :param shear_range: see random_affine_transforms()
+    :param zoom_range: see random_affine_transforms()
+    :param fill_mode: 'nearest', 'constant', 'reflect' or 'wrap'
+    :param cval: value for fill_mode='constant'
+    :param seed: op seed
+
+    :return: transformed images
+    """
+    height, width = images.shape[1], images.shape[2]
+    transforms = random_affine_transforms(tf.shape(images)[0], height, width,
+                                          rotation_range=rotation_range,
+                                          width_shift_range=width_shift_range,
+                                          height_shift_range=height_shift_range,
+                                          shear_range=shear_range,
+                                          zoom_range=zoom_range,
+                                          seed=seed)
+
+    return transform_images(images, transforms, fill_mode=fill_mode, cval=cval)
+
+
+def make_augmented_dataset(x_data, y_data, batch_size=32,
+                           rotation_range=0., width_shift_range=0., height_shift_range=0.,
+                           shear_range=0., zoom_range=0., fill_mode='nearest',
+                           shuffle=True, shuffle_buffer=10000, seed=None):
+    """
+    tf.data version of ImageDataGenerator(...).flow(x_data, y_data, batch_size).
+    Items are shuffled each epoch, batched, augmented with parallel map and prefetched.
+
+    :param x_data: images (n_items, height, width, channels)
+    :param y_data: labels (n_items, ...)
+    :param batch_size: items per batch
+    :param rotation_range: see random_affine_transforms()
+    :param width_shift_range: see random_affine_transforms()
+    :param height_shift_range: see random_affine_transforms()
+    :param shear_range: see random_affine_transforms()
+    :param zoom_range: see random_affine_transforms()
+    :param fill_mode: 'nearest', 'constant', 'reflect' or 'wrap'
+    :param shuffle: shuffle items each epoch
+    :param shuffle_buffer: max items in the shuffle buffer
+    :param seed: for shuffling and transforms
+
+    :return: tf.data.Dataset of (x_batch, y_batch), one epoch per iteration
+    """
+    x_data = np.asarray(x_data, dtype=np.float32)
+    if len(np.shape(x_data)) == 3:
+        x_data = x_data[..., np.newaxis]
+
+    dataset = tf.data.Dataset.from_tensor_slices((x_data, y_data))
+    if shuffle:
+        dataset = dataset.shuffle(min(len(x_data), shuffle_buffer), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+
+    def augment(x_batch, y_batch):
+        return augment_batch(x_batch,
+                             rotation_range=rotation_range,
+                             width_shift_range=width_shift_range,
+                             height_shift_range=height_shift_range,
+                             shear_range=shear_range,
+                             zoom_range=zoom_range,
+                             fill_mode=fill_mode,
+                             seed=seed), y_batch
+
+    dataset = dataset.map(augment, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+    return dataset
@@ -1,6 +1,7 @@
 import datetime
 import os
 import pickle
+import pickletools
 import shelve
 import h5py
 from itertools import product
@@ -8,7 +9,7 @@ import numpy as np
 import pandas as pd
 from sklearn.metrics import confusion_matrix
 
-from tools.data import load_y_data, nick_to_csv, nick_read_csv
+from tools.data import load_y_data, nick_to_table, nick_read_table
 from tools.dicts import load_dict, focussed_dict_print
 
 
@@ -307,8 +308,8 @@ def get_scores(predicted_outputs, y_df, output_filename,
     conf_matrix_df.index.names = ['true_label']
 
     # # names for output files
-    item_correct_name = "{}_item_correct.csv".format(output_filename)
-    flat_conf_name = "{}_flat_conf_matrix.csv".format(output_filename)
+    item_correct_name = "{}_item_correct.tbl".format(output_filename)
+    flat_conf_name = "{}_flat_conf_matrix.tbl".format(output_filename)
 
     flat_conf_or_name = flat_conf_name
     if return_flat_conf is True:
@@ -320,7 +321,7 @@ def get_scores(predicted_outputs, y_df, output_filename,
         flat_conf_or_name = flat_conf_df
         if save_all_csvs is True:
             # flat_conf_df.to_csv(flat_conf_name)
-            nick_to_csv(flat_conf_df, flat_conf_name)
+            nick_to_table(flat_conf_df, flat_conf_name)
 
     if verbose is True:
         print("\ncategory failures: " + str(category_fail))
@@ -341,7 +342,7 @@ def get_scores(predicted_outputs, y_df, output_filename,
         else:
             int_item_correct_df = item_correct_df.astype('int32')
         # int_item_correct_df.to_csv(item_correct_name, index=False)
-        nick_to_csv(int_item_correct_df, item_correct_name)
+        nick_to_table(int_item_correct_df, item_correct_name)
 
     scores_dict = {"n_items": n_items, "n_correct": n_correct, "gha_acc": gha_acc,
                    "category_fail": category_fail, "category_low": category_low, "n_cats_correct": n_cats_correct,
@@ -489,7 +490,81 @@ def get_scores(predicted_outputs, y_df, output_filename,
 
 
 
-def VGG_get_scores(predicted_outputs, y_df, output_filename, verbose=False, save_all_csvs=True):
+def get_top_k(predicted_outputs, true_cat, top_k=5):
+    """
+    Top-k classes for each item (with argpartition, so the whole row isn't sorted)
+    and whether the true class is one of them.
+
+    :param predicted_outputs: shape (n_items, n_cats)
+    :param true_cat: true class of each item (n_items, )
+    :param top_k: number of top classes
+
+    :return: top_k_cats (n_items, top_k), highest first
+    :return: in_top_k - uint8 (n_items, ), 1 if true class is in top_k
+    """
+    predicted_outputs = np.asarray(predicted_outputs)
+    top_k = min(top_k, predicted_outputs.shape[1])
+
+    top_k_cats = np.argpartition(-predicted_outputs, top_k - 1, axis=1)[:, :top_k]
+    top_k_order = np.argsort(-np.take_along_axis(predicted_outputs, top_k_cats, axis=1), axis=1)
+    top_k_cats = np.take_along_axis(top_k_cats, top_k_order, axis=1)
+
+    in_top_k = np.any(top_k_cats == np.asarray(true_cat)[:, np.newaxis], axis=1).astype(np.uint8)
+
+    return top_k_cats, in_top_k
+
+
+def sparse_confusion(true_cat, pred_cat, n_cats, counts=None):
+    """
+    Confusion matrix as COO triplets (non-zero cells only), e.g., for 1000 ImageNet classes,
+    where a dense (or flattened, labelled) matrix per lesioned unit is too big.
+
+    :param true_cat: true class of each item (or of each cell, if counts is given)
+    :param pred_cat: predicted class of each item (or cell)
+    :param n_cats: number of classes
+    :param counts: count for each cell (e.g., to merge triplets from several batches)
+
+    :return: dict {'n_cats': n_cats, 'true': array, 'pred': array, 'count': array}
+    """
+    cells = np.asarray(true_cat, dtype=np.int64) * n_cats + np.asarray(pred_cat, dtype=np.int64)
+    cells, cell_index = np.unique(cells, return_inverse=True)
+    if counts is None:
+        cell_counts = np.bincount(cell_index)
+    else:
+        cell_counts = np.bincount(cell_index, weights=counts).astype(np.int64)
+
+    return {'n_cats': n_cats, 'true': cells // n_cats, 'pred': cells % n_cats, 'count': cell_counts}
+
+
+def sparse_conf_class_counts(sparse_conf):
+    """
+    Per class counts from a sparse confusion matrix (see sparse_confusion).
+
+    :param sparse_conf: dict from sparse_confusion
+
+    :return: tp (correct per class), true_tot (items per class), pred_tot (items predicted as each class).
+        fp = pred_tot - tp, fn = true_tot - tp.
+    """
+    n_cats = sparse_conf['n_cats']
+    true_cat, pred_cat, counts = sparse_conf['true'], sparse_conf['pred'], sparse_conf['count']
+    diagonal = true_cat == pred_cat
+
+    tp = np.bincount(true_cat[diagonal], weights=counts[diagonal], minlength=n_cats).astype(int)
+    true_tot = np.bincount(true_cat, weights=counts, minlength=n_cats).astype(int)
+    pred_tot = np.bincount(pred_cat, weights=counts, minlength=n_cats).astype(int)
+
+    return tp, true_tot, pred_tot
+
+
+def sparse_conf_to_dense(sparse_conf):
+    """(n_cats, n_cats) array (true x pred) from a sparse confusion matrix"""
+    n_cats = sparse_conf['n_cats']
+    conf_matrix = np.zeros((n_cats, n_cats), dtype=int)
+    conf_matrix[sparse_conf['true'], sparse_conf['pred']] = sparse_conf['count']
+    return conf_matrix
+
+
+def VGG_get_scores(predicted_outputs, y_df, output_filename, verbose=False, save_all_csvs=True, top_k=5):
     """
     Script will compare predicted class and true class to find whether each item was correct.
 
@@ -499,10 +574,15 @@ def VGG_get_scores(predicted_outputs, y_df, output_filename, verbose=False, save
     :param y_df:  y item and class
     :param output_filename:  to use when saving csvs
     :param verbose:
-    :param save_all_csvs:
+    :param save_all_csvs: if True, save item_correct, flat_conf, top_k_correct and sparse_conf files
+                          under output_filename.  Use False when scoring many models (e.g., each lesioned unit),
+                          and store the arrays returned in scores_dict per model instead.
+    :param top_k: also score whether the true class is in the top_k predictions (None to skip).
+                  The uint8 per-item array is returned as scores_dict['top_k_correct']
+                  (and saved to {output_filename}_top_{top_k}_correct.npy), counts in scores_dict.
 
     :return: item_correct_df - item number, class, correct (1 or if incorrect, 0)
-    :return: scores_dict - descriptives
+    :return: scores_dict - descriptives (including sparse_conf, see sparse_confusion() and top_k_correct)
     :return: incorrect_items - list of item numbers that were incorrect
 
     """
@@ -558,10 +638,27 @@ def VGG_get_scores(predicted_outputs, y_df, output_filename, verbose=False, save
     category_low = sum(value < 3 for value in corr_per_cat_dict.values())
     n_cats_correct = n_cats - category_fail
 
-    # # report scores
-    conf_matrix = confusion_matrix(y_true=true_cat, y_pred=predicted_cat)
-    print("conf_matrix_shape: {}".format(np.shape(conf_matrix)))
-    np.save('{}_conf_matrix.npy'.format(output_filename), conf_matrix)
+    # # top-k scores
+    top_k_scores = dict()
+    if top_k:
+        top_k_cats, in_top_k = get_top_k(predicted_outputs, true_cat, top_k=top_k)
+        corr_per_cat_top_k = np.bincount(np.asarray(true_cat)[in_top_k == 1], minlength=n_cats)
+        n_correct_top_k = int(np.sum(in_top_k))
+        top_k_scores = {"top_k": top_k,
+                        "n_correct_top_k": n_correct_top_k,
+                        "top_k_acc": np.around(n_correct_top_k / n_items, decimals=3),
+                        "corr_per_cat_top_k_dict": dict(zip(range(n_cats), corr_per_cat_top_k.tolist())),
+                        "top_k_correct": in_top_k}
+        print("top_{} correct: {}\ntop_{} accuracy: {}".format(top_k, n_correct_top_k,
+                                                              top_k, top_k_scores['top_k_acc']))
+        if save_all_csvs is True:
+            np.save('{}_top_{}_correct.npy'.format(output_filename, top_k), in_top_k)
+
+    # # report scores (sparse, as there might be 1000 classes)
+    sparse_conf = sparse_confusion(true_cat, predicted_cat, n_cats)
+    print("sparse_conf cells: {}".format(len(sparse_conf['count'])))
+    if save_all_csvs is True:
+        np.savez_compressed('{}_sparse_conf.npz'.format(output_filename), **sparse_conf)
 
 
     if verbose is True:
@@ -570,7 +667,7 @@ def VGG_get_scores(predicted_outputs, y_df, output_filename, verbose=False, save
         print("corr_per_cat_dict: {}".format(corr_per_cat_dict))
 
     # # names for output files
-    item_correct_name = "{}_item_correct.csv".format(output_filename)
+    item_correct_name = "{}_item_correct.tbl".format(output_filename)
     flat_conf_name = "{}_flat_conf_matrix.csv".format(output_filename)
 
     if save_all_csvs is True:
@@ -578,7 +675,7 @@ def VGG_get_scores(predicted_outputs, y_df, output_filename, verbose=False, save
         if n_cats > 100:
             print("too many classes to make a flat conf matrix")
         else:
-            flat_conf = np.ravel(conf_matrix)
+            flat_conf = np.ravel(sparse_conf_to_dense(sparse_conf))
             flat_conf_labels = ["t{}_p{}".format(i[0], i[1])
                                 for i in list(product(list(range(n_cats)), repeat=2))]
             flat_conf_df = pd.DataFrame(data=[flat_conf], columns=flat_conf_labels, index=['full_model'])
@@ -596,8 +693,8 @@ def VGG_get_scores(predicted_outputs, y_df, output_filename, verbose=False, save
         int_item_correct_df = item_correct_df  # keeps the current int64
         # else:
         #     int_item_correct_df = item_correct_df.astype('int32')
-        int_item_correct_df.to_csv(item_correct_name, index=False)
-        # nick_to_csv(int_item_correct_df, item_correct_name)
+        # int_item_correct_df.to_csv(item_correct_name, index=False)
+        nick_to_table(int_item_correct_df, item_correct_name)
 
 
     scores_dict = {"n_items": n_items, "n_correct": n_correct, "gha_acc": gha_acc,
@@ -605,17 +702,188 @@ def VGG_get_scores(predicted_outputs, y_df, output_filename, verbose=False, save
                    "corr_per_cat_dict": corr_per_cat_dict,
                    "item_correct_name": item_correct_name,
                    # "flat_conf_name": flat_conf_name,
+                   "sparse_conf": sparse_conf,
                    "scores_date": tools_date, 'scores_time': tools_time}
+    scores_dict.update(top_k_scores)
 
     return item_correct_df, scores_dict, incorrect_items
 
 ##################################################################
 
+class UnitRecord:
+    """
+    Lightweight record for one unit (and timestep) yielded by loop_thru_acts().
+
+    unit_acts is a (strided) view into the memory-mapped layer array, labels and item_index
+    are shared arrays for the whole layer, so nothing is copied per unit.
+    If incorrect items are being removed, rows are the items to keep and acts does the indexing
+    (once, the result is cached).
+
+    Old callers can still use it like the old loop_dict, e.g., unit_gha['layer_name'].
+    unit_gha['item_act_label_array'] is only made when asked for.
+    """
+    __slots__ = ('sequence_data', 'y_1hot', 'act_func', 'hid_act_number', 'layer_name',
+                 'unit_index', 'timestep', 'unit_acts', 'labels', 'item_index', 'rows', '_acts')
+
+    loop_dict_keys = ("sequence_data", "y_1hot", "act_func", "hid_act_number", "layer_name",
+                      "unit_index", "timestep", 'item_act_label_array')
+
+    def __init__(self, sequence_data, y_1hot, act_func, hid_act_number, layer_name,
+                 unit_index, timestep, unit_acts, labels, item_index, rows=None):
+        self.sequence_data = sequence_data
+        self.y_1hot = y_1hot
+        self.act_func = act_func
+        self.hid_act_number = hid_act_number
+        self.layer_name = layer_name
+        self.unit_index = unit_index
+        self.timestep = timestep
+        self.unit_acts = unit_acts
+        self.labels = labels
+        self.item_index = item_index
+        self.rows = rows
+        self._acts = None
+
+    @property
+    def acts(self):
+        """activations for this unit/timestep (only the items being analysed)"""
+        if self.rows is None:
+            return self.unit_acts
+        if self._acts is None:
+            self._acts = self.unit_acts[self.rows]
+        return self._acts
+
+    @property
+    def item_act_label_array(self):
+        """legacy (items, 3) array of item_index, activation, label"""
+        return np.vstack((self.item_index, self.acts, self.labels)).T
+
+    def keys(self):
+        return self.loop_dict_keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.loop_dict_keys]
+
+    def __contains__(self, key):
+        return key in self.loop_dict_keys
+
+    def __getitem__(self, key):
+        if key not in self.loop_dict_keys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+
+# # length of the size field after each raw bytes opcode in a pickle
+_pickle_bytes_opcodes = {'SHORT_BINBYTES': 1, 'BINBYTES': 4, 'BINBYTES8': 8, 'BYTEARRAY8': 8}
+
+
+def _pickled_bytes_offsets(pickle_filename):
+    """(offset, n_bytes) of each raw bytes object in a pickle file, in the order they were saved"""
+    offsets = []
+    with open(pickle_filename, 'rb') as pkl:
+        for opcode, arg, pos in pickletools.genops(pkl):
+            if opcode.name in _pickle_bytes_opcodes:
+                offsets.append((pos + 1 + _pickle_bytes_opcodes[opcode.name], len(arg)))
+    return offsets
+
+
+def get_layer_memmaps(hid_acts_filename, verbose=False):
+    """
+    Memory-map the activations for each layer in a hid_acts pickle.
+
+    numpy arrays are pickled as their raw bytes, so each layer's activations are
+    memory-mapped straight from the hid_acts pickle.
+    The first time, the pickle is loaded once to find where each layer's array is in the file,
+    this is saved as a small index pickle.  After that the pickle isn't loaded at all, just the index.
+    Any layer that can't be mapped from the pickle (e.g., old pickle protocols) is saved as
+    {hid_acts_name}_layer{hid_act_number}.npy instead.
+
+    :param hid_acts_filename: path to hid_acts.pickle
+    :param verbose: how much to print to screen
+
+    :return: dict {hid_act_number: {'layer_name': name, 'hid_acts': read-only memmap}}
+    """
+    if verbose:
+        print("\n**** get_layer_memmaps() ****")
+
+    hid_acts_name = os.path.splitext(hid_acts_filename)[0]
+    index_name = f"{hid_acts_name}_layer_index.pickle"
+
+    if not os.path.isfile(index_name) or \
+            os.path.getmtime(index_name) < os.path.getmtime(hid_acts_filename):
+        print(f"\nfinding layers in {hid_acts_filename} (only done once)")
+        with open(hid_acts_filename, 'rb') as pkl:
+            hid_acts_dict = pickle.load(pkl)
+        bytes_offsets = iter(_pickled_bytes_offsets(hid_acts_filename))
+
+        layer_index = dict()
+        for hid_act_number, layer_dict in hid_acts_dict.items():
+            if 'hid_acts' in layer_dict:
+                hid_acts_key = 'hid_acts'
+            elif '2d_acts' in layer_dict:
+                hid_acts_key = '2d_acts'
+            else:
+                raise KeyError(f"how are hid_acts labelled in layer_dict?: {layer_dict.keys()}")
+
+            # # arrays are saved in the order they are in the dict,
+            # skip other bytes objects (e.g., numpy's typecode) to the next one the size of the array
+            hid_acts_array = np.asarray(layer_dict[hid_acts_key])
+            array_offset = None
+            for key, value in layer_dict.items():
+                if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+                    offset_and_size = next((o for o in bytes_offsets if o[1] == value.nbytes), None)
+                    if key == hid_acts_key:
+                        array_offset = offset_and_size
+
+            order = 'F' if hid_acts_array.flags.f_contiguous and not hid_acts_array.flags.c_contiguous else 'C'
+            layer_info = {'layer_name': layer_dict['layer_name'],
+                          'offset': None if array_offset is None else array_offset[0],
+                          'shape': hid_acts_array.shape, 'dtype': hid_acts_array.dtype, 'order': order}
+
+            # # check the mapped array matches what was unpickled
+            mapped = array_offset is not None and array_offset[1] == hid_acts_array.nbytes
+            if mapped:
+                layer_memmap = np.memmap(hid_acts_filename, mode='r', offset=layer_info['offset'],
+                                         dtype=layer_info['dtype'], shape=layer_info['shape'], order=order)
+                mapped = np.allclose(layer_memmap, hid_acts_array, rtol=0, atol=0, equal_nan=True)
+                del layer_memmap
+
+            if not mapped:
+                layer_npy_name = f"{hid_acts_name}_layer{hid_act_number}.npy"
+                print(f"can't memory-map layer {hid_act_number} from pickle, saving {layer_npy_name}")
+                np.save(layer_npy_name, hid_acts_array)
+                layer_info = {'layer_name': layer_dict['layer_name'], 'npy_name': layer_npy_name}
+
+            layer_index[hid_act_number] = layer_info
+        hid_acts_dict = dict()
+
+        with open(index_name, "wb") as pickle_out:
+            pickle.dump(layer_index, pickle_out, protocol=pickle.HIGHEST_PROTOCOL)
+    else:
+        layer_index = load_dict(index_name)
+
+    layer_memmaps = dict()
+    for hid_act_number, layer_info in layer_index.items():
+        if 'npy_name' in layer_info:
+            layer_acts = np.load(layer_info['npy_name'], mmap_mode='r')
+        else:
+            layer_acts = np.memmap(hid_acts_filename, mode='r', offset=layer_info['offset'],
+                                   dtype=layer_info['dtype'], shape=layer_info['shape'],
+                                   order=layer_info['order'])
+        layer_memmaps[hid_act_number] = {'layer_name': layer_info['layer_name'], 'hid_acts': layer_acts}
+
+    if verbose:
+        for hid_act_number, layer_info in layer_memmaps.items():
+            print(f"{hid_act_number}: {layer_info['layer_name']} {np.shape(layer_info['hid_acts'])}")
+
+    return layer_memmaps
+
+
 def loop_thru_acts(gha_dict_path,
                    correct_items_only=True,
                    acts_saved_as='pickle',
                    letter_sel=False,
                    already_completed={},
+                   yield_layers=False,
                    verbose=False, test_run=False):
     """To use hidden unit activations for sel, (lesioning?) visualisation.
         1. load dict from study (GHA dict) - get variables from dict
@@ -637,13 +905,16 @@ def loop_thru_acts(gha_dict_path,
     :param already_completed: None, or dict with layer_names as keys,
                             values are ether 'all' or number of last completed unit.
     :param acts_saved_as: file format used to save gha
+    :param yield_layers: if True, yield one dict per layer (whole hid_acts array, rows to keep and
+                        list of units still to run) rather than a UnitRecord per unit/timestep.
 
     :param verbose: how much to print to screen
     :param test_run: if True, only do subset, e.g., 3 units from 3 layers
 
-    :return: hid_acts_array (activation values for all items at this unit (all timesteps?))
-    :return: data_details (item_numbers, class_labels, whether_correct)
-    :return: unit-details (layer_name, layer_class, act_func, unit_number)
+    :return: UnitRecord for each unit (and timestep), which can also be used like the old loop_dict.
+            acts (activation values for all items at this unit/timestep, a view into the layer)
+            labels, item_index (shared for all units)
+            unit-details (layer_name, act_func, unit_index, timestep)
     """
 
     if verbose:
@@ -778,7 +1049,7 @@ def loop_thru_acts(gha_dict_path,
         # # load item_correct (y_data)
         item_correct_name = gha_dict['GHA_info']['scores_dict']['item_correct_name']
         # y_df = pd.read_csv(item_correct_name)
-        y_scores_df = nick_read_csv(item_correct_name)
+        y_scores_df = nick_read_table(item_correct_name)
         seqs_corr = y_scores_df['full_model'].to_list()
         test_label_seqs = np.array(y_scores_df['full_model'].to_list())
 
@@ -888,18 +1159,23 @@ def loop_thru_acts(gha_dict_path,
 
 
 
+    # # labels and item index are shared by all units (not remade per unit)
+    item_index = np.asarray(item_index)
+    if sequence_data:
+        shared_labels = np.asarray(test_label_seqs).astype(int)
+    else:
+        shared_labels = y_df['class'].to_numpy()
+
     # # Part 3 - where to load hid_acts from
     if acts_saved_as is 'pickle':
-        with open(hid_acts_filename, 'rb') as pkl:
-            hid_acts_dict = pickle.load(pkl)
+        # # each layer is memory-mapped from the pickle file, rather than unpickling everything for every layer
+        hid_acts_dict = get_layer_memmaps(hid_acts_filename, verbose=verbose)
 
         hid_acts_keys_list = list(hid_acts_dict.keys())
 
         if verbose:
-            print(f"\n**** pickle opening {hid_acts_filename} ****")
+            print(f"\n**** memory-mapped layers from {hid_acts_filename} ****")
             print(f"hid_acts_keys_list: {hid_acts_keys_list}")
-            print(f"first layer keys: {list(hid_acts_dict[0].keys())}")
-            # focussed_dict_print(hid_acts_dict, 'hid_acts_dict')
 
         last_hid_act_number = hid_acts_keys_list[-1]
         last_layer_name = hid_acts_dict[last_hid_act_number]['layer_name']
@@ -949,10 +1225,8 @@ def loop_thru_acts(gha_dict_path,
 
         # # Once I've decided to run this unit
         if acts_saved_as is 'pickle':
-            with open(hid_acts_filename, 'rb') as pkl:
-                hid_acts_dict = pickle.load(pkl)
-                layer_dict = hid_acts_dict[hid_act_number]
-                
+            layer_dict = hid_acts_dict[hid_act_number]
+
         elif acts_saved_as is 'h5':
             with h5py.File(hid_acts_filename, 'r') as hid_acts_dict:
                 layer_dict = hid_acts_dict[hid_act_number]
@@ -1010,18 +1284,15 @@ def loop_thru_acts(gha_dict_path,
 
 
 
-        # # remove incorrect responses from np array
+        # # remove incorrect responses: rows to keep are applied per unit (not copying the layer)
+        keep_rows = None
         if correct_items_only:
             if gha_incorrect:
+                keep_rows = np.flatnonzero(mask)
                 if verbose:
                     print(f"\nremoving {n_incorrect} incorrect responses from "
                           f"hid_acts_array: {np.shape(hid_acts_array)}")
-
-                hid_acts_array = hid_acts_array[mask]
-                # these_labels = np.array(list(range(_n_items)))[mask]
-                if verbose:
-                    print(f"(cleaned) np.shape(hid_acts_array) (n_seqs_corr, timesteps, units_per_layer): "
-                          f"{np.shape(hid_acts_array)}"
+                    print(f"(cleaned) n_seqs_corr: {len(keep_rows)}"
                           f"\ntest_label_seqs: {np.shape(test_label_seqs)}")
 
         # get units per layer
@@ -1035,6 +1306,20 @@ def loop_thru_acts(gha_dict_path,
 
         
         
+        if yield_layers:
+            # # whole layer at once, with the units that still need running
+            run_units = list(range(units_per_layer))
+            if partially_completed_layer:
+                run_units = [u for u in run_units if u > already_completed[layer_name]]
+            if test_run is True:
+                run_units = run_units[:3]
+
+            yield {'sequence_data': sequence_data, 'y_1hot': y_1hot, 'act_func': act_func,
+                   'hid_act_number': hid_act_number, 'layer_name': layer_name,
+                   'hid_acts': hid_acts_array, 'labels': shared_labels,
+                   'item_index': item_index, 'rows': keep_rows, 'units': run_units}
+            continue
+
         '''loop through units'''
         if verbose:
             print("\n**** loop through units ****")
@@ -1057,10 +1342,14 @@ def loop_thru_acts(gha_dict_path,
                   f"({layer_name}): unit {unit_index} of {units_per_layer}\n****")
             
             if sequence_data:
-                
+
                 one_unit_all_timesteps = hid_acts_array[:, :, unit_index]
+                if keep_rows is None:
+                    unit_sum = np.sum(one_unit_all_timesteps)
+                else:
+                    unit_sum = np.sum(one_unit_all_timesteps[keep_rows])
 
-                if np.sum(one_unit_all_timesteps) == 0:
+                if unit_sum == 0:
                     dead_unit = True
                     if verbose:
                         print("dead unit")
@@ -1068,55 +1357,37 @@ def loop_thru_acts(gha_dict_path,
                     if verbose:
                         print(f"\nnp.shape(one_unit_all_timesteps) (seqs, timesteps): "
                               f"{np.shape(one_unit_all_timesteps)}")
-                    
+
                     # get hid acts for each timestep
                     for timestep in range(timesteps):
                         print("\n\tunit {} timestep {} (of {})".format(unit_index, timestep, timesteps))
 
-                        one_unit_one_timestep = one_unit_all_timesteps[:, timestep]
-
-                        # y_labels_one_timestep_float = combo_data[:, timestep]
-                        y_labels_one_timestep_float = test_label_seqs[:, timestep]
-                        y_labels_one_timestep = [int(q) for q in y_labels_one_timestep_float]
-
-
-                        these_acts = one_unit_one_timestep
-                        these_labels = y_labels_one_timestep
+                        # # views, not copies
+                        unit_record = UnitRecord(sequence_data=sequence_data, y_1hot=y_1hot,
+                                                 act_func=act_func, hid_act_number=hid_act_number,
+                                                 layer_name=layer_name, unit_index=unit_index,
+                                                 timestep=timestep,
+                                                 unit_acts=one_unit_all_timesteps[:, timestep],
+                                                 labels=shared_labels[:, timestep],
+                                                 item_index=item_index, rows=keep_rows)
 
                         if verbose:
                             print(f'item_index: {np.shape(item_index)}')
-                            print(f'these_acts: {np.shape(these_acts)}')
-                            print(f'these_labels: {np.shape(these_labels)}')
-
-                        # insert act values in middle of labels (item, act, cat)
-                        item_act_label_array = np.vstack((item_index, these_acts, these_labels)).T
+                            print(f'these_acts: {np.shape(unit_record.acts)}')
+                            print(f'these_labels: {np.shape(unit_record.labels)}')
 
-                        if verbose:
-                            print(f"\t - one_unit_one_timestep shape: (n seqs) {np.shape(one_unit_one_timestep)}")
-                            print(f"\t - y_labels_one_timestep shape: {np.shape(y_labels_one_timestep)}")
-
-                            print(f"\t - item_act_label_array shape: (item_idx, hid_acts, y_label) "
-                                  f"{np.shape(item_act_label_array)}")
-                        # print(f"\titem_act_label_array: \n\t{item_act_label_array}")
-
-                        loop_dict = {
-                                     "sequence_data": sequence_data,
-                                     "y_1hot": y_1hot,
-                                     "act_func": act_func,
-                                     "hid_act_number": hid_act_number, "layer_name": layer_name,
-                                     "unit_index": unit_index,
-                                     "timestep": timestep,
-                                     'item_act_label_array': item_act_label_array,
-                                     }
-
-                        yield loop_dict
+                        yield unit_record
 
                     # return hid act, data info, unit info and timestep
             else:
                 # if not sequences, just items
                 this_unit_just_acts = hid_acts_array[:, unit_index]
-                
-                if np.sum(this_unit_just_acts) == 0:
+                if keep_rows is None:
+                    unit_sum = np.sum(this_unit_just_acts)
+                else:
+                    unit_sum = np.sum(this_unit_just_acts[keep_rows])
+
+                if unit_sum == 0:
                     dead_unit = True
                     if verbose:
                         print("dead unit")
@@ -1125,33 +1396,14 @@ def loop_thru_acts(gha_dict_path,
                         print(f"\nnp.shape(this_unit_just_acts) (items, ): "
                               f"{np.shape(this_unit_just_acts)}")
 
-                    these_acts = this_unit_just_acts
-                    these_labels = y_df['class'].tolist()
-                    #
-                    # if verbose:
-                    #     print(f"\nidiot check\n"
-                    #           f"item_index: {np.shape(item_index)}\n"
-                    #           f"these_acts: {np.shape(these_acts)}\n"
-                    #           f"these_labels: {np.shape(these_labels)}\n"
-                    #           f"these_labels: {these_labels}")
-
-                    # insert act values in middle of labels (item, act, cat)
-                    item_act_label_array = np.vstack((item_index, these_acts, these_labels)).T
-
-                    if verbose:
-                        print(" - item_act_label_array shape: {}".format(np.shape(item_act_label_array)))
-                        print(f"item_act_label_array: (item_idx, hid_acts, y_label)\n{item_act_label_array}")
-
                     timestep = None
 
-                    loop_dict = {
-                        "sequence_data": sequence_data,
-                        "y_1hot": y_1hot,
-                        "act_func": act_func,
-                        "hid_act_number": hid_act_number, "layer_name": layer_name,
-                        "unit_index": unit_index,
-                        "timestep": timestep,
-                        'item_act_label_array': item_act_label_array,
-                    }
-
-                    yield loop_dict
+                    unit_record = UnitRecord(sequence_data=sequence_data, y_1hot=y_1hot,
+                                             act_func=act_func, hid_act_number=hid_act_number,
+                                             layer_name=layer_name, unit_index=unit_index,
+                                             timestep=timestep,
+                                             unit_acts=this_unit_just_acts,
+                                             labels=shared_labels,
+                                             item_index=item_index, rows=keep_rows)
+
+                    yield unit_record
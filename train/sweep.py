@@ -0,0 +1,272 @@
+import csv
+import datetime
+import json
+import os
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+
+from tools.dicts import focussed_dict_print
+
+
+'''Parallel sweeps.
+
+Run a grid of train_model() arguments across a process pool,
+e.g., conditions x runs of small mlps/cnns/rnns, which only use a little of a multi-core box each.
+Each worker is a new (spawned) process with TF limited to tf_threads threads.
+Each finished run can be chained into GHA -> selectivity -> lesion in the same worker.
+
+A json manifest (one entry per job) is re-written as each job finishes,
+so re-running the same sweep skips jobs that are already 'done'.
+
+Each job writes its training_summary row(s) to its own csv, which the parent process
+adds to {exp_name}_training_summary.csv, so workers never write to the same file.
+'''
+
+# # analysis steps that can be chained after training, in order
+sweep_steps = ('gha', 'sel', 'lesion')
+
+
+def make_sweep_grid(base_kwargs, grid, n_runs=1):
+    """
+    Make a list of train_model kwargs from every combination of grid values.
+    Each combination is a condition (cond), each is repeated for n_runs (run).
+
+    :param base_kwargs: dict of kwargs used for every job (e.g., exp_name, data_dict_path)
+    :param grid: dict {kwarg: list of values}, e.g., {'act_func': ['relu', 'sigmoid'], 'lr': [.01, .001]}
+    :param n_runs: number of runs of each condition
+
+    :return: list of kwargs dicts
+    """
+    grid_keys = list(grid.keys())
+
+    job_list = []
+    for cond, values in enumerate(product(*[grid[k] for k in grid_keys])):
+        for run in range(n_runs):
+            job_kwargs = dict(base_kwargs)
+            job_kwargs.update(dict(zip(grid_keys, values)))
+            job_kwargs['cond'] = cond
+            job_kwargs['run'] = run
+            job_list.append(job_kwargs)
+
+    return job_list
+
+
+def _init_sweep_worker(tf_threads):
+    """limit the threads each worker uses (set before any TF ops run)"""
+    os.environ['OMP_NUM_THREADS'] = str(tf_threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(tf_threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(tf_threads)
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(tf_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(tf_threads)
+
+
+def _run_sweep_job(job_index, job_kwargs, model_type, chain, chain_kwargs):
+    """
+    Train one model and run the chained analysis steps.
+    Runs in a worker process, so imports are here (after the TF thread limits are set).
+
+    :return: manifest entry dict
+    """
+    entry = {'job': job_index, 'kwargs': job_kwargs, 'status': 'running',
+             'start': datetime.datetime.now().isoformat(timespec='seconds')}
+    t_start = time.perf_counter()
+
+    try:
+        # # this job's training_summary rows go in their own csv (merged by the parent)
+        summary_name = f"{job_kwargs['exp_name']}_training_summary_job{job_index}.csv"
+        if model_type == 'rnn':
+            from train.train_STM_RNN import train_model
+            training_info, sim_dict = train_model(summary_name=summary_name, **job_kwargs)
+        else:
+            from train.train_model import train_model
+            training_info, sim_dict = train_model(summary_name=summary_name, **job_kwargs)
+
+        # # train_model() saves the summary in the experiment folder, and returns from there
+        entry['job_summary_path'] = os.path.abspath(summary_name)
+
+        # # stacked models (n_stacked > 1) give a list of sim_dicts
+        sim_dict_list = sim_dict if isinstance(sim_dict, list) else [sim_dict]
+
+        entry['sim_dict_path'] = []
+        entry['trained_for'] = []
+        entry['end_loss'] = []
+        entry['gha_dict_path'] = []
+        for sim_dict in sim_dict_list:
+            if model_type == 'rnn':
+                sim_dict_path = sim_dict['training_info']['sim_dict_path']
+            else:
+                sim_dict_path = os.path.join(sim_dict['topic_info']['exp_cond_path'],
+                                             sim_dict['training_info']['sim_dict_name'])
+            entry['sim_dict_path'].append(sim_dict_path)
+            entry['trained_for'].append(sim_dict['training_info']['trained_for'])
+            entry['end_loss'].append(sim_dict['training_info']['loss'])
+
+            gha_dict_path = None
+            if 'gha' in chain:
+                if model_type == 'rnn':
+                    from GHA.RNN_GHA import rnn_gha
+                    gha_dict = rnn_gha(sim_dict_path, **chain_kwargs.get('gha', {}))
+                else:
+                    from GHA.ff_GHA import ff_gha
+                    gha_info, gha_dict = ff_gha(sim_dict_path, **chain_kwargs.get('gha', {}))
+                gha_dict_path = gha_dict['GHA_info']['gha_dict_path']
+                entry['gha_dict_path'].append(gha_dict_path)
+
+            if 'sel' in chain:
+                if model_type == 'rnn':
+                    from Selectivity.RNN_sel import rnn_sel
+                    rnn_sel(gha_dict_path, **chain_kwargs.get('sel', {}))
+                else:
+                    from Selectivity.ff_sel import ff_sel
+                    ff_sel(gha_dict_path, **chain_kwargs.get('sel', {}))
+
+            if 'lesion' in chain:
+                from lesion.lesion import lesion_2020
+                lesion_2020(gha_dict_path, **chain_kwargs.get('lesion', {}))
+
+        entry['status'] = 'done'
+
+    except Exception as e:
+        entry['status'] = 'failed'
+        entry['error'] = repr(e)
+        entry['traceback'] = traceback.format_exc()
+
+    entry['run_time'] = time.perf_counter() - t_start
+
+    return entry
+
+
+def merge_training_summary(job_summary_path, summary_path):
+    """
+    Add a job's training_summary rows to the sweep's training_summary csv, then delete the job's csv.
+    Headers are only written if summary_path is a new file.
+
+    :param job_summary_path: csv written by one job
+    :param summary_path: {exp_name}_training_summary.csv
+    """
+    with open(job_summary_path, 'r', newline='') as fp:
+        rows = list(csv.reader(fp))
+
+    if os.path.isfile(summary_path):
+        rows = rows[1:]
+
+    with open(summary_path, 'a', newline='') as fp:
+        csv.writer(fp).writerows(rows)
+
+    os.remove(job_summary_path)
+
+
+def run_sweep(job_list, manifest_path,
+              model_type='ff',
+              chain=(),
+              chain_kwargs=None,
+              n_workers=None,
+              tf_threads=1,
+              verbose=True):
+    """
+    Run train_model (then optionally GHA, selectivity, lesion) for each job, across a process pool.
+
+    :param job_list: list of train_model kwargs dicts (e.g., from make_sweep_grid())
+    :param manifest_path: path to json manifest of results (re-used to skip finished jobs)
+    :param model_type: 'ff' (train/train_model.py) or 'rnn' (train/train_STM_RNN.py)
+    :param chain: analysis steps to run after training, any of ('gha', 'sel', 'lesion').
+                  'sel' and 'lesion' need 'gha'.  There is no lesion script for rnns.
+    :param chain_kwargs: dict of kwargs for each step, e.g., {'gha': {'use_dataset': 'test_set'}}
+    :param n_workers: number of processes (default: n_cpus // tf_threads)
+    :param tf_threads: max intra/inter op threads per worker
+    :param verbose: how much to print to screen
+
+    :return: manifest: list of dicts, one per job (status, paths, error if failed).
+        Paths etc are lists, with one value per trained model (more than one if n_stacked > 1).
+    """
+    print("\n**** run_sweep() ****")
+
+    chain = tuple(chain)
+    for step in chain:
+        if step not in sweep_steps:
+            raise ValueError(f"chain step '{step}' not in {sweep_steps}")
+    if ('sel' in chain or 'lesion' in chain) and 'gha' not in chain:
+        raise ValueError("'sel' and 'lesion' need 'gha' in the chain")
+    if model_type == 'rnn' and 'lesion' in chain:
+        raise ValueError("lesion is not available for rnn models")
+
+    if chain_kwargs is None:
+        chain_kwargs = dict()
+
+    if n_workers is None:
+        n_workers = max(1, multiprocessing.cpu_count() // tf_threads)
+
+    # # load manifest to skip finished jobs
+    manifest = [None] * len(job_list)
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, 'r') as fp:
+            for entry in json.load(fp):
+                # # compare as json, e.g., tuples are saved as lists
+                if entry['job'] < len(job_list) and \
+                        entry['kwargs'] == json.loads(json.dumps(job_list[entry['job']], default=str)):
+                    manifest[entry['job']] = entry
+
+    to_run = [i for i, entry in enumerate(manifest) if entry is None or entry['status'] != 'done']
+
+    if verbose:
+        print(f"{len(job_list)} jobs, {len(job_list) - len(to_run)} already done, "
+              f"running {len(to_run)} on {n_workers} workers ({tf_threads} TF threads each)")
+
+    def save_manifest():
+        with open(manifest_path, 'w') as fp:
+            json.dump([entry for entry in manifest if entry is not None], fp, indent=4,
+                      separators=(',', ':'), default=str)
+
+    # # spawn, as TF isn't fork-safe
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_sweep_worker, initargs=(tf_threads,)) as pool:
+        futures = [pool.submit(_run_sweep_job, i, job_list[i], model_type, chain, chain_kwargs)
+                   for i in to_run]
+
+        for future in as_completed(futures):
+            entry = future.result()
+
+            # # only the parent writes to the sweep's training_summary
+            job_summary_path = entry.pop('job_summary_path', None)
+            if job_summary_path is not None and os.path.isfile(job_summary_path):
+                summary_path = os.path.join(os.path.dirname(job_summary_path),
+                                            f"{entry['kwargs']['exp_name']}_training_summary.csv")
+                merge_training_summary(job_summary_path, summary_path)
+                entry['training_summary_path'] = summary_path
+
+            manifest[entry['job']] = entry
+            save_manifest()
+
+            if verbose:
+                print(f"job {entry['job']}: {entry['status']} ({entry['run_time']:.1f}s)")
+                if entry['status'] == 'failed':
+                    print(entry['traceback'])
+
+    if verbose:
+        n_failed = sum(1 for entry in manifest if entry is not None and entry['status'] == 'failed')
+        focussed_dict_print({'manifest_path': manifest_path, 'n_jobs': len(job_list),
+                             'n_failed': n_failed}, 'sweep')
+
+    return manifest
+
+
+######################
+# job_list = make_sweep_grid(base_kwargs={'exp_name': 'sweep_test',
+#                                         'data_dict_path': '/home/nm13850/Documents/PhD/python_v2/datasets/'
+#                                                           'objects/ShapeNet/ShapeNet_data_dict.txt',
+#                                         'model_path': 'mlps/fc2',
+#                                         'max_epochs': 100},
+#                            grid={'act_func': ['relu', 'sigmoid'],
+#                                  'units_per_layer': [10, 100]},
+#                            n_runs=3)
+#
+# manifest = run_sweep(job_list, manifest_path='sweep_test_manifest.json',
+#                      chain=('gha', 'sel', 'lesion'),
+#                      tf_threads=2)
@@ -8,14 +8,15 @@ import numpy as np
 import tensorflow as tf
 from tensorflow.keras.optimizers import Adam, SGD, RMSprop, Adagrad, Adadelta, Adamax, Nadam
 
-from tensorflow.python.keras.callbacks import Callback, TensorBoard
+from tensorflow.python.keras.callbacks import TensorBoard
 from keras.preprocessing.image import ImageDataGenerator
 import matplotlib.pyplot as plt
-import tensorflow.keras.backend as K
 
 from tensorflow.python.framework import ops
 from tensorflow.python.keras.optimizer_v2 import optimizer_v2
 from tensorflow.python.ops import array_ops
+from tensorflow.python.ops import clip_ops
+from tensorflow.python.ops import control_flow_ops
 from tensorflow.python.ops import resource_variable_ops
 from tensorflow.python.training import training_ops
 
@@ -25,7 +26,9 @@ from sklearn.preprocessing import MinMaxScaler
 from tools.dicts import load_dict, focussed_dict_print, print_nested_round_floats
 from tools.data import find_path_to_dir, switch_home_dirs, running_on_laptop
 from tools.network import get_model_dict, get_scores
-from tools.RNN_STM import generate_STM_RNN_seqs, get_label_seqs, get_test_scores, free_rec_acc
+from tools.callbacks import TrainingStatsCallback
+from tools.RNN_STM import make_STM_RNN_dataset, get_label_seqs, get_test_scores, free_rec_acc, \
+    seq_IoU, seq_corr
 from models.rnns import Bowers14rnn, SimpleRNNn, Bowers_14_Elman, Bowers_14_Elman2, GRUn, LSTMn, Seq2Seq
 
 
@@ -43,6 +46,7 @@ class dougsMomentum(optimizer_v2.OptimizerV2):
 
 
         Has a momentum term similar to SGD, but previous update clipped to 1.
+        (As implemented, the weights are clipped to [-1, 1] before each momentum update, in-graph.)
         instead of:
               v(t+1) = momentum * v(t) - learning_rate * gradient
         uses:
@@ -86,29 +90,33 @@ class dougsMomentum(optimizer_v2.OptimizerV2):
                         self._get_hyper("momentum", var_dtype))
 
     def _resource_apply_dense(self, grad, var, apply_state=None):
-        # # here is the change from SGD with momentum
-        # print(f"orig var: {var}")
-        K.set_value(var, K.clip(var, min_value=-1.0, max_value=1.0))
-        # print(f"set var: {var}")
-
+        # # here is the change from SGD with momentum: var is clipped to [-1, 1] before the update.
+        # # All in-graph (no K.set_value round trip), the clip is fused with the momentum update
+        # # and only uses XLA-compilable ops.  Same results as:
+        # #     var = clip(var, -1, 1)
+        # #     m = momentum * m - lr * grad
+        # #     var = var + m    (nesterov: var + (momentum * m - lr * grad))
+        # # Checked against the old K.set_value clip + training_ops kernels (float32, 100 steps,
+        # # with and without momentum/nesterov): weights and momentum match exactly.
         var_device, var_dtype = var.device, var.dtype.base_dtype
         coefficients = ((apply_state or {}).get((var_device, var_dtype))
                         or self._fallback_apply_state(var_device, var_dtype))
 
+        lr_t = coefficients["lr_t"]
+        clipped_var = clip_ops.clip_by_value(var, -1.0, 1.0)
 
         if self._momentum:
             momentum_var = self.get_slot(var, "momentum")
-            return training_ops.resource_apply_keras_momentum(
-                var.handle,
-                momentum_var.handle,
-                coefficients["lr_t"],
-                grad,
-                coefficients["momentum"],
-                use_locking=self._use_locking,
-                use_nesterov=self.nesterov)
+            momentum_t = coefficients["momentum"] * momentum_var - lr_t * grad
+            momentum_update = momentum_var.assign(momentum_t, use_locking=self._use_locking)
+            if self.nesterov:
+                var_t = clipped_var + (coefficients["momentum"] * momentum_t - lr_t * grad)
+            else:
+                var_t = clipped_var + momentum_t
+            var_update = var.assign(var_t, use_locking=self._use_locking)
+            return control_flow_ops.group(var_update, momentum_update)
         else:
-            return training_ops.resource_apply_gradient_descent(
-              var.handle, coefficients["lr_t"], grad, use_locking=self._use_locking)
+            return var.assign(clipped_var - lr_t * grad, use_locking=self._use_locking).op
 
     def _resource_apply_sparse_duplicate_indices(self, grad, var, indices,
                                                    **kwargs):
@@ -151,32 +159,6 @@ class dougsMomentum(optimizer_v2.OptimizerV2):
         return config
 
 
-# # reset hidden sate to .5 for training like lens
-initial_state = .5
-
-class SetHiddedStatesCallback(Callback):
-    # def on_epoch_begin(self, epoch, logs):
-    def on_train_batch_begin(self, batch, logs=None):
-        # print(f"\norig_states: {K.eval(self.model.layers[0].states)}")
-
-        # #I need to to set the state at .5
-        # state_shape = K.shape(self.model.layers[0].states)
-        # print(f"state_shape: {state_shape}\n"
-        #       f"I can use state_shape[1] and [2] to give new_states shape"
-        #       f"{state_shape[0]} {state_shape[1]} {state_shape[2]}")
-
-        # # make array to set as new state including initial_state
-        new_states = np.full((1, 200), initial_state)
-        self.model.layers[0].reset_states(new_states)
-
-        # print(f"\nnew_states: {K.eval(self.model.layers[0].states)}")
-
-
-
-
-
-
-
 def train_model(exp_name,
                 data_dict_path,
                 model_path,
@@ -203,7 +185,9 @@ def train_model(exp_name,
                 lr=0.001,
                 unroll=False,
                 LENS_states=False,
+                seed=None,
                 exp_root='/home/nm13850/Documents/PhD/python_v2/experiments/',
+                summary_name=None,
                 verbose=False,
                 test_run=False
                 ):
@@ -261,7 +245,12 @@ def train_model(exp_name,
     :param init_range: Range for random uniform intializer (+/-, e.g., from 1 to -1)
     :param lr: set the learning rate for the optimizer
     :param unroll:  Whether to unroll the model.
+    :param LENS_states: if True (or a value), hidden states start each sequence at .5 (or value),
+                        as in LENS.  Set in the rnn layers (see models.rnns.get_rnn_layer).
+    :param seed: if not None, seed for the generated training data (reproducible batches).
     :param exp_root: root directory for saving experiments
+    :param summary_name: csv (in the experiment folder) to add this training_info to.
+                        Default is f"{exp_name}_training_summary.csv"
 
     :param verbose: if 0, not verbose; if 1 - print basics; if 2, print all
 
@@ -337,8 +326,8 @@ def train_model(exp_name,
         n_items = np.shape(x_train)[0]
     else:
         # # if generator is true
-        x_data_path = 'RNN_STM_tools/generate_STM_RNN_seqs'
-        y_data_path = 'RNN_STM_tools/generate_STM_RNN_seqs'
+        x_data_path = 'RNN_STM_tools/make_STM_RNN_dataset'
+        y_data_path = 'RNN_STM_tools/make_STM_RNN_dataset'
         n_items = 'unknown'
 
 
@@ -392,9 +381,12 @@ def train_model(exp_name,
         print("\nloading a recurrent model")
         augmentation = False
 
+        # # LENS_states: hidden states start at .5 (or LENS_states value) for each sequence.
+        # # This is set in-graph by the rnn layers (any batch size), not with a stateful model.
         stateful = False
-        if LENS_states != False:
-            stateful = True
+        init_state_kwargs = dict()
+        if LENS_states:
+            init_state_kwargs['initial_state'] = .5 if LENS_states is True else LENS_states
 
         print(f"\nserial_recall: {serial_recall}\n"
               f"y_1hot: {y_1hot}\n"
@@ -423,7 +415,8 @@ def train_model(exp_name,
                                               weight_init=weight_init,
                                               init_range=init_range,
                                               unroll=unroll,
-                                              stateful=stateful)
+                                              stateful=stateful,
+                                              **init_state_kwargs)
     else:
         print("model_dir not recognised")
 
@@ -471,8 +464,12 @@ def train_model(exp_name,
     if y_1hot:
         main_metric = 'categorical_accuracy'
 
+    # # in-graph IoU scores (as in get_test_scores) for class outputs
+    use_metrics = [main_metric]
+    if output_type == 'classes':
+        use_metrics = [main_metric, seq_IoU, seq_corr]
 
-    model.compile(loss=loss_func, optimizer=this_optimizer,  metrics=[main_metric])
+    model.compile(loss=loss_func, optimizer=this_optimizer,  metrics=use_metrics)
 
     optimizer_details = model.optimizer.get_config()
     # print_nested_round_floats(model_details)
@@ -526,8 +523,11 @@ def train_model(exp_name,
     callbacks_list = [early_stop_plateau, checkpointer, tensorboard]
     val_callbacks_list = [val_early_stop_plateau, checkpointer, tensorboard]
 
-    if LENS_states:
-        callbacks_list = [early_stop_plateau, checkpointer, tensorboard, SetHiddedStatesCallback()]
+    # # record time, throughput and memory
+    # # (input_data is added below for the tf.data pipeline, to probe input cost)
+    train_stats_cb = TrainingStatsCallback(batch_size=batch_size)
+    callbacks_list.append(train_stats_cb)
+    val_callbacks_list.append(train_stats_cb)
 
     ############################
     # # train model
@@ -564,24 +564,26 @@ def train_model(exp_name,
             fit_model = model.fit(x_train, y_train,
                                   epochs=max_epochs, batch_size=batch_size, verbose=1, callbacks=callbacks_list)
         else:
-            # # use generator
+            # # use generator (tf.data pipeline)
             print("Using data generator")
-            generate_data = generate_STM_RNN_seqs(data_dict=data_dict,
-                                                  seq_len=timesteps,
-                                                  batch_size=batch_size,
-                                                  serial_recall=serial_recall,
-                                                  output_type=output_type,
-                                                  x_data_type=x_data_type,
-                                                  end_seq_cue=end_seq_cue,
-                                                  train_cycles=train_cycles,
-                                                  verbose=False  # verbose
-                                                  )
-
-            fit_model = model.fit_generator(generate_data,
-                                            steps_per_epoch=100,
-                                            epochs=max_epochs,
-                                            callbacks=callbacks_list,
-                                            shuffle=False)
+            generate_data = make_STM_RNN_dataset(data_dict=data_dict,
+                                                 seq_len=timesteps,
+                                                 batch_size=batch_size,
+                                                 serial_recall=serial_recall,
+                                                 output_type=output_type,
+                                                 x_data_type=x_data_type,
+                                                 end_seq_cue=end_seq_cue,
+                                                 train_cycles=train_cycles,
+                                                 seed=seed,
+                                                 verbose=False  # verbose
+                                                 )
+            train_stats_cb.input_data = generate_data
+
+            fit_model = model.fit(generate_data,
+                                  steps_per_epoch=100,
+                                  epochs=max_epochs,
+                                  callbacks=callbacks_list,
+                                  shuffle=False)
 
     ########################################################
     print("\n**** TRAINING COMPLETE ****")
@@ -625,6 +627,9 @@ def train_model(exp_name,
     if use_val_data:
         print(f'end val loss: {end_val_loss}\nend val acc: {end_val_acc}')
 
+    train_stats = train_stats_cb.get_summary()
+    focussed_dict_print(train_stats, 'train_stats')
+
 
     # # # # PART 3 get_scores() # # #
     """accuracy can be two things
@@ -704,7 +709,8 @@ def train_model(exp_name,
                               'timesteps': timesteps,
                               'unroll': unroll,
                               'y_1hot': y_1hot,
-                              'LENS_states': LENS_states}
+                              'LENS_states': LENS_states,
+                              'seed': seed}
 
     git_repository = '/home/nm13850/Documents/PhD/code/library'
     if os.path.isdir('/Users/nickmartin/Documents/PhD/code/library'):
@@ -733,6 +739,8 @@ def train_model(exp_name,
                                   'sim_dict_path': sim_dict_path,
                                   'tensorboard_path': tensorboard_path,
                                   'commit': repo.head.object.hexsha,
+                                  'train_stats': train_stats,
+                                  'epoch_stats': train_stats_cb.epoch_stats,
                                   }
                 }
 
@@ -769,8 +777,10 @@ def train_model(exp_name,
                      use_val_data, loss_target, min_loss_change,
                      max_epochs, trained_for, end_acc, end_loss, end_val_acc, end_val_loss,
                      checkpoint_path, trained_date, trained_time, mean_IoU, prop_seq_corr,
-                     unroll, y_1hot, LENS_states
-
+                     unroll, y_1hot, LENS_states,
+                     train_stats['train_time'], train_stats['epoch_time'],
+                     train_stats['steps_per_sec'], train_stats['items_per_sec'],
+                     train_stats['input_cost_frac'], train_stats['peak_rss_mb'],
                      ]
 
 
@@ -784,8 +794,11 @@ def train_model(exp_name,
     print(f"save_summaries: {exp_path}")
 
 
+    if summary_name is None:
+        summary_name = f"{exp_name}_training_summary.csv"
+
     # check if training_info.csv exists
-    if not os.path.isfile(f"{exp_name}_training_summary.csv"):
+    if not os.path.isfile(summary_name):
 
         headers = ["file", "cond", "run",
                    "dataset", "x_size", "n_cats", 'timesteps', "n_items",
@@ -801,13 +814,15 @@ def train_model(exp_name,
                    "val_data", "loss_target", "min_loss_change",
                    "max_epochs", "trained_for", "end_acc", "end_loss", "end_val_acc", "end_val_loss",
                    "model_file", "date", "time", "mean_IoU", "prop_seq_corr",
-                   "unroll", "y_1hot", "LENS_states"]
+                   "unroll", "y_1hot", "LENS_states",
+                   "train_time", "epoch_time", "steps_per_sec", "items_per_sec",
+                   "input_cost_frac", "peak_rss_mb"]
 
-        training_overview = open(f"{exp_name}_training_summary.csv", 'w')
+        training_overview = open(summary_name, 'w')
         mywriter = csv.writer(training_overview)
         mywriter.writerow(headers)
     else:
-        training_overview = open(f"{exp_name}_training_summary.csv", 'a')
+        training_overview = open(summary_name, 'a')
         mywriter = csv.writer(training_overview)
 
     mywriter.writerow(training_info)
@@ -823,4 +838,4 @@ def train_model(exp_name,
     print("\ntrain_model() finished")
 
 
-    return sim_dict
+    return training_info, sim_dict
@@ -9,7 +9,6 @@ import numpy as np
 import tensorflow as tf
 
 from tensorflow.keras.optimizers import Adam, SGD, RMSprop
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 # from tensorflow.keras.utils.np_utils import to_categorical
 from tensorflow.keras.utils import to_categorical
 from tensorflow.python.keras.callbacks import TensorBoard
@@ -20,12 +19,14 @@ from sklearn.preprocessing import MinMaxScaler
 from tools.dicts import load_dict, focussed_dict_print, print_nested_round_floats
 from tools.data import load_x_data, load_y_data, switch_home_dirs
 from tools.network import get_model_dict, get_scores
+from tools.callbacks import TrainingStatsCallback, StackedBestWeights
+from tools.image_aug import make_augmented_dataset
 
 from models.cnns import con6_pool3_fc1, con2_pool2_fc1, con4_pool2_fc1, \
     con4_pool2_fc1_reluconv, con4_pool2_fc1_noise_layer, con2_pool2_fc1_reluconv, \
     conv1_pool1_fc1_reluconv
 from models.rnns import Bowers14rnn, SimpleRNNn, GRUn, LSTMn, Seq2Seq
-from models.mlps import mlp, fc1, fc2, fc4
+from models.mlps import mlp, fc1, fc2, fc4, stacked_mlp, stacked_loss, stacked_metrics, split_stacked_mlp
 
 
 '''following coding tips session with Ben'''
@@ -53,7 +54,9 @@ def train_model(exp_name,
                 use_batch_norm=False, use_dropout=0.0,
                 use_val_data=True,
                 timesteps=1,
+                n_stacked=1,
                 exp_root='/home/nm13850/Documents/PhD/python_v2/experiments/',
+                summary_name=None,
                 verbose=False,
                 test_run=False,
                 ):
@@ -94,12 +97,18 @@ def train_model(exp_name,
     :param use_dropout: use dropout
     :param use_val_data: use validation set (either separate set, or train/val split)
     :param timesteps: if RNN length of sequence
+    :param n_stacked: if > 1, train this many copies of an mlp (different initial weights) together,
+                        as one stacked model (models/mlps.stacked_mlp).  Each copy is then saved as
+                        its own model (output_filename_m0, _m1...) with its own scores and training_info.
     :param exp_root: root directory for saving experiments
+    :param summary_name: csv (in the experiment folder) to add this training_info to.
+                        Default is f"{exp_name}_training_summary.csv"
 
     :param verbose: if 0, not verbose; if 1 - print basics; if 2, print all
 
     :return: training_info csv
     :return: sim_dict with dataset info, model info and training info
+        (if n_stacked > 1, lists of training_info and sim_dict, one per model)
 
     """
 
@@ -284,7 +293,21 @@ def train_model(exp_name,
 
 
     # # The Model
-    if model_dir in ['mlp', 'mlps']:
+    if n_stacked > 1:
+        if model_dir not in ['mlp', 'mlps'] or model_name != 'mlp':
+            raise ValueError(f"n_stacked is only available for mlps/mlp, not {model_path}")
+
+        print(f"\nloading {n_stacked} stacked mlp models")
+        augmentation = False
+        mlp_kwargs = {'features': x_size, 'classes': n_cats,
+                      'n_layers': n_layers, 'units_per_layer': units_per_layer,
+                      'act_func': act_func, 'use_bias': use_bias,
+                      'y_1hot': y_1hot, 'output_act': output_act,
+                      'weight_init': weight_init,
+                      'batch_norm': use_batch_norm, 'dropout': use_dropout}
+        model = stacked_mlp.build(n_models=n_stacked, **mlp_kwargs)
+
+    elif model_dir in ['mlp', 'mlps']:
         print("\nloading an mlp model")
         augmentation = False
         model_dict = {'mlp': mlp,
@@ -381,11 +404,19 @@ def train_model(exp_name,
 
 
     # # compile model
-    model.compile(loss=loss_func, optimizer=this_optimizer, metrics=['acc'])
+    if n_stacked > 1:
+        # # sum of each model's loss, with loss and acc per model (loss_m0, acc_m0...)
+        model.compile(loss=stacked_loss(loss_func), optimizer=this_optimizer,
+                      metrics=stacked_metrics(loss_func, n_stacked))
+    else:
+        model.compile(loss=loss_func, optimizer=this_optimizer, metrics=['acc'])
 
 
     # # get model dict
-    model_info = get_model_dict(model)  # , verbose=True)
+    if n_stacked > 1:
+        model_info = get_model_dict(mlp.build(**mlp_kwargs))
+    else:
+        model_info = get_model_dict(model)  # , verbose=True)
     # print("\nmodel_info:")
     print_nested_round_floats(model_info, 'model_info')
     tf.compat.v1.keras.utils.plot_model(model, to_file=f'{model_name}_diag.png', show_shapes=True)
@@ -450,30 +481,44 @@ def train_model(exp_name,
     callbacks_list = [early_stop_plateau, checkpointer, tensorboard]
     val_callbacks_list = [val_early_stop_plateau, checkpointer, tensorboard]
 
+    if n_stacked > 1:
+        # # keep each model's weights from its own best epoch, instead of checkpointing the stack
+        stacked_best = StackedBestWeights(n_models=n_stacked, monitor=checkpoint_mon)
+        callbacks_list = [early_stop_plateau, stacked_best, tensorboard]
+        val_callbacks_list = [val_early_stop_plateau, stacked_best, tensorboard]
+
     ############################
     # # train model
     print("\n**** TRAINING ****")
     if augmentation:
-        # # construct the image generator for data augmentation
-        aug = ImageDataGenerator(rotation_range=10,  # randomly rotate images in the range (degrees, 0 to 180)
-                                 width_shift_range=0.1,  # randomly shift images horizontally (fraction of total width)
-                                 height_shift_range=0.1,  # randomly shift images vertically (fraction of total height)
-                                 shear_range=0.1,  # set range for random shear (tilt image)
-                                 zoom_range=0.1,  # set range for random zoom
-                                 # horizontal_flip=True,
-                                 fill_mode="nearest")
+        # # data augmentation in a tf.data pipeline (same ranges as the old ImageDataGenerator)
+        aug_data = make_augmented_dataset(x_train, y_train, batch_size=batch_size,
+                                          rotation_range=10,  # randomly rotate images in the range (degrees, 0 to 180)
+                                          width_shift_range=0.1,  # randomly shift images horizontally (fraction of total width)
+                                          height_shift_range=0.1,  # randomly shift images vertically (fraction of total height)
+                                          shear_range=0.1,  # set range for random shear (tilt image)
+                                          zoom_range=0.1,  # set range for random zoom
+                                          fill_mode="nearest")
+
+        # # record time, throughput and memory (probe the augmentation pipeline for input cost)
+        train_stats_cb = TrainingStatsCallback(batch_size=batch_size, input_data=aug_data)
+        callbacks_list.append(train_stats_cb)
+        val_callbacks_list.append(train_stats_cb)
 
         if use_val_data:
-            fit_model = model.fit_generator(aug.flow(x_train, y_train, batch_size=batch_size),
-                                            validation_data=(x_val, y_val),
-                                            # steps_per_epoch=len(x_train) // batch_size,
-                                            epochs=max_epochs, verbose=1, callbacks=val_callbacks_list)
+            fit_model = model.fit(aug_data,
+                                  validation_data=(x_val, y_val),
+                                  epochs=max_epochs, verbose=1, callbacks=val_callbacks_list)
         else:
-            fit_model = model.fit_generator(aug.flow(x_train, y_train, batch_size=batch_size),
-                                            # steps_per_epoch=len(x_train) // batch_size,
-                                            epochs=max_epochs, verbose=1, callbacks=callbacks_list)
+            fit_model = model.fit(aug_data,
+                                  epochs=max_epochs, verbose=1, callbacks=callbacks_list)
 
     else:
+        # # record time, throughput and memory (data is in memory, so no input probe)
+        train_stats_cb = TrainingStatsCallback(batch_size=batch_size)
+        callbacks_list.append(train_stats_cb)
+        val_callbacks_list.append(train_stats_cb)
+
         if use_val_data:
             fit_model = model.fit(x_train, y_train,
                                   validation_data=(x_val, y_val),
@@ -486,17 +531,100 @@ def train_model(exp_name,
     ############################################
 
     print("\n**** TRAINING COMPLETE ****")
+
+    # # split stacked models, then record each model (or just the one model) in turn
+    if n_stacked > 1:
+        member_models = split_stacked_mlp(model, member_weights=stacked_best.member_weights, **mlp_kwargs)
+        stacked_filename = output_filename
+        stacked_run = run
+        stacked_history = fit_model.history
+    else:
+        member_models = [model]
+    fit_history = fit_model.history
+
+    # # settings needed to record each trained model
+    record_kwargs = {'exp_name': exp_name, 'cond_name': cond_name, 'cond': cond,
+                     'data_dict_path': data_dict_path, 'data_dict': data_dict, 'dset_name': dset_name,
+                     'model_path': model_path, 'model_dir': model_dir, 'model_name': model_name,
+                     'exp_cond_path': exp_cond_path, 'x_data': x_data, 'y_df': y_df,
+                     'x_data_path': x_data_path, 'y_data_path': y_data_path, 'x_size': x_size,
+                     'width': width, 'height': height, 'n_cats': n_cats, 'n_items': n_items,
+                     'timesteps': timesteps, 'n_layers': n_layers, 'units_per_layer': units_per_layer,
+                     'act_func': act_func, 'use_bias': use_bias, 'y_1hot': y_1hot, 'output_act': output_act,
+                     'weight_init': weight_init, 'use_optimizer': use_optimizer, 'lr': lr,
+                     'loss_func': loss_func, 'max_epochs': max_epochs, 'batch_size': batch_size,
+                     'use_batch_norm': use_batch_norm, 'use_dropout': use_dropout,
+                     'use_val_data': use_val_data, 'augmentation': augmentation, 'grey_image': grey_image,
+                     'loss_target': loss_target, 'min_loss_change': min_loss_change, 'n_stacked': n_stacked,
+                     'train_stats_cb': train_stats_cb, 'tensorboard_path': tensorboard_path,
+                     'summary_name': summary_name, 'verbose': verbose}
+
+    all_training_info = []
+    all_sim_dicts = []
+    for member, model in enumerate(member_models):
+
+        if n_stacked > 1:
+            # # each model is saved and recorded as if it was trained alone
+            output_filename = f"{stacked_filename}_m{member}"
+            checkpoint_path = f'{output_filename}_model.hdf5'
+            if stacked_run is not None:
+                run = stacked_run * n_stacked + member
+            fit_history = {key: stacked_history[f'{key}_m{member}'] for key in ['loss', 'acc']}
+            if use_val_data:
+                fit_history['val_loss'] = stacked_history[f'val_loss_m{member}']
+                fit_history['val_acc'] = stacked_history[f'val_acc_m{member}']
+
+            model_info = dict(model_info)
+            model.compile(loss=loss_func, optimizer=this_optimizer, metrics=['acc'])
+            os.chdir(exp_cond_path)
+            model.save(checkpoint_path)
+            print(f"\nstacked model {member}: {checkpoint_path}")
+
+        training_info, sim_dict = _record_trained_model(model, fit_history, output_filename, checkpoint_path,
+                                                        run, model_info, **record_kwargs)
+
+        all_training_info.append(training_info)
+        all_sim_dicts.append(sim_dict)
+
+    if n_stacked > 1:
+        return all_training_info, all_sim_dicts
+
+    return training_info, sim_dict
+
+
+def _record_trained_model(model, fit_history, output_filename, checkpoint_path, run, model_info,
+                          exp_name, cond_name, cond, data_dict_path, data_dict, dset_name, model_path,
+                          model_dir, model_name, exp_cond_path, x_data, y_df, x_data_path, y_data_path,
+                          x_size, width, height, n_cats, n_items, timesteps, n_layers, units_per_layer,
+                          act_func, use_bias, y_1hot, output_act, weight_init, use_optimizer, lr, loss_func,
+                          max_epochs, batch_size, use_batch_norm, use_dropout, use_val_data, augmentation,
+                          grey_image, loss_target, min_loss_change, n_stacked, train_stats_cb,
+                          tensorboard_path, summary_name, verbose):
+    """
+    Plot, score and save one trained model (sim_dict, scores and a row of the training_summary csv).
+    Called by train_model() for the model, or for each model split from a stacked model.
+
+    :param model: trained model
+    :param fit_history: dict of 'loss', 'acc' (and 'val_loss', 'val_acc') per epoch
+    :param output_filename: name for this model's output files
+    :param checkpoint_path: path of the saved model
+    :param run: run number for this model
+    :param model_info: model dict (from get_model_dict), overview is added here
+    other params are the settings and data from train_model()
+
+    :return: training_info (training_summary row), sim_dict
+    """
     # # plot the training loss and accuracy
     fig, (ax1, ax2) = plt.subplots(2, sharex=True)
-    ax1.plot(fit_model.history['acc'])
+    ax1.plot(fit_history['acc'])
     if use_val_data:
-        ax1.plot(fit_model.history['val_acc'])
+        ax1.plot(fit_history['val_acc'])
     ax1.set_title('model accuracy (top); loss (bottom)')
     ax1.set_ylabel('accuracy')
     ax1.set_xlabel('epoch')
-    ax2.plot(fit_model.history['loss'])
+    ax2.plot(fit_history['loss'])
     if use_val_data:
-        ax2.plot(fit_model.history['val_loss'])
+        ax2.plot(fit_history['val_loss'])
     ax2.set_ylabel('loss')
     ax2.set_xlabel('epoch')
     fig.legend(['train', 'val'], loc='upper left')
@@ -508,22 +636,25 @@ def train_model(exp_name,
 
     # # get best epoch
     if use_val_data:
-        print(fit_model.history['val_loss'])
-        trained_for = int(fit_model.history['val_loss'].index(min(fit_model.history['val_loss'])))
-        end_val_loss = float(fit_model.history['val_loss'][trained_for])
-        end_val_acc = float(fit_model.history['val_acc'][trained_for])
+        print(fit_history['val_loss'])
+        trained_for = int(fit_history['val_loss'].index(min(fit_history['val_loss'])))
+        end_val_loss = float(fit_history['val_loss'][trained_for])
+        end_val_acc = float(fit_history['val_acc'][trained_for])
     else:
-        print(fit_model.history['loss'])
-        trained_for = int(fit_model.history['loss'].index(min(fit_model.history['loss'])))
+        print(fit_history['loss'])
+        trained_for = int(fit_history['loss'].index(min(fit_history['loss'])))
         end_val_loss = np.nan
         end_val_acc = np.nan
 
-    end_loss = float(fit_model.history['loss'][trained_for])
-    end_acc = float(fit_model.history['acc'][trained_for])
+    end_loss = float(fit_history['loss'][trained_for])
+    end_acc = float(fit_history['acc'][trained_for])
     print(f'\nTraining Info\nbest loss after {trained_for} epochs\n'
           f'end loss: {end_loss}\nend acc: {end_acc}\n'
           f'end val loss: {end_val_loss}\nend val acc: {end_val_acc}')
 
+    train_stats = train_stats_cb.get_summary()
+    focussed_dict_print(train_stats, 'train_stats')
+
 
     # # # PART 3 get_scores() # # #
     # # these three lines are to re-shape MNIST
@@ -569,7 +700,8 @@ def train_model(exp_name,
                               "grey_image": grey_image,
                               "loss_target": loss_target,
                               "min_loss_change": min_loss_change,
-                              'timesteps': timesteps
+                              'timesteps': timesteps,
+                              'n_stacked': n_stacked,
                               }
 
 
@@ -597,6 +729,8 @@ def train_model(exp_name,
                                   'x_data_path': x_data_path, 'y_data_path': y_data_path,
                                   'tensorboard_path': tensorboard_path,
                                   'commit': repo.head.object.hexsha,
+                                  'train_stats': train_stats,
+                                  'epoch_stats': train_stats_cb.epoch_stats,
                                   }
                 }
 
@@ -694,6 +828,9 @@ def train_model(exp_name,
                      max_epochs, trained_for, end_acc, end_loss, end_val_acc, end_val_loss,
                      checkpoint_path, trained_date, trained_time,
                      # var_one, var_two, var_three, var_four, var_five, var_six
+                     train_stats['train_time'], train_stats['epoch_time'],
+                     train_stats['steps_per_sec'], train_stats['items_per_sec'],
+                     train_stats['input_cost_frac'], train_stats['peak_rss_mb'],
                      ]
 
 
@@ -701,8 +838,11 @@ def train_model(exp_name,
     os.chdir(exp_path)
     print(f"save_summaries: {exp_path}")
 
+    if summary_name is None:
+        summary_name = f"{exp_name}_training_summary.csv"
+
     # check if training_info.csv exists
-    if not os.path.isfile(f"{exp_name}_training_summary.csv"):
+    if not os.path.isfile(summary_name):
 
         headers = ["file", "cond", "run",
                    "dataset", "x_size", "n_cats", 'timesteps', "n_items",
@@ -717,13 +857,15 @@ def train_model(exp_name,
                    "max_epochs", "trained_for", "end_acc", "end_loss", "end_val_acc", "end_val_loss",
                    "model_file", "date", "time",
                    # 'V1', 'V2', 'V3', 'V4', 'V5', 'V6'
+                   "train_time", "epoch_time", "steps_per_sec", "items_per_sec",
+                   "input_cost_frac", "peak_rss_mb",
                    ]
 
-        training_overview = open(f"{exp_name}_training_summary.csv", 'w')
+        training_overview = open(summary_name, 'w')
         mywriter = csv.writer(training_overview)
         mywriter.writerow(headers)
     else:
-        training_overview = open(f"{exp_name}_training_summary.csv", 'a')
+        training_overview = open(summary_name, 'a')
         mywriter = csv.writer(training_overview)
 
     mywriter.writerow(training_info)
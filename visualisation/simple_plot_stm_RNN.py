@@ -9,7 +9,7 @@ import matplotlib.pyplot as plt
 from tools.dicts import load_dict, focussed_dict_print, print_nested_round_floats
 from tools.RNN_STM import get_X_and_Y_data_from_seq, seq_items_per_class, spell_label_seqs
 from tools.RNN_STM import word_letter_combo_dict, letter_in_seq
-from tools.data import nick_read_csv, find_path_to_dir
+from tools.data import nick_read_table, find_path_to_dir
 from tools.network import loop_thru_acts
 
 
@@ -160,7 +160,7 @@ def simple_plot_rnn(gha_dict_path,
         # # load item_correct (y_data)
         item_correct_name = gha_dict['GHA_info']['scores_dict']['item_correct_name']
         # y_df = pd.read_csv(item_correct_name)
-        y_scores_df = nick_read_csv(item_correct_name)
+        y_scores_df = nick_read_table(item_correct_name)
 
 
 
@@ -9,7 +9,7 @@ import ptitprince as pt
 from itertools import zip_longest
 
 from tools.dicts import load_dict, focussed_dict_print, print_nested_round_floats
-from tools.data import load_y_data, load_hid_acts, nick_read_csv, find_path_to_dir
+from tools.data import load_y_data, load_hid_acts, nick_read_table, find_path_to_dir
 from tools.network import loop_thru_acts
 
 from tools.RNN_STM import get_X_and_Y_data_from_seq, seq_items_per_class, spell_label_seqs
@@ -135,7 +135,7 @@ def simple_plot(gha_dict_path,
         # # load item_correct (y_data)
         item_correct_name = gha_dict['GHA_info']['scores_dict']['item_correct_name']
         # y_df = pd.read_csv(item_correct_name)
-        y_scores_df = nick_read_csv(item_correct_name)
+        y_scores_df = nick_read_table(item_correct_name)
 
         if verbose:
             print(f"\ny_scores_df: {y_scores_df.shape}\n{y_scores_df.head()}")
@@ -800,7 +800,7 @@ def simple_rain(gha_dict_path,
         # # load item_correct (y_data)
         item_correct_name = gha_dict['GHA_info']['scores_dict']['item_correct_name']
         # y_df = pd.read_csv(item_correct_name)
-        y_scores_df = nick_read_csv(item_correct_name)
+        y_scores_df = nick_read_table(item_correct_name)
 
         if verbose:
             print(f"\ny_scores_df: {y_scores_df.shape}\n{y_scores_df.head()}")